@@ -0,0 +1,643 @@
+"""
+In process stand-ins for docker, etcd, route53 and health check targets used
+by the benchmarks. Everything binds to 127.0.0.1 so that the benchmarks run
+offline.
+"""
+import json
+import random
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.etree import ElementTree
+
+from boto.route53.exception import DNSServerError
+from boto.route53.record import Record, ResourceRecordSets
+from requests import Response
+from requests.exceptions import HTTPError
+
+LOCALHOST = '127.0.0.1'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(server, name):
+    thread = threading.Thread(target=server.serve_forever, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class FakeDockerClient:
+    """
+    Docker client stand-in serving inspect results for a fixed set of
+    containers. The events stream stays open without any events.
+    """
+
+    def __init__(self, containers):
+        """
+        :param containers: Container info (as returned by docker inspect)
+        :type containers: list
+        """
+        self.containers_info = {info['Id']: info for info in containers}
+        self.inspect_count = 0
+
+    def _find(self, container_id):
+        info = self.containers_info.get(container_id)
+        if info:
+            return info
+        for info in self.containers_info.values():
+            if info['Name'].lstrip('/') == container_id.lstrip('/'):
+                return info
+
+    def inspect_container(self, container_id):
+        self.inspect_count += 1
+        info = self._find(container_id)
+        if not info:
+            response = Response()
+            response.status_code = 404
+            raise HTTPError('No such container: %s' % container_id,
+                            response=response)
+        return info
+
+    def containers(self):
+        return [{'Id': container_id} for container_id, info in
+                self.containers_info.items() if info['State']['Running']]
+
+    def events(self):
+        def stream():
+            threading.Event().wait()
+            return
+            yield
+        return stream()
+
+
+def create_container_info(index, public_ports, env=None):
+    """
+    Creates docker inspect output for a discoverable container.
+
+    :param index: Container index (used for id and name)
+    :type index: int
+    :param public_ports: Public port keyed by private port (e.g. 8080)
+    :type public_ports: dict
+    :param env: Additional DISCOVER_* environment
+    :type env: list
+    :rtype: dict
+    """
+    return {
+        'Id': 'bench%059d' % index,
+        'Name': '/bench-app-%d' % index,
+        'Config': {
+            'Env': ['DISCOVER_APP_NAME=bench-app-%d' % index] + (env or []),
+            'ExposedPorts': {'%s/tcp' % port: {} for port in public_ports}
+        },
+        'NetworkSettings': {
+            'Ports': {
+                '%s/tcp' % port: [{'HostIp': '0.0.0.0',
+                                   'HostPort': str(public_port)}]
+                for port, public_port in public_ports.items()
+            }
+        },
+        'State': {
+            'Running': True
+        }
+    }
+
+
+class HealthTargetServer:
+    """
+    HTTP server answering health checks with the configured latency and
+    failure rate (failures are answered with status 500).
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        target = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                target.requests += 1
+                if target.latency:
+                    time.sleep(target.latency)
+                failed = random.random() < target.failure_rate
+                body = b'failed' if failed else b'ok'
+                self.send_response(500 if failed else 200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.server = ThreadingHTTPServer((LOCALHOST, 0), Handler)
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        serve(self.server, 'health-target-%d' % self.port)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class EtcdStore:
+    """
+    Minimal in memory etcd v2 key space supporting TTLs, refresh, the
+    prevExist/prevValue/prevIndex conditions and watches.
+    """
+
+    def __init__(self):
+        self.index = 0
+        self.nodes = {}
+        self.history = []
+        self.operations = {}
+        self.stopped = False
+        # Number of watches currently waiting for events
+        self.watchers = 0
+        self.condition = threading.Condition()
+
+    def count(self, operation):
+        self.operations[operation] = self.operations.get(operation, 0) + 1
+
+    def _node(self, key, node):
+        result = {'key': key, 'value': node['value'],
+                  'modifiedIndex': node['modifiedIndex'],
+                  'createdIndex': node['createdIndex']}
+        if node['expires']:
+            result['ttl'] = max(int(node['expires'] - time.time()), 0)
+            result['expiration'] = time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(node['expires']))
+        return result
+
+    def _record(self, action, key, node, prev_node=None):
+        self.index += 1
+        event = {'action': action, 'node': dict(self._node(key, node),
+                                                modifiedIndex=self.index)}
+        if prev_node:
+            event['prevNode'] = self._node(key, prev_node)
+        self.history.append((self.index, key, event))
+        self.condition.notify_all()
+        return event
+
+    def expire(self):
+        now = time.time()
+        for key, node in list(self.nodes.items()):
+            if node['expires'] and node['expires'] <= now:
+                del self.nodes[key]
+                self._record('expire', key, node, prev_node=node)
+
+    def expire_now(self, key):
+        """
+        Expires the key right away (as if its TTL elapsed).
+        """
+        with self.condition:
+            if key in self.nodes:
+                self.nodes[key] = dict(self.nodes[key], expires=time.time())
+                self.expire()
+
+    def _check(self, key, node, params):
+        prev_exist = params.get('prevExist')
+        if prev_exist == 'false' and node:
+            return 412, error(105, 'Key already exists', key, self.index)
+        if (prev_exist == 'true' or 'prevValue' in params or
+                'prevIndex' in params) and not node:
+            return 404, error(100, 'Key not found', key, self.index)
+        if 'prevValue' in params and node['value'] != params['prevValue']:
+            return 412, error(101, 'Compare failed', key, self.index)
+        if 'prevIndex' in params and \
+                str(node['modifiedIndex']) != params['prevIndex']:
+            return 412, error(101, 'Compare failed', key, self.index)
+        return None
+
+    def put(self, key, params):
+        with self.condition:
+            refresh = params.get('refresh') == 'true'
+            self.count('refresh' if refresh else 'put')
+            self.expire()
+            node = self.nodes.get(key)
+            failure = self._check(key, node, params)
+            if failure:
+                return failure
+            ttl = params.get('ttl')
+            expires = time.time() + int(ttl) if ttl else None
+            if refresh:
+                node = dict(node, expires=expires)
+                self.nodes[key] = node
+                # Refresh does not notify the watchers
+                return 200, {'action': 'update',
+                             'node': self._node(key, node)}
+            new_node = {'value': params.get('value'),
+                        'modifiedIndex': self.index + 1,
+                        'createdIndex': node['createdIndex'] if node
+                        else self.index + 1,
+                        'expires': expires}
+            self.nodes[key] = new_node
+            return (200 if node else 201), self._record(
+                'set' if node else 'create', key, new_node, prev_node=node)
+
+    def delete(self, key, params):
+        with self.condition:
+            self.count('delete')
+            self.expire()
+            node = self.nodes.get(key)
+            if not node:
+                return 404, error(100, 'Key not found', key, self.index)
+            failure = self._check(key, node, params)
+            if failure:
+                return failure
+            del self.nodes[key]
+            return 200, self._record('delete', key, node, prev_node=node)
+
+    def get(self, key, params):
+        with self.condition:
+            self.expire()
+            self.count('get')
+            if params.get('wait') == 'true':
+                return self._wait(key, params)
+            node = self.nodes.get(key)
+            if node:
+                return 200, {'action': 'get', 'node': self._node(key, node)}
+            prefix = key.rstrip('/') + '/'
+            children = [self._node(child_key, child) for child_key, child in
+                        sorted(self.nodes.items())
+                        if child_key.startswith(prefix)]
+            if not children and key != '/':
+                return 404, error(100, 'Key not found', key, self.index)
+            # Leaves are returned flat (no nested directories)
+            return 200, {'action': 'get', 'node': {
+                'key': key, 'dir': True, 'nodes': children}}
+
+    def _matches(self, watched_key, key, recursive):
+        return key == watched_key or \
+            (recursive and key.startswith(watched_key.rstrip('/') + '/'))
+
+    def _wait(self, key, params):
+        recursive = params.get('recursive') == 'true'
+        wait_index = int(params.get('waitIndex', self.index + 1))
+        self.watchers += 1
+        try:
+            while not self.stopped:
+                for index, event_key, event in self.history:
+                    if index >= wait_index and \
+                            self._matches(key, event_key, recursive):
+                        return 200, event
+                # Client side timeout ends the watch
+                self.condition.wait(1)
+                self.expire()
+        finally:
+            self.watchers -= 1
+        return 503, error(300, 'Server stopped', key, self.index)
+
+
+def error(code, message, key, index):
+    return {'errorCode': code, 'message': message, 'cause': key,
+            'index': index}
+
+
+class FakeEtcdServer:
+    """
+    Etcd v2 keys API stand-in served over HTTP (so that the real etcd and
+    yoda clients are exercised).
+    """
+
+    def __init__(self):
+        store = self.store = EtcdStore()
+        cluster_id = uuid.uuid4().hex[:16]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _params(self, query):
+                return {name: values[-1] for name, values in
+                        parse_qs(query, keep_blank_values=True).items()}
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                if url.path == '/version':
+                    # Supports TTL refresh (etcd 2.3+)
+                    self._send(200, {'etcdserver': '2.3.8',
+                                     'etcdcluster': '2.3.0'})
+                    return
+                if not url.path.startswith('/v2/keys'):
+                    self._send(404, {'message': 'Not found'})
+                    return
+                key = url.path[len('/v2/keys'):] or '/'
+                params = self._params(url.query)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    params.update(self._params(
+                        self.rfile.read(length).decode('utf-8')))
+                if params.get('wait') == 'true':
+                    self._stream(*self._watch(key, params))
+                else:
+                    self._send(*method(key, params))
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('X-Etcd-Index', str(store.index))
+                self.send_header('X-Etcd-Cluster-Id', cluster_id)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                try:
+                    self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' %
+                                     (len(data), data))
+                except (BrokenPipeError, ConnectionResetError):
+                    # Watch timed out on the client side
+                    pass
+
+            def _watch(self, key, params):
+                # Like etcd, headers are sent right away and the body once
+                # the event is available
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.send_header('X-Etcd-Index', str(store.index))
+                self.send_header('X-Etcd-Cluster-Id', cluster_id)
+                self.end_headers()
+                self.wfile.flush()
+                return store.get(key, params)
+
+            def do_GET(self):
+                self._handle(store.get)
+
+            def do_PUT(self):
+                self._handle(store.put)
+
+            def do_POST(self):
+                self._handle(store.put)
+
+            def do_DELETE(self):
+                self._handle(store.delete)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((LOCALHOST, 0), Handler)
+        self.port = self.server.server_address[1]
+
+    @property
+    def writes(self):
+        """
+        Number of write requests (put, refresh and delete) received.
+        """
+        operations = self.store.operations
+        return sum(operations.get(operation, 0)
+                   for operation in ('put', 'refresh', 'delete'))
+
+    def start(self):
+        serve(self.server, 'fake-etcd')
+        return self
+
+    def stop(self):
+        with self.store.condition:
+            self.store.stopped = True
+            self.store.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeEtcd3Connection:
+    """
+    In process stand-in for discover.etcd3_leases.Etcd3Connection. Keys are
+    attached to leases which expire unless kept alive.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_lease_id = 1
+        # Expiry time and ttl keyed by lease id
+        self.leases = {}
+        # (value, lease id) keyed by key
+        self.keys = {}
+        self.operations = {}
+
+    def count(self, operation):
+        self.operations[operation] = self.operations.get(operation, 0) + 1
+
+    def expire(self):
+        now = time.time()
+        expired = {lease_id for lease_id, (expires, _ttl) in
+                   self.leases.items() if expires <= now}
+        for lease_id in expired:
+            del self.leases[lease_id]
+        for key, (_value, lease_id) in list(self.keys.items()):
+            if lease_id in expired:
+                del self.keys[key]
+
+    def values(self):
+        with self.lock:
+            self.expire()
+            return {key: value for key, (value, _lease_id) in
+                    self.keys.items()}
+
+    def grant(self, ttl):
+        with self.lock:
+            self.count('grant')
+            lease_id = self.next_lease_id
+            self.next_lease_id += 1
+            self.leases[lease_id] = (time.time() + ttl, ttl)
+            return lease_id
+
+    def put(self, key, value, lease_id=None):
+        with self.lock:
+            self.count('put')
+            self.expire()
+            if lease_id is not None and lease_id not in self.leases:
+                raise ValueError('Lease %s not found' % lease_id)
+            self.keys[key] = (value, lease_id)
+
+    def delete(self, key):
+        with self.lock:
+            self.count('delete')
+            return self.keys.pop(key, None) is not None
+
+    def revoke(self, lease_id):
+        with self.lock:
+            self.count('revoke')
+            self.leases[lease_id] = (0, 0)
+            self.expire()
+
+    def keepalive(self, lease_id, interval, stop):
+        while True:
+            with self.lock:
+                self.count('keepalive')
+                self.expire()
+                if lease_id in self.leases:
+                    ttl = self.leases[lease_id][1]
+                    self.leases[lease_id] = (time.time() + ttl, ttl)
+                else:
+                    ttl = 0
+            yield ttl
+            if stop.wait(interval):
+                return
+
+
+ROUTE53_NAMESPACE = '{https://route53.amazonaws.com/doc/2013-04-01/}'
+
+
+def route53_error(code, message):
+    return DNSServerError(400, 'Bad Request',
+                          {'Error': {'Code': code, 'Message': message}})
+
+
+def parse_change_batch(body):
+    """
+    Parses the ChangeResourceRecordSets request body.
+
+    :return: List of (action, (name, type, identifier), (value, ttl,
+        weight)) tuples
+    :rtype: list
+    """
+    changes = []
+    root = ElementTree.fromstring(body.encode('utf-8'))
+    for change in root.iter(ROUTE53_NAMESPACE + 'Change'):
+        record_set = change.find(ROUTE53_NAMESPACE + 'ResourceRecordSet')
+
+        def text(element, path):
+            found = element.find('/'.join(
+                ROUTE53_NAMESPACE + part for part in path.split('/')))
+            return found.text.strip() if found is not None else None
+
+        changes.append((
+            text(change, 'Action'),
+            (text(record_set, 'Name').rstrip('.').lower() + '.',
+             text(record_set, 'Type'), text(record_set, 'SetIdentifier')),
+            (text(record_set, 'ResourceRecords/ResourceRecord/Value'),
+             text(record_set, 'TTL'), text(record_set, 'Weight'))))
+    return changes
+
+
+class FakeRoute53Connection:
+    """
+    In process stand-in for the boto route53 connection (get_all_rrsets,
+    change_rrsets and get_change). Requests beyond the account wide rate
+    fail with a Throttling error and change batches are validated like
+    route53 does (e.g. a DELETE not matching the record fails the batch).
+    Listings are paginated like route53 does (bound to this connection).
+    """
+
+    def __init__(self, rate=5, burst=5, latency=0.0, page_size=100):
+        self.lock = threading.Lock()
+        self.page_size = page_size
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated_at = time.time()
+        self.latency = latency
+        # (value, ttl, weight) keyed by (name, type, identifier)
+        self.records = {}
+        self.operations = {}
+        self.throttled = 0
+        self.changes = 0
+        # Changes which did not modify the record (UPSERT of same values)
+        self.noop_changes = 0
+        self.next_change_id = 1
+
+    def count(self, operation):
+        self.operations[operation] = self.operations.get(operation, 0) + 1
+
+    def _call(self, operation):
+        with self.lock:
+            self.count(operation)
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                self.throttled += 1
+                raise route53_error('Throttling', 'Rate exceeded')
+            self.tokens -= 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def seed(self, name, record_type, values, ttl, weight):
+        """
+        Creates the weighted records (value keyed by set identifier) without
+        counting them as changes.
+        """
+        with self.lock:
+            for identifier, value in values.items():
+                self.records[(name.rstrip('.').lower() + '.', record_type,
+                              identifier)] = (value, str(ttl), str(weight))
+
+    def values(self, name, record_type):
+        """
+        Gets the record values keyed by set identifier.
+        """
+        name = name.rstrip('.').lower() + '.'
+        with self.lock:
+            return {identifier: value for (record_name, type_, identifier),
+                    (value, _ttl, _weight) in self.records.items()
+                    if record_name == name and type_ == record_type}
+
+    def get_all_rrsets(self, hosted_zone_id, type=None, name=None,
+                       identifier=None, maxitems=None):
+        self._call('get_all_rrsets')
+        start = ((name or '').rstrip('.').lower() + '.' if name else '',
+                 type or '', identifier or '')
+        page_size = int(maxitems or self.page_size)
+        page = ResourceRecordSets(self, hosted_zone_id)
+        with self.lock:
+            keys = sorted(key for key in self.records if key >= start)
+            for key in keys[:page_size]:
+                page.append(Record(
+                    name=key[0], type=key[1], ttl=self.records[key][1],
+                    resource_records=[self.records[key][0]],
+                    identifier=key[2], weight=self.records[key][2]))
+        if len(keys) > page_size:
+            page.is_truncated = True
+            page.next_record_name, page.next_record_type, \
+                page.next_record_identifier = keys[page_size]
+        return page
+
+    def change_rrsets(self, hosted_zone_id, xml_body):
+        self._call('change_rrsets')
+        changes = parse_change_batch(xml_body)
+        with self.lock:
+            records = dict(self.records)
+            noop = 0
+            for action, key, record in changes:
+                existing = records.get(key)
+                if action == 'DELETE':
+                    if existing != record:
+                        raise route53_error(
+                            'InvalidChangeBatch',
+                            'Tried to delete resource record set %s but it '
+                            'was not found' % (key,))
+                    del records[key]
+                elif action == 'CREATE' and existing:
+                    raise route53_error(
+                        'InvalidChangeBatch',
+                        'Tried to create resource record set %s but it '
+                        'already exists' % (key,))
+                else:
+                    noop += existing == record
+                    records[key] = record
+            self.records = records
+            self.changes += len(changes)
+            self.noop_changes += noop
+            change_id = '/change/C%d' % self.next_change_id
+            self.next_change_id += 1
+        return {'ChangeResourceRecordSetsResponse': {
+            'ChangeInfo': {'Id': change_id, 'Status': 'INSYNC'}}}
+
+    def get_change(self, change_id):
+        self._call('get_change')
+        return {'GetChangeResponse': {
+            'ChangeInfo': {'Id': change_id, 'Status': 'INSYNC'}}}
@@ -0,0 +1,259 @@
+"""
+Throughput benchmark for the register path.
+
+Runs the register loops (one docker_container_poll per container or a
+single docker_host_poll) against an in process docker stand-in, a fake etcd
+HTTP server and local health check targets, and reports the results as
+JSON so that they can be compared between versions.
+
+Usage: python -m benchmarks.register --containers 50 --ports 2 \
+    --duration 60 --mode host --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+from benchmarks.fakes import FakeDockerClient, FakeEtcdServer, \
+    HealthTargetServer, create_container_info, LOCALHOST
+from discover.clients import reset_clients
+from discover.http_pool import init_http_pool
+from discover.metrics import get_metrics
+import discover.yoda_register.__main__ as register_main
+
+MODE_CONTAINER = 'container'
+MODE_HOST = 'host'
+FIRST_PRIVATE_PORT = 8080
+
+
+def percentile(values, percent):
+    """
+    Gets the percentile (nearest rank) of the given values.
+
+    :param values: Values
+    :type values: list
+    :param percent: Percentile (0-100)
+    :type percent: float
+    :rtype: float
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def memory_usage():
+    """
+    Gets the resident set size (current and peak) of the process in KB.
+
+    :rtype: dict
+    """
+    usage = {'peak_rss_kb': resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss}
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    usage['rss_kb'] = int(line.split()[1])
+                elif line.startswith('VmHWM:'):
+                    usage['peak_rss_kb'] = int(line.split()[1])
+    except OSError:
+        pass
+    return usage
+
+
+def count_endpoints(outcome):
+    counter = get_metrics().counter('endpoints_total')
+    return sum(value for labels, value in counter.values.items()
+               if ('outcome', outcome) in labels)
+
+
+def container_env(parsed_args):
+    env = [
+        'DISCOVER_POLL_INTERVAL=%d' % parsed_args.poll_interval,
+        'DISCOVER_MIN_POLL_INTERVAL=%d' % parsed_args.poll_interval,
+        'DISCOVER_MAX_POLL_INTERVAL=%d' % parsed_args.poll_interval,
+        'DISCOVER_POLL_JITTER=%s' % parsed_args.jitter,
+    ]
+    if not parsed_args.tcp_checks:
+        env.append('DISCOVER_HEALTH=%s' % json.dumps({
+            str(FIRST_PRIVATE_PORT + port): {'uri': '/health'}
+            for port in range(parsed_args.ports)}))
+    return env
+
+
+def register_args(etcd_port, *extra_args):
+    return register_main.create_parser().parse_args([
+        '--etcd-host', LOCALHOST, '--etcd-port', str(etcd_port),
+        '--proxy-host', LOCALHOST] + list(extra_args))
+
+
+def run(parsed_args):
+    """
+    Runs the benchmark.
+
+    :param parsed_args: Benchmark arguments
+    :return: Benchmark results
+    :rtype: dict
+    """
+    targets = [HealthTargetServer(latency=parsed_args.target_latency,
+                                  failure_rate=parsed_args.failure_rate)
+               .start() for _ in range(parsed_args.targets)]
+    etcd_server = FakeEtcdServer().start()
+    env = container_env(parsed_args)
+    containers = [
+        create_container_info(index, {
+            FIRST_PRIVATE_PORT + port:
+                targets[(index + port) % len(targets)].port
+            for port in range(parsed_args.ports)}, env=env)
+        for index in range(parsed_args.containers)]
+    docker_cl = FakeDockerClient(containers)
+    latencies = []
+
+    class TimedRegistration(register_main.ContainerRegistration):
+        def register(self, view):
+            started = time.time()
+            try:
+                return super().register(view)
+            finally:
+                latencies.append(time.time() - started)
+
+    reset_clients()
+    init_http_pool(max_connections=parsed_args.max_http_connections)
+    started = time.time()
+    ends_at = started + parsed_args.duration
+    poll = lambda: time.time() < ends_at  # noqa: E731
+    threads = []
+    with patch.object(register_main, 'docker_client',
+                      lambda *args: docker_cl), \
+            patch.object(register_main, 'ContainerRegistration',
+                         TimedRegistration):
+        if parsed_args.mode == MODE_HOST:
+            args = register_args(
+                etcd_server.port, '--all-containers',
+                '--max-concurrent-checks',
+                str(parsed_args.max_concurrent_checks))
+            threads.append(threading.Thread(
+                target=register_main.docker_host_poll, args=(args, poll)))
+        else:
+            for container in containers:
+                name = container['Name'].lstrip('/')
+                args = register_args(
+                    etcd_server.port, '--discover-name', name,
+                    '--max-concurrent-checks',
+                    str(parsed_args.max_concurrent_checks), name)
+                threads.append(threading.Thread(
+                    target=register_main.docker_container_poll,
+                    args=(args, poll)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(max(ends_at - time.time(), 0) +
+                        parsed_args.poll_interval + 10)
+    elapsed = time.time() - started
+
+    etcd_server.stop()
+    for target in targets:
+        target.stop()
+
+    registered = count_endpoints('registered')
+    minutes = elapsed / 60.0
+    return {
+        'benchmark': 'register',
+        'timestamp': int(started),
+        'python': platform.python_version(),
+        'params': {
+            name: getattr(parsed_args, name) for name in (
+                'mode', 'containers', 'ports', 'duration', 'poll_interval',
+                'jitter', 'targets', 'target_latency', 'failure_rate',
+                'tcp_checks', 'max_concurrent_checks',
+                'max_http_connections')
+        },
+        'results': dict({
+            'elapsed_seconds': round(elapsed, 3),
+            'iterations': len(latencies),
+            'registrations': registered,
+            'registrations_per_second': round(registered / elapsed, 3),
+            'failed_endpoints': count_endpoints('failed'),
+            'skipped_endpoints': count_endpoints('skipped'),
+            'iteration_latency_p50_seconds': percentile(latencies, 50),
+            'iteration_latency_p99_seconds': percentile(latencies, 99),
+            'etcd_operations': dict(etcd_server.store.operations),
+            'etcd_writes_per_container_per_minute': round(
+                etcd_server.writes / max(parsed_args.containers, 1) /
+                minutes, 3),
+            'docker_inspects': docker_cl.inspect_count,
+            'health_requests': sum(target.requests for target in targets),
+            'unfinished_loops': len([thread for thread in threads
+                                     if thread.is_alive()]),
+        }, **memory_usage())
+    }
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the register path against local docker, '
+                    'etcd and health check stand-ins')
+    parser.add_argument(
+        '--mode', choices=(MODE_CONTAINER, MODE_HOST), default=MODE_HOST,
+        help='Run one container poll per container (container) or a single '
+             'host wide poll (host). Defaults to host')
+    parser.add_argument(
+        '--containers', type=int, default=50,
+        help='Number of containers. Defaults to 50')
+    parser.add_argument(
+        '--ports', type=int, default=1,
+        help='Number of exposed ports per container. Defaults to 1')
+    parser.add_argument(
+        '--duration', type=int, default=30,
+        help='Duration of the benchmark in seconds. Defaults to 30')
+    parser.add_argument(
+        '--poll-interval', type=int, default=1,
+        help='Poll interval in seconds (fixed). Defaults to 1')
+    parser.add_argument(
+        '--jitter', type=float, default=0.1,
+        help='Poll jitter. Defaults to 0.1')
+    parser.add_argument(
+        '--targets', type=int, default=8,
+        help='Number of health check target servers. Defaults to 8')
+    parser.add_argument(
+        '--target-latency', type=float, default=0.0,
+        help='Latency in seconds of every health check response. '
+             'Defaults to 0')
+    parser.add_argument(
+        '--failure-rate', type=float, default=0.0,
+        help='Fraction of failed health check responses. Defaults to 0')
+    parser.add_argument(
+        '--tcp-checks', action='store_true',
+        help='Use port tests instead of http health checks')
+    parser.add_argument(
+        '--max-concurrent-checks', type=int, default=10,
+        help='Maximum number of concurrent health checks. Defaults to 10')
+    parser.add_argument(
+        '--max-http-connections', type=int, default=32,
+        help='Maximum number of pooled http connections. Defaults to 32')
+    parser.add_argument(
+        '--output', metavar='<FILE>',
+        help='File to which the results are written. Defaults to stdout')
+    return parser
+
+
+def main():
+    parsed_args = create_parser().parse_args()
+    results = json.dumps(run(parsed_args), indent=2, sort_keys=True)
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as output:
+            output.write(results + os.linesep)
+    else:
+        sys.stdout.write(results + os.linesep)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+"""
+Record and replay harness for the route53 sync loop.
+
+Records the <etcd_base>/proxy-nodes event stream of a live etcd (or
+generates a synthetic one: rolling replace, mass expiry or a flapping node)
+and replays it at accelerated speed into route53_sync running against a fake
+etcd HTTP server and a fake (rate limited) route53 connection. Reports the
+time to converge, the route53 API calls, the redundant changes and the
+correctness of the final records as JSON so that changes to the sync loop
+can be compared between versions.
+
+Usage:
+    python -m benchmarks.route53 record --etcd-host 10.0.0.1 \
+        --duration 600 --output events.json
+    python -m benchmarks.route53 replay --scenario rolling --nodes 20 \
+        --speed 10 --output results.json
+    python -m benchmarks.route53 replay --events events.json --speed 50
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+import etcd
+
+from benchmarks.fakes import FakeEtcdServer, FakeRoute53Connection, \
+    LOCALHOST
+from discover.clients import reset_clients
+import discover.yoda_route53.__main__ as route53_main
+
+SCENARIO_ROLLING = 'rolling'
+SCENARIO_EXPIRY = 'expiry'
+SCENARIO_FLAPPING = 'flapping'
+ETCD_BASE = '/yoda'
+ZONE_ID = 'ZBENCHMARK'
+DNS_RECORD = 'cluster.benchmark.local'
+
+
+def node_value(index):
+    return 'proxy-%d.benchmark.local' % index
+
+
+def initial_nodes(nodes):
+    return {'node-%d' % index: node_value(index) for index in range(nodes)}
+
+
+def rolling_replace(nodes, interval=1.0):
+    """
+    Replaces every proxy node (new node added, then the old one deleted)
+    one at a time.
+
+    :param nodes: Number of proxy nodes
+    :type nodes: int
+    :param interval: Seconds between replacements
+    :type interval: float
+    :return: Scenario
+    :rtype: dict
+    """
+    events = []
+    for index in range(nodes):
+        at = index * interval
+        events.append({'at': at, 'action': 'set',
+                       'node': 'node-%d' % (nodes + index),
+                       'value': node_value(nodes + index)})
+        events.append({'at': at + interval / 2, 'action': 'delete',
+                       'node': 'node-%d' % index})
+    return {'name': SCENARIO_ROLLING, 'initial': initial_nodes(nodes),
+            'events': events}
+
+
+def mass_expiry(nodes, fraction=0.5):
+    """
+    Expires a fraction of the proxy nodes at once (e.g. presence agents of
+    an availability zone losing etcd).
+
+    :return: Scenario
+    :rtype: dict
+    """
+    expired = int(nodes * fraction)
+    return {'name': SCENARIO_EXPIRY, 'initial': initial_nodes(nodes),
+            'events': [{'at': 0.0, 'action': 'expire',
+                        'node': 'node-%d' % index}
+                       for index in range(expired)]}
+
+
+def flapping(nodes, flaps=20, period=0.5):
+    """
+    Flaps a single proxy node (removed and added back) repeatedly.
+
+    :return: Scenario
+    :rtype: dict
+    """
+    events = []
+    for flap in range(flaps):
+        at = flap * period
+        events.append({'at': at, 'action': 'delete', 'node': 'node-0'})
+        events.append({'at': at + period / 2, 'action': 'set',
+                       'node': 'node-0', 'value': node_value(0)})
+    return {'name': SCENARIO_FLAPPING, 'initial': initial_nodes(nodes),
+            'events': events}
+
+
+SCENARIOS = {
+    SCENARIO_ROLLING: rolling_replace,
+    SCENARIO_EXPIRY: mass_expiry,
+    SCENARIO_FLAPPING: flapping,
+}
+
+
+def record(etcd_cl, proxy_nodes_key, duration, timeout=5):
+    """
+    Records the proxy node events from a live etcd.
+
+    :param etcd_cl: Etcd client
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :param duration: Recording duration in seconds
+    :type duration: float
+    :return: Scenario (initial proxy nodes and the recorded events)
+    :rtype: dict
+    """
+    initial, etcd_index = route53_main.read_proxy_nodes(etcd_cl,
+                                                        proxy_nodes_key)
+    wait_index = (etcd_index or 0) + 1
+    events = []
+    started = time.time()
+    while time.time() - started < duration:
+        try:
+            event = etcd_cl.read(proxy_nodes_key, recursive=True, wait=True,
+                                 waitIndex=wait_index, timeout=timeout)
+        except etcd.EtcdWatchTimedOut:
+            continue
+        wait_index = event.modifiedIndex + 1
+        node = event.key[len(proxy_nodes_key):].strip('/')
+        if not node or '/' in node:
+            continue
+        recorded = {'at': round(time.time() - started, 3),
+                    'action': event.action, 'node': node}
+        if event.action not in ('delete', 'expire'):
+            recorded['value'] = event.value
+        events.append(recorded)
+    return {'name': 'recorded', 'initial': initial, 'events': events}
+
+
+def wait_for(condition, timeout, interval=0.02):
+    ends_at = time.time() + timeout
+    while time.time() < ends_at:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+
+def sync_index(store):
+    with store.condition:
+        node = store.nodes.get('%s/route53/sync-index/' % ETCD_BASE)
+        return int(node['value']) if node else 0
+
+
+def last_event_index(store, proxy_nodes_key):
+    with store.condition:
+        return max([index for index, key, _event in store.history
+                    if key.startswith(proxy_nodes_key + '/')] or [0])
+
+
+def replay_event(store, proxy_nodes_key, event):
+    key = '%s/%s' % (proxy_nodes_key, event['node'])
+    if event['action'] == 'expire':
+        store.expire_now(key)
+    elif event['action'] == 'delete':
+        store.delete(key, {})
+    else:
+        store.put(key, {'value': event['value']})
+
+
+def sync_args(etcd_port, parsed_args):
+    return route53_main.create_parser().parse_args([
+        '--etcd-host', LOCALHOST, '--etcd-port', str(etcd_port),
+        '--etcd-base', ETCD_BASE,
+        '--reconcile-interval', str(parsed_args.reconcile_interval),
+        '--route53-rate', str(parsed_args.sync_rate),
+        '--route53-burst', str(parsed_args.sync_burst),
+        ZONE_ID, DNS_RECORD])
+
+
+def minimal_changes(initial, final):
+    """
+    Gets the number of record changes needed to move the initial records to
+    the final ones.
+    """
+    return len([node for node in set(initial) | set(final)
+                if initial.get(node) != final.get(node)])
+
+
+def replay(scenario, parsed_args):
+    """
+    Replays the scenario into route53_sync.
+
+    :param scenario: Scenario (initial proxy nodes and events)
+    :type scenario: dict
+    :param parsed_args: Benchmark arguments
+    :return: Benchmark results
+    :rtype: dict
+    """
+    etcd_server = FakeEtcdServer().start()
+    store = etcd_server.store
+    route53 = FakeRoute53Connection(rate=parsed_args.route53_api_rate,
+                                    burst=parsed_args.route53_api_burst,
+                                    latency=parsed_args.route53_latency)
+    args = sync_args(etcd_server.port, parsed_args)
+    proxy_nodes_key = '%s/proxy-nodes' % ETCD_BASE
+    # Steady state: etcd and route53 in sync before the replay
+    for node, value in scenario['initial'].items():
+        store.put('%s/%s' % (proxy_nodes_key, node), {'value': value})
+    route53.seed(DNS_RECORD, args.record_type, scenario['initial'],
+                 args.dns_ttl, args.record_weight)
+
+    stopped = threading.Event()
+
+    def sync():
+        try:
+            route53_main.route53_sync(args, lambda: not stopped.is_set())
+        except Exception:
+            if not stopped.is_set():
+                raise
+
+    reset_clients()
+    with patch.object(route53_main.boto, 'connect_route53',
+                      lambda **kwargs: route53):
+        thread = threading.Thread(target=sync, name='route53-sync')
+        thread.daemon = True
+        thread.start()
+        # Replay once the initial reconcile is done and the loop is watching
+        wait_for(lambda: store.watchers > 0, parsed_args.converge_timeout)
+        calls_before = dict(route53.operations)
+
+        started = time.time()
+        for event in sorted(scenario['events'], key=lambda item: item['at']):
+            delay = started + event['at'] / parsed_args.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            replay_event(store, proxy_nodes_key, event)
+        replayed = time.time()
+
+        with store.condition:
+            store.expire()
+            expected = {key[len(proxy_nodes_key):].strip('/'): node['value']
+                        for key, node in store.nodes.items()
+                        if key.startswith(proxy_nodes_key + '/')}
+        last_index = last_event_index(store, proxy_nodes_key)
+        # Converged once all the events are synced and the records match
+        converged = wait_for(
+            lambda: sync_index(store) >= last_index and
+            route53.values(DNS_RECORD, args.record_type) == expected,
+            parsed_args.converge_timeout)
+        converged_at = time.time()
+        stopped.set()
+    etcd_server.stop()
+    thread.join(1)
+
+    final = route53.values(DNS_RECORD, args.record_type)
+    api_calls = {operation: count - calls_before.get(operation, 0)
+                 for operation, count in route53.operations.items()
+                 if count > calls_before.get(operation, 0)}
+    needed = minimal_changes(scenario['initial'], expected)
+    return {
+        'benchmark': 'route53',
+        'timestamp': int(started),
+        'python': platform.python_version(),
+        'params': dict({
+            name: getattr(parsed_args, name) for name in (
+                'speed', 'reconcile_interval', 'sync_rate', 'sync_burst',
+                'route53_api_rate', 'route53_api_burst', 'route53_latency')
+        }, scenario=scenario['name'], nodes=len(scenario['initial']),
+            events=len(scenario['events'])),
+        'results': {
+            'converged': converged,
+            'replay_seconds': round(replayed - started, 3),
+            'converge_seconds': round(converged_at - replayed, 3)
+            if converged else None,
+            'total_seconds': round(converged_at - started, 3),
+            'api_calls': api_calls,
+            'api_calls_total': sum(api_calls.values()),
+            'throttled_calls': route53.throttled,
+            'changes': route53.changes,
+            'minimal_changes': needed,
+            'redundant_changes': max(route53.changes - needed, 0),
+            'noop_changes': route53.noop_changes,
+            'missing_records': len(set(expected) - set(final)),
+            'unexpected_records': len(set(final) - set(expected)),
+            'stale_records': len([node for node in expected
+                                  if node in final and
+                                  final[node] != expected[node]]),
+        }
+    }
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Records proxy node events or replays them into the '
+                    'route53 sync against local etcd and route53 '
+                    'stand-ins')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    recorder = commands.add_parser(
+        'record', help='Record proxy node events from a live etcd')
+    recorder.add_argument('--etcd-host', default='172.17.42.1',
+                          help='Etcd host. Defaults to 172.17.42.1')
+    recorder.add_argument('--etcd-port', type=int, default=4001,
+                          help='Etcd port. Defaults to 4001')
+    recorder.add_argument('--etcd-base', default=ETCD_BASE,
+                          help='Yoda base key. Defaults to %s' % ETCD_BASE)
+    recorder.add_argument(
+        '--duration', type=float, default=300,
+        help='Recording duration in seconds. Defaults to 300')
+    recorder.add_argument(
+        '--output', metavar='<FILE>',
+        help='File to which the events are written. Defaults to stdout')
+
+    replayer = commands.add_parser(
+        'replay', help='Replay recorded or synthetic events into the sync')
+    source = replayer.add_mutually_exclusive_group()
+    source.add_argument(
+        '--scenario', choices=sorted(SCENARIOS), default=SCENARIO_ROLLING,
+        help='Synthetic scenario. Defaults to %s' % SCENARIO_ROLLING)
+    source.add_argument('--events', metavar='<FILE>',
+                        help='Recorded events to be replayed')
+    replayer.add_argument(
+        '--nodes', type=int, default=20,
+        help='Number of proxy nodes (synthetic scenarios). Defaults to 20')
+    replayer.add_argument(
+        '--speed', type=float, default=10,
+        help='Replay speed up factor. Defaults to 10')
+    replayer.add_argument(
+        '--reconcile-interval', type=int, default=3600,
+        help='Reconcile interval of the sync in seconds. Defaults to 3600')
+    replayer.add_argument(
+        '--sync-rate', type=float, default=5,
+        help='Route53 request rate of the sync. Defaults to 5')
+    replayer.add_argument(
+        '--sync-burst', type=int, default=5,
+        help='Route53 burst of the sync. Defaults to 5')
+    replayer.add_argument(
+        '--route53-api-rate', type=float, default=5,
+        help='Requests per second allowed by the fake route53 before '
+             'throttling. Defaults to 5')
+    replayer.add_argument(
+        '--route53-api-burst', type=int, default=5,
+        help='Burst allowed by the fake route53. Defaults to 5')
+    replayer.add_argument(
+        '--route53-latency', type=float, default=0.05,
+        help='Latency in seconds of every fake route53 call. '
+             'Defaults to 0.05')
+    replayer.add_argument(
+        '--converge-timeout', type=float, default=120,
+        help='Seconds to wait for the records to converge. Defaults to 120')
+    replayer.add_argument(
+        '--output', metavar='<FILE>',
+        help='File to which the results are written. Defaults to stdout')
+    return parser
+
+
+def main():
+    parsed_args = create_parser().parse_args()
+    if parsed_args.command == 'record':
+        etcd_cl = etcd.Client(host=parsed_args.etcd_host,
+                              port=parsed_args.etcd_port)
+        results = record(etcd_cl, '%s/proxy-nodes' % parsed_args.etcd_base,
+                         parsed_args.duration)
+    else:
+        if parsed_args.events:
+            with open(parsed_args.events) as events:
+                scenario = json.load(events)
+        else:
+            scenario = SCENARIOS[parsed_args.scenario](parsed_args.nodes)
+        results = replay(scenario, parsed_args)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as output_file:
+            output_file.write(output + os.linesep)
+    else:
+        sys.stdout.write(output + os.linesep)
+
+
+if __name__ == '__main__':
+    main()
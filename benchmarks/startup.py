@@ -0,0 +1,172 @@
+"""
+Cold start benchmark for the discover tools.
+
+Measures the wall time of `python -m discover <command> --help` (interpreter
+start up, imports and argument parsing) in fresh processes and reports the
+heavy dependencies imported by each command, so that start up regressions
+(e.g. boto imported by register) are caught.
+
+Usage: python -m benchmarks.startup --runs 10 --max-seconds 1.5 \
+    --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks.register import percentile
+
+COMMANDS = {
+    'register': 'discover.yoda_register.__main__',
+    'presence': 'discover.yoda_presence.__main__',
+    'route53': 'discover.yoda_route53.__main__',
+}
+HEAVY_MODULES = ('boto', 'docker', 'etcd', 'etcd3', 'grpc', 'requests')
+# Heavy modules each command is allowed to import
+EXPECTED_MODULES = {
+    'register': {'docker', 'etcd', 'requests'},
+    'presence': {'etcd'},
+    'route53': {'boto', 'etcd'},
+}
+IMPORT_CHECK = '''\
+import importlib, json, sys
+importlib.import_module(sys.argv[1])
+print(json.dumps(sorted(name for name in sys.argv[2:] if name in sys.modules)))
+'''
+
+
+def heavy_modules(module_name):
+    """
+    Gets the heavy modules imported (in a fresh process) by the given module.
+
+    :param module_name: Module to be imported
+    :type module_name: str
+    :return: Names of the imported heavy modules
+    :rtype: list
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_CHECK, module_name] +
+        list(HEAVY_MODULES))
+    return json.loads(output.decode('utf-8'))
+
+
+def time_command(command, runs):
+    """
+    Times `python -m discover <command> --help` in fresh processes.
+
+    :return: Wall times in seconds
+    :rtype: list
+    """
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            started = time.time()
+            subprocess.check_call(
+                [sys.executable, '-m', 'discover', command, '--help'],
+                stdout=devnull)
+            timings.append(time.time() - started)
+    return timings
+
+
+def time_interpreter(runs):
+    timings = []
+    for _ in range(runs):
+        started = time.time()
+        subprocess.check_call([sys.executable, '-c', 'pass'])
+        timings.append(time.time() - started)
+    return timings
+
+
+def run(parsed_args):
+    """
+    Runs the benchmark.
+
+    :param parsed_args: Benchmark arguments
+    :return: Benchmark results
+    :rtype: dict
+    """
+    baseline = percentile(time_interpreter(parsed_args.runs), 50)
+    results = {}
+    for command in parsed_args.commands:
+        timings = time_command(command, parsed_args.runs)
+        imported = heavy_modules(COMMANDS[command])
+        results[command] = {
+            'min_seconds': round(min(timings), 4),
+            'p50_seconds': round(percentile(timings, 50), 4),
+            'max_seconds': round(max(timings), 4),
+            'p50_over_interpreter_seconds': round(
+                percentile(timings, 50) - baseline, 4),
+            'heavy_modules': imported,
+            'unexpected_modules': sorted(
+                set(imported) - EXPECTED_MODULES[command]),
+        }
+    return {
+        'benchmark': 'startup',
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'params': {'runs': parsed_args.runs,
+                   'commands': parsed_args.commands},
+        'results': dict(results, interpreter_p50_seconds=round(baseline, 4))
+    }
+
+
+def failures(results, max_seconds=None):
+    """
+    Gets the regressions in the results (unexpected heavy imports and, if
+    max_seconds is set, slow start ups).
+
+    :rtype: list
+    """
+    found = []
+    for command in COMMANDS:
+        result = results['results'].get(command)
+        if not result:
+            continue
+        if result['unexpected_modules']:
+            found.append('%s imports %s' % (
+                command, ', '.join(result['unexpected_modules'])))
+        if max_seconds and result['p50_seconds'] > max_seconds:
+            found.append('%s starts in %ss (max: %ss)' % (
+                command, result['p50_seconds'], max_seconds))
+    return found
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the cold start of the discover tools')
+    parser.add_argument(
+        '--runs', type=int, default=10,
+        help='Number of runs per command. Defaults to 10')
+    parser.add_argument(
+        '--commands', nargs='+', choices=sorted(COMMANDS),
+        default=sorted(COMMANDS),
+        help='Commands to be benchmarked. Defaults to all')
+    parser.add_argument(
+        '--max-seconds', type=float,
+        help='Fail if the median start up time of a command exceeds this')
+    parser.add_argument(
+        '--output', metavar='<FILE>',
+        help='File to which the results are written. Defaults to stdout')
+    return parser
+
+
+def main():
+    parsed_args = create_parser().parse_args()
+    results = run(parsed_args)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as output_file:
+            output_file.write(output + os.linesep)
+    else:
+        sys.stdout.write(output + os.linesep)
+    regressions = failures(results, parsed_args.max_seconds)
+    for regression in regressions:
+        sys.stderr.write('Regression: %s%s' % (regression, os.linesep))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
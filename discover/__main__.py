@@ -0,0 +1,49 @@
+"""
+Single entry point for the discover tools:
+
+    python -m discover {register,presence,route53} [options]
+
+Only the module of the requested tool is imported, so the dependencies of
+the other tools (e.g. boto for route53) do not add to the start up time.
+"""
+import argparse
+import importlib
+import sys
+
+# Module and description keyed by command
+COMMANDS = {
+    'register': ('discover.yoda_register.__main__',
+                 'Registers containers to yoda proxy'),
+    'presence': ('discover.yoda_presence.__main__',
+                 'Registers proxy nodes to etcd'),
+    'route53': ('discover.yoda_route53.__main__',
+                'Syncs proxy nodes with route53'),
+}
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m discover',
+        description='Service Discovery for Yoda Proxy',
+        epilog='Commands: ' + ', '.join(
+            '%s (%s)' % (command, COMMANDS[command][1])
+            for command in sorted(COMMANDS)))
+    parser.add_argument(
+        'command', choices=sorted(COMMANDS),
+        help='Tool to be run. See python -m discover <command> --help')
+    parser.add_argument(
+        'args', nargs=argparse.REMAINDER,
+        help='Arguments for the command')
+    return parser
+
+
+def main(argv=None):
+    parsed_args = create_parser().parse_args(argv)
+    module_name = COMMANDS[parsed_args.command][0]
+    module = importlib.import_module(module_name)
+    return module.main(parsed_args.args,
+                       prog='python -m discover %s' % parsed_args.command)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Long lived etcd / yoda clients shared by all the loops of a process.
+"""
+import functools
+import threading
+
+import etcd
+import yoda
+
+from discover import logger
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def etcd_client(etcd_host, etcd_port):
+    """
+    Gets the shared etcd client for the given host and port. The client
+    keeps a pool of HTTP connections to etcd which is reused across
+    iterations.
+
+    :param etcd_host: Etcd host
+    :type etcd_host: str
+    :param etcd_port: Etcd port
+    :type etcd_port: int
+    :rtype: etcd.Client
+    """
+    key = ('etcd', etcd_host, int(etcd_port))
+    with _lock:
+        if key not in _clients:
+            _clients[key] = etcd.Client(host=etcd_host, port=int(etcd_port))
+        return _clients[key]
+
+
+def yoda_client(parsed_args):
+    """
+    Gets the shared yoda client for the etcd settings in parsed arguments.
+
+    :param parsed_args: Parsed arguments (etcd_host, etcd_port, etcd_base)
+    :rtype: yoda.Client
+    """
+    key = ('yoda', parsed_args.etcd_host, int(parsed_args.etcd_port),
+           parsed_args.etcd_base)
+    etcd_cl = etcd_client(parsed_args.etcd_host, parsed_args.etcd_port)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = yoda.Client(etcd_cl=etcd_cl,
+                                        etcd_base=parsed_args.etcd_base)
+        return _clients[key]
+
+
+def reset_clients():
+    """
+    Drops all the shared clients so that they get re-created (and
+    re-connected) on next use.
+    """
+    with _lock:
+        _clients.clear()
+
+
+def reconnect_on_failure(func):
+    """
+    Decorator retrying the decorated function once with fresh clients when
+    the etcd connection fails.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except etcd.EtcdConnectionFailed:
+            logger.warn('Etcd connection failed during %s. Reconnecting...',
+                        func.__name__)
+            reset_clients()
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,194 @@
+"""
+EC2 instance metadata resolver. Only the requested keys are fetched (instead
+of the whole metadata tree) and the results are cached in a small file
+shared by all the discover processes on the host, so that restarts do not
+hit the instance metadata service.
+"""
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+from urllib.request import Request, urlopen
+
+from discover import logger
+
+METADATA_URL = 'http://169.254.169.254/latest/meta-data/'
+TOKEN_URL = 'http://169.254.169.254/latest/api/token'
+# Host directory (bind mounted into the discover containers) so that the
+# cache is shared by the containers and survives their restarts (--rm)
+DEFAULT_CACHE_FILE = '/var/cache/yoda-discover/ec2-metadata.json'
+DEFAULT_METADATA_TTL = 3600
+DEFAULT_METADATA_TIMEOUT = 2
+
+_instance_metadata = None
+_lock = threading.Lock()
+
+
+def fetch_metadata(key, timeout=DEFAULT_METADATA_TIMEOUT):
+    """
+    Fetches a single metadata key. IMDSv2 (session token) is used when
+    available and IMDSv1 otherwise.
+
+    :param key: Metadata key. e.g.: public-hostname
+    :type key: str
+    :param timeout: Timeout in seconds for each request
+    :type timeout: float
+    :return: Metadata value
+    :rtype: str
+    """
+    headers = {}
+    try:
+        token = urlopen(Request(
+            TOKEN_URL, method='PUT',
+            headers={'X-aws-ec2-metadata-token-ttl-seconds': '300'}),
+            timeout=timeout).read().decode('utf-8')
+        headers['X-aws-ec2-metadata-token'] = token
+    except Exception:
+        logger.debug('IMDSv2 token not available. Using IMDSv1')
+    response = urlopen(Request(METADATA_URL + key, headers=headers),
+                       timeout=timeout)
+    return response.read().decode('utf-8').strip()
+
+
+class InstanceMetadata:
+    """
+    Lazily fetched instance metadata cached on disk with a TTL. If the
+    metadata service is unavailable, the last cached (stale) value is used.
+    """
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE,
+                 ttl=DEFAULT_METADATA_TTL, timeout=DEFAULT_METADATA_TIMEOUT,
+                 fetch=fetch_metadata):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.timeout = timeout
+        self.fetch = fetch
+
+    def _read(self):
+        try:
+            with open(self.cache_file) as cache:
+                entries = json.load(cache)
+            return entries if isinstance(entries, dict) else {}
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        temp_file = '%s.%d' % (self.cache_file, os.getpid())
+        try:
+            with open(temp_file, 'w') as cache:
+                json.dump(entries, cache)
+            os.replace(temp_file, self.cache_file)
+        except (IOError, OSError):
+            logger.warn('Could not write metadata cache %s',
+                        self.cache_file)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Serializes the fetches across processes so that only one of them
+        hits the metadata service on a restart storm.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or '.',
+                        exist_ok=True)
+            lock_file = open(self.cache_file + '.lock', 'a')
+        except (IOError, OSError):
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fresh(self, entry):
+        return entry is not None and \
+            time.time() - entry.get('fetched', 0) < self.ttl
+
+    def get(self, key):
+        """
+        Gets the metadata value from the cache (or the metadata service if
+        the cached value is missing or expired).
+
+        :param key: Metadata key. e.g.: public-hostname
+        :type key: str
+        :return: Metadata value
+        :rtype: str
+        """
+        entry = self._read().get(key)
+        if self._fresh(entry):
+            return entry['value']
+        with self._locked():
+            # Another process might have refreshed it meanwhile
+            entries = self._read()
+            entry = entries.get(key)
+            if self._fresh(entry):
+                return entry['value']
+            try:
+                value = self.fetch(key, timeout=self.timeout)
+            except Exception:
+                if entry is None:
+                    raise
+                logger.exception('Failed to fetch metadata %s. Using cached '
+                                 'value', key)
+                return entry['value']
+            entries[key] = {'value': value, 'fetched': time.time()}
+            self._write(entries)
+            return value
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+
+def init_instance_metadata(cache_file=DEFAULT_CACHE_FILE,
+                           ttl=DEFAULT_METADATA_TTL):
+    """
+    Initializes the shared instance metadata.
+
+    :param cache_file: File shared by the processes on the host for caching
+        the metadata
+    :type cache_file: str
+    :param ttl: TTL in seconds for cached values
+    :type ttl: int
+    :rtype: InstanceMetadata
+    """
+    global _instance_metadata
+    with _lock:
+        _instance_metadata = InstanceMetadata(cache_file=cache_file, ttl=ttl)
+        return _instance_metadata
+
+
+def get_instance_metadata():
+    """
+    Gets the shared instance metadata (initialized with defaults if needed).
+
+    :rtype: InstanceMetadata
+    """
+    with _lock:
+        if _instance_metadata is not None:
+            return _instance_metadata
+    return init_instance_metadata()
+
+
+def add_metadata_arguments(parser):
+    """
+    Adds the instance metadata cache options to the argument parser.
+
+    :param parser: Argument parser
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        '--metadata-cache-file', metavar='<METADATA_CACHE_FILE>',
+        default=os.environ.get('DISCOVER_METADATA_CACHE', DEFAULT_CACHE_FILE),
+        help='File (shared by the discover processes on the host) used for '
+             'caching ec2 metadata (defaults to %s)' % DEFAULT_CACHE_FILE)
+    parser.add_argument(
+        '--metadata-ttl', metavar='<METADATA_TTL>',
+        default=os.environ.get('DISCOVER_METADATA_TTL', DEFAULT_METADATA_TTL),
+        type=int,
+        help='TTL in seconds for cached ec2 metadata. Mapped proxy host is '
+             'also re-checked at this interval (defaults to %d)' %
+             DEFAULT_METADATA_TTL)
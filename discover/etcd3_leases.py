@@ -0,0 +1,286 @@
+"""
+Optional etcd v3 backend. All the keys written by a discover process are
+attached to a single lease which is kept alive over one streaming
+keepalive. Liveness then costs O(1) writes per process (instead of one
+write per key per poll) and all the keys are removed at once when the
+process dies.
+
+Requires the etcd3 package (only when --etcd-api v3 is used).
+"""
+import os
+import threading
+
+from discover import logger
+from discover.metrics import get_metrics
+
+ETCD_API_V2 = 'v2'
+ETCD_API_V3 = 'v3'
+DEFAULT_ETCD3_PORT = 2379
+DEFAULT_LEASE_TTL = 30
+
+_leased_keys = {}
+_lock = threading.Lock()
+
+
+def import_etcd3():
+    """
+    Imports the etcd3 package on first use, so that its grpc stack is not
+    loaded by the processes using the v2 api.
+
+    :return: etcd3 module or None if it is not installed
+    """
+    try:
+        import etcd3
+    except ImportError:
+        return None
+    return etcd3
+
+
+class Etcd3Connection:
+    """
+    Thin adapter over the etcd3 client exposing only the operations used by
+    LeasedKeys (so that it can be swapped with an in process stand-in).
+    """
+
+    def __init__(self, host, port):
+        etcd3 = import_etcd3()
+        if etcd3 is None:
+            raise RuntimeError('etcd3 package is required for etcd v3 api')
+        self.client = etcd3.client(host=host, port=int(port))
+
+    def grant(self, ttl):
+        return self.client.lease(ttl).id
+
+    def put(self, key, value, lease_id=None):
+        self.client.put(key, value, lease=lease_id)
+
+    def delete(self, key):
+        return self.client.delete(key)
+
+    def revoke(self, lease_id):
+        self.client.revoke_lease(lease_id)
+
+    def keepalive(self, lease_id, interval, stop):
+        """
+        Keeps the lease alive over a single keepalive stream. A keepalive
+        request is sent every interval till stop is set.
+
+        :return: Generator yielding the remaining TTL of the lease after
+            every keepalive (0 once the lease is lost)
+        """
+        from etcd3 import etcdrpc
+
+        def requests():
+            while True:
+                yield etcdrpc.LeaseKeepAliveRequest(ID=lease_id)
+                if stop.wait(interval):
+                    return
+
+        for response in self.client.leasestub.LeaseKeepAlive(
+                requests(), None, credentials=self.client.call_credentials,
+                metadata=self.client.metadata):
+            yield response.TTL
+
+
+class LeasedKeys:
+    """
+    Keys of the process attached to a single lease. Keys are only written
+    when their value changes. If the lease is lost (e.g. the process was
+    paused longer than the TTL), a new lease is granted and all the keys are
+    re-written.
+    """
+
+    def __init__(self, connection, ttl=DEFAULT_LEASE_TTL):
+        self.connection = connection
+        self.ttl = ttl
+        self.lease_id = None
+        # Value keyed by etcd key
+        self.keys = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _grant(self):
+        self.lease_id = self.connection.grant(self.ttl)
+        get_metrics().counter(
+            'etcd3_lease_grants_total', 'Number of granted etcd v3 leases') \
+            .inc()
+        logger.info('Granted etcd lease %x (ttl: %ds)', self.lease_id,
+                    self.ttl)
+
+    def put(self, key, value):
+        """
+        Writes the key attached to the lease (if its value changed).
+
+        :param key: Etcd key
+        :type key: str
+        :param value: Value
+        :type value: str
+        :return: True if the key was written
+        :rtype: bool
+        """
+        with self._lock:
+            if self.lease_id is not None and self.keys.get(key) == value:
+                return False
+            if self.lease_id is None:
+                self._grant()
+            self.connection.put(key, value, self.lease_id)
+            self.keys[key] = value
+            self._set_gauge()
+            return True
+
+    def put_with_ttl(self, key, value, ttl):
+        """
+        Writes the key with its own lease so that it outlives the process
+        (e.g. upstreams shared by multiple processes) or expires before it
+        (e.g. draining endpoints). The key is detached from the lease of
+        the process.
+        """
+        with self._lock:
+            if self.keys.pop(key, None) is not None:
+                self._set_gauge()
+        self.connection.put(key, value, self.connection.grant(ttl))
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.keys
+
+    def delete(self, key):
+        with self._lock:
+            self.keys.pop(key, None)
+            self._set_gauge()
+        self.connection.delete(key)
+
+    def _set_gauge(self):
+        get_metrics().gauge('etcd3_leased_keys',
+                            'Number of keys attached to the lease').set(
+            len(self.keys))
+
+    def regrant(self):
+        """
+        Grants a new lease and re-writes all the keys.
+        """
+        with self._lock:
+            self._grant()
+            for key, value in self.keys.items():
+                self.connection.put(key, value, self.lease_id)
+
+    def keepalive(self):
+        """
+        Keeps the current lease alive till stopped or till the lease is lost
+        (in which case a new one is granted).
+        """
+        lease_id = self.lease_id
+        keepalives = get_metrics().counter(
+            'etcd3_keepalives_total', 'Number of etcd v3 lease keepalives')
+        for remaining in self.connection.keepalive(
+                lease_id, self.ttl / 3.0, self._stop):
+            keepalives.inc()
+            if remaining <= 0:
+                logger.warn('Etcd lease %x expired. Granting a new lease.',
+                            lease_id)
+                self.regrant()
+                return
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.lease_id is None:
+                self._stop.wait(self.ttl / 3.0)
+                continue
+            try:
+                self.keepalive()
+            except Exception:
+                logger.exception('Etcd lease keepalive failed. Retrying...')
+                self._stop.wait(1)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='etcd3-keepalive')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self, revoke=True):
+        """
+        Stops the keepalive. If revoke is True, the lease is revoked so that
+        all the keys get removed right away.
+        """
+        self._stop.set()
+        with self._lock:
+            lease_id, self.lease_id = self.lease_id, None
+            self.keys.clear()
+        if revoke and lease_id is not None:
+            logger.info('Revoking etcd lease %x', lease_id)
+            self.connection.revoke(lease_id)
+
+
+def leased_keys(parsed_args):
+    """
+    Gets the shared leased keys (with a running keepalive) for the etcd
+    settings in parsed arguments.
+
+    :param parsed_args: Parsed arguments (etcd_host, etcd3_port, lease_ttl)
+    :rtype: LeasedKeys
+    """
+    key = (parsed_args.etcd_host, int(parsed_args.etcd3_port))
+    with _lock:
+        if key not in _leased_keys:
+            _leased_keys[key] = LeasedKeys(
+                Etcd3Connection(parsed_args.etcd_host,
+                                parsed_args.etcd3_port),
+                ttl=parsed_args.lease_ttl).start()
+        return _leased_keys[key]
+
+
+def close_leased_keys():
+    """
+    Stops the keepalives and revokes the leases (removing all the keys of the
+    process).
+    """
+    with _lock:
+        leases = list(_leased_keys.values())
+        _leased_keys.clear()
+    for leased in leases:
+        try:
+            leased.close()
+        except Exception:
+            logger.exception('Failed to revoke etcd lease. Leaving it to '
+                             'expire.')
+
+
+def is_etcd3(parsed_args):
+    return parsed_args.etcd_api == ETCD_API_V3
+
+
+def validate_etcd_api(parser, parsed_args):
+    """
+    Fails (parser error) if etcd v3 api is requested without the etcd3
+    package.
+    """
+    if is_etcd3(parsed_args) and import_etcd3() is None:
+        parser.error('--etcd-api v3 requires the etcd3 package '
+                     '(pip install etcd3)')
+
+
+def add_etcd3_arguments(parser):
+    """
+    Adds the etcd v3 (lease) options to the argument parser.
+
+    :param parser: Argument parser
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        '--etcd-api', choices=(ETCD_API_V2, ETCD_API_V3),
+        default=os.environ.get('ETCD_API', ETCD_API_V2),
+        help='Etcd api used for registration. v3 attaches all the keys of '
+             'the process to a single lease (defaults to v2)')
+    parser.add_argument(
+        '--etcd3-port', metavar='<ETCD3_PORT>',
+        default=os.environ.get('ETCD3_PORT', DEFAULT_ETCD3_PORT), type=int,
+        help='Etcd v3 (grpc) port (defaults to %d)' % DEFAULT_ETCD3_PORT)
+    parser.add_argument(
+        '--lease-ttl', metavar='<LEASE_TTL>',
+        default=os.environ.get('DISCOVER_LEASE_TTL', DEFAULT_LEASE_TTL),
+        type=int,
+        help='TTL (in seconds) of the etcd v3 lease (defaults to %d)' %
+             DEFAULT_LEASE_TTL)
@@ -0,0 +1,265 @@
+"""
+Concurrent health check engine.
+"""
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from discover import logger
+from discover.metrics import get_metrics
+from discover.util import health_test, convert_to_milliseconds, \
+    DEFAULT_TIMEOUT
+
+DEFAULT_MAX_CONCURRENT_CHECKS = 10
+# Extra time (in seconds) given to a check on top of its own timeout
+DEADLINE_GRACE_SECONDS = 1
+# Consecutive passed checks needed before an endpoint is published
+DEFAULT_RISE = 1
+# Consecutive failed checks after which an endpoint is removed
+DEFAULT_FALL = 3
+# Weight of the latest sample in the smoothed (EWMA) latency
+DEFAULT_LATENCY_SMOOTHING = 0.3
+# Relative change of the smoothed latency needed before it is re-published
+DEFAULT_LATENCY_THRESHOLD = 0.25
+# Smaller changes (in ms) of the smoothed latency are never re-published
+MIN_LATENCY_CHANGE_MS = 1.0
+
+
+def check_deadline(health_check):
+    """
+    Gets the deadline (in seconds) for the given health check.
+
+    :param health_check: Health check configuration (DISCOVER_HEALTH entry)
+    :type health_check: dict
+    :rtype: float
+    """
+    return convert_to_milliseconds(
+        health_check.get('timeout', DEFAULT_TIMEOUT)) / 1000 + \
+        DEADLINE_GRACE_SECONDS
+
+
+def split_thresholds(health_check):
+    """
+    Splits the rise/fall thresholds from the health check configuration.
+
+    :param health_check: Health check configuration (DISCOVER_HEALTH entry)
+    :type health_check: dict
+    :return: Tuple of (health_check, rise, fall) where health_check no longer
+        contains the thresholds
+    :rtype: tuple
+    """
+    health_check = dict(health_check)
+    rise = int(health_check.pop('rise', DEFAULT_RISE))
+    fall = int(health_check.pop('fall', DEFAULT_FALL))
+    return health_check, max(rise, 1), max(fall, 1)
+
+
+class HealthState:
+    """
+    Health of a single endpoint with hysteresis. The endpoint goes up after
+    `rise` consecutive passed checks and down after `fall` consecutive failed
+    checks. The initial state is unknown (neither up nor down).
+    """
+
+    def __init__(self, rise=DEFAULT_RISE, fall=DEFAULT_FALL):
+        self.rise = rise
+        self.fall = fall
+        self.up = None
+        self.successes = 0
+        self.failures = 0
+
+    def record(self, passed):
+        """
+        Records the result of a health check.
+
+        :param passed: True if the check passed
+        :type passed: bool
+        :return: True if the state changed with this check
+        :rtype: bool
+        """
+        if passed:
+            self.successes += 1
+            self.failures = 0
+            if self.up is not True and self.successes >= self.rise:
+                self.up = True
+                return True
+        else:
+            self.failures += 1
+            self.successes = 0
+            if self.up is not False and self.failures >= self.fall:
+                self.up = False
+                return True
+        return False
+
+
+class LatencyEstimate:
+    """
+    Smoothed (EWMA) latency of an endpoint. The published value only moves
+    once the estimate drifts past the threshold, so that the endpoint is not
+    re-written on every poll.
+    """
+
+    def __init__(self, smoothing=DEFAULT_LATENCY_SMOOTHING):
+        self.smoothing = smoothing
+        # Smoothed latency in seconds
+        self.value = None
+        self.published_ms = None
+
+    def update(self, latency):
+        """
+        Records the latency of a passed check.
+
+        :param latency: Latency in seconds
+        :type latency: float
+        :return: Smoothed latency in seconds
+        :rtype: float
+        """
+        if self.value is None:
+            self.value = latency
+        else:
+            self.value += self.smoothing * (latency - self.value)
+        return self.value
+
+    def publish(self, threshold=DEFAULT_LATENCY_THRESHOLD):
+        """
+        Gets the latency to be published.
+
+        :param threshold: Relative change of the smoothed latency (from the
+            published one) needed before a new value is published
+        :type threshold: float
+        :return: Latency in ms (None if no latency was recorded)
+        :rtype: float
+        """
+        if self.value is None:
+            return self.published_ms
+        value_ms = round(self.value * 1000, 1)
+        if self.published_ms is None or \
+                abs(value_ms - self.published_ms) > max(
+                    self.published_ms * threshold, MIN_LATENCY_CHANGE_MS):
+            self.published_ms = value_ms
+        return self.published_ms
+
+
+def timed_health_test(port, host, health_check, labels):
+    """
+    Runs the health test recording its duration and outcome (passed or
+    failed) as health_check operation.
+
+    :return: Tuple of (healthy, latency in seconds)
+    :rtype: tuple
+    """
+    started = time.time()
+    healthy = False
+    try:
+        healthy = health_test(port, host, **health_check)
+        return healthy, time.time() - started
+    finally:
+        get_metrics().observe('health_check', time.time() - started,
+                              'passed' if healthy else 'failed', **labels)
+
+
+class HealthCheckEngine:
+    """
+    Runs health checks concurrently with a cap on the number of checks
+    in flight.
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT_CHECKS):
+        self.max_concurrent = max_concurrent
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent)
+
+    def run(self, checks, labels=None):
+        """
+        Runs all the given checks at once and yields the results as the
+        checks finish. Checks that do not finish within their deadline are
+        reported as failed.
+
+        :param checks: List of (check_id, port, host, health_check) tuples
+        :type checks: list
+        :param labels: Metric labels (e.g. app and port) keyed by check id
+        :type labels: dict
+        :return: Generator of (check_id, healthy) tuples
+        """
+        for check_id, healthy, _latency in self.run_timed(checks, labels):
+            yield check_id, healthy
+
+    def run_timed(self, checks, labels=None):
+        """
+        Same as run but yields the latency (connect or http round trip) of
+        every check as well.
+
+        :return: Generator of (check_id, healthy, latency) tuples where
+            latency is in seconds (None if the check did not finish)
+        """
+        labels = labels or {}
+        # Time at which the check started running keyed by its index
+        started = {}
+        futures = {}
+        for index, (check_id, port, host, health_check) in \
+                enumerate(checks):
+            future = self.executor.submit(
+                self._run_check, started, index, port, host, health_check,
+                labels.get(check_id) or {'port': port})
+            futures[future] = (index, check_id, check_deadline(health_check))
+        if not futures:
+            return
+
+        # Every check gets its own deadline from the time it starts running,
+        # so that a slow check does not eat the time of the ones queued
+        # behind it (beyond the concurrency cap). Queued checks fail if they
+        # do not start in time (e.g. all the workers are stuck).
+        max_deadline = max(deadline for _index, _check_id, deadline in
+                           futures.values())
+        queue_deadline = time.time() + max_deadline * math.ceil(
+            len(futures) / self.max_concurrent)
+
+        def expiry(future):
+            index, _check_id, deadline = futures[future]
+            if index in started:
+                return started[index] + deadline
+            return queue_deadline
+
+        pending = set(futures)
+        while pending:
+            timeout = min(expiry(future) for future in pending) - time.time()
+            if any(futures[future][0] not in started for future in pending):
+                # Re-check once queued checks start running
+                timeout = min(timeout, min(
+                    deadline for _index, _check_id, deadline in
+                    futures.values()))
+            done, _not_done = wait(pending, timeout=max(timeout, 0),
+                                   return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                check_id = futures[future][1]
+                try:
+                    healthy, latency = future.result()
+                except Exception:
+                    logger.exception('Health check %s failed', check_id)
+                    healthy, latency = False, None
+                yield check_id, healthy, latency
+            now = time.time()
+            for future in [future for future in pending
+                           if expiry(future) <= now]:
+                pending.discard(future)
+                index, check_id, deadline = futures[future]
+                future.cancel()
+                if index in started:
+                    logger.warn('Health check %s did not finish within %ds',
+                                check_id, deadline)
+                else:
+                    logger.warn('Health check %s did not start in time',
+                                check_id)
+                get_metrics().counter(
+                    'health_check_timeouts_total',
+                    'Number of health checks that missed their deadline') \
+                    .inc(**(labels.get(check_id) or {}))
+                yield check_id, False, None
+
+    @staticmethod
+    def _run_check(started, index, port, host, health_check, labels):
+        started[index] = time.time()
+        return timed_health_test(port, host, health_check, labels)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,230 @@
+"""
+Keep-alive HTTP connection pool used by the HTTP health checks.
+"""
+import http.client
+import socket
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_DNS_TTL_SECONDS = 60
+DEFAULT_MAX_DNS_ENTRIES = 256
+# Responses with a bigger body are not drained. Connection gets closed
+# instead.
+MAX_DRAIN_BYTES = 64 * 1024
+# Number of (plain http) redirects followed by a health request
+MAX_REDIRECTS = 1
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class PoolExhausted(Exception):
+    """
+    Raised when no connection could be acquired within the check timeout.
+    """
+    pass
+
+
+class DnsCache:
+    """
+    Caches resolved host addresses for a bounded TTL.
+    """
+
+    def __init__(self, ttl=DEFAULT_DNS_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_DNS_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """
+        Resolves the host to an IPv4 address.
+
+        :param host: Host name or address
+        :type host: str
+        :param port: Port to be used for resolving
+        :type port: int
+        :return: Resolved address
+        :rtype: str
+        """
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(host)
+            if entry and entry[1] > now:
+                return entry[0]
+        address = socket.getaddrinfo(host, port, socket.AF_INET,
+                                     socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+            self.entries[host] = (address, now + self.ttl)
+        return address
+
+
+class HttpConnectionPool:
+    """
+    Pool of HTTP/1.1 keep-alive connections per (host, port) with a cap on
+    the total number of open connections (idle and in use).
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 dns_ttl=DEFAULT_DNS_TTL_SECONDS):
+        self.max_connections = max_connections
+        self.dns_cache = DnsCache(ttl=dns_ttl)
+        self.idle = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _close_idle(self, exclude=None):
+        """
+        Closes one idle connection (not belonging to the excluded key) to
+        free a slot.
+
+        :return: True if a connection was closed
+        :rtype: bool
+        """
+        with self._lock:
+            for key, connections in self.idle.items():
+                if key != exclude and connections:
+                    connection = connections.pop()
+                    break
+            else:
+                return False
+        self._discard(connection)
+        return True
+
+    def _discard(self, connection):
+        connection.close()
+        self._slots.release()
+
+    def _acquire(self, key, address, timeout):
+        connection = None
+        stale = []
+        with self._lock:
+            connections = self.idle.get(key, [])
+            while connections and not connection:
+                candidate = connections.pop()
+                if candidate.host == address:
+                    connection = candidate
+                else:
+                    # Address changed (DNS TTL expired)
+                    stale.append(candidate)
+        for candidate in stale:
+            self._discard(candidate)
+        if connection:
+            connection.timeout = timeout
+            if connection.sock:
+                connection.sock.settimeout(timeout)
+            return connection, True
+
+        if not self._slots.acquire(blocking=False):
+            self._close_idle(exclude=key)
+            if not self._slots.acquire(timeout=timeout):
+                raise PoolExhausted('No HTTP connection available for %s:%s'
+                                    % key)
+        return http.client.HTTPConnection(address, key[1],
+                                          timeout=timeout), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            self.idle.setdefault(key, []).append(connection)
+
+    def get_status(self, host, port, path, timeout,
+                   max_redirects=MAX_REDIRECTS):
+        """
+        Performs a GET request and returns the response status. Plain http
+        redirects are followed up to max_redirects (the redirect status is
+        returned beyond that). At most MAX_DRAIN_BYTES of the body are read
+        so that the connection can be reused.
+
+        :param host: Host to be checked
+        :type host: str
+        :param port: Port to be checked
+        :type port: int
+        :param path: Request path
+        :type path: str
+        :param timeout: Timeout in seconds
+        :type timeout: float
+        :param max_redirects: Maximum number of redirects to be followed
+        :type max_redirects: int
+        :return: HTTP status
+        :rtype: int
+        """
+        status, location = self._get(host, port, path, timeout)
+        if status in REDIRECT_STATUSES and location and max_redirects > 0:
+            url = urlsplit(urljoin('http://%s:%s%s' % (host, port, path),
+                                   location))
+            if url.scheme == 'http' and url.hostname:
+                path = url.path or '/'
+                if url.query:
+                    path += '?' + url.query
+                return self.get_status(url.hostname, url.port or 80, path,
+                                       timeout,
+                                       max_redirects=max_redirects - 1)
+        return status
+
+    def _get(self, host, port, path, timeout):
+        key = (host, int(port))
+        address = self.dns_cache.resolve(host, port)
+        connection, reused = self._acquire(key, address, timeout)
+        try:
+            try:
+                response = self._request(connection, key, path)
+            except (http.client.HTTPException, ConnectionError):
+                if not reused:
+                    raise
+                # Server closed the idle keep-alive connection. Retry once on
+                # a fresh connection.
+                connection.close()
+                response = self._request(connection, key, path)
+            response.read(MAX_DRAIN_BYTES)
+            if response.isclosed() and not response.will_close:
+                self._release(key, connection)
+            else:
+                self._discard(connection)
+            return response.status, response.getheader('Location')
+        except Exception:
+            self._discard(connection)
+            raise
+
+    def _request(self, connection, key, path):
+        connection.request('GET', path, headers={
+            'Host': '%s:%s' % key,
+            'Connection': 'keep-alive'
+        })
+        return connection.getresponse()
+
+    def close(self):
+        with self._lock:
+            connections = [connection for idle in self.idle.values()
+                           for connection in idle]
+            self.idle.clear()
+        for connection in connections:
+            self._discard(connection)
+
+
+_pool = HttpConnectionPool()
+
+
+def init_http_pool(max_connections=DEFAULT_MAX_CONNECTIONS,
+                   dns_ttl=DEFAULT_DNS_TTL_SECONDS):
+    """
+    Replaces the shared HTTP connection pool.
+
+    :param max_connections: Maximum number of open connections
+    :type max_connections: int
+    :param dns_ttl: TTL in seconds for cached DNS results
+    :type dns_ttl: int
+    :return: New shared pool
+    :rtype: HttpConnectionPool
+    """
+    global _pool
+    _pool.close()
+    _pool = HttpConnectionPool(max_connections=max_connections,
+                               dns_ttl=dns_ttl)
+    return _pool
+
+
+def get_http_pool():
+    return _pool
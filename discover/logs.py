@@ -0,0 +1,271 @@
+"""
+Logging setup for the discover tools.
+
+Repeated identical failures of a target (e.g. health checks of a dead
+backend) are collapsed into periodic summaries with counts while the state
+transitions (failing and recovered) are logged at full detail. Optionally,
+records are formatted and written from a background thread (so that
+tracebacks are not formatted on the hot path) and emitted as JSON.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from discover import logger
+from discover.metrics import get_metrics
+
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+# Time in seconds between the summaries of a repeated failure
+DEFAULT_SUMMARY_INTERVAL = 60
+# Maximum number of records waiting to be written (async logging)
+DEFAULT_QUEUE_SIZE = 10000
+# Failures not repeated for this many summary intervals are forgotten
+FORGET_INTERVALS = 10
+# Extra record attributes included in json output
+JSON_EXTRA_FIELDS = ('check_target', 'repeated')
+
+_failure_log = None
+_listener = None
+_lock = threading.Lock()
+
+
+class _Failure:
+
+    def __init__(self, started):
+        self.started = started
+        self.signature = None
+        self.count = 0
+        self.repeated = 0
+        self.reported = started
+        self.last = started
+
+
+class FailureLog:
+    """
+    Failures keyed by target (e.g. host:port). The first failure of a target
+    and every change of failure are logged at full detail (with traceback).
+    Identical failures repeated within the summary interval are suppressed
+    and reported as a single summary with a count. Recovery of a failing
+    target is logged with the number of failed checks.
+    """
+
+    def __init__(self, summary_interval=DEFAULT_SUMMARY_INTERVAL, log=logger,
+                 clock=time.time):
+        self.summary_interval = summary_interval
+        self.log = log
+        self.clock = clock
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def _forget_stale(self, now):
+        expiry = max(self.summary_interval, 1) * FORGET_INTERVALS
+        for target, failure in list(self._failures.items()):
+            if now - failure.last > expiry:
+                del self._failures[target]
+
+    def failed(self, target, message, *args, exc_info=False,
+               level=logging.WARN):
+        """
+        Logs the failure of the target (or counts it if it is a repeat).
+
+        :param target: Failing target. e.g.: host:port
+        :type target: str
+        :param message: Log message (format string)
+        :type message: str
+        :param args: Log message arguments
+        :param exc_info: True to log the current exception
+        :type exc_info: bool
+        :param level: Log level
+        :type level: int
+        """
+        error_type = sys.exc_info()[0] if exc_info else None
+        signature = (message, error_type)
+        now = self.clock()
+        with self._lock:
+            failure = self._failures.get(target)
+            if failure is None:
+                self._forget_stale(now)
+                failure = self._failures[target] = _Failure(now)
+            failure.count += 1
+            failure.last = now
+            if failure.signature != signature or self.summary_interval <= 0:
+                failure.signature = signature
+                failure.repeated = 0
+                failure.reported = now
+                summary = None
+            else:
+                failure.repeated += 1
+                if now - failure.reported < self.summary_interval:
+                    get_metrics().counter(
+                        'log_records_suppressed_total',
+                        'Number of repeated failures not logged').inc()
+                    return
+                summary = (failure.repeated, int(now - failure.reported))
+                failure.repeated = 0
+                failure.reported = now
+        extra = {'check_target': target}
+        if summary is None:
+            self.log.log(level, message, *args, exc_info=exc_info,
+                         extra=extra)
+        else:
+            extra['repeated'] = summary[0]
+            self.log.log(level, message + ' (repeated %d time(s) in the last '
+                         '%ds)', *(args + summary), extra=extra)
+
+    def passed(self, target):
+        """
+        Marks the target as passed (logging the recovery if it was failing).
+
+        :param target: Target. e.g.: host:port
+        :type target: str
+        """
+        if target not in self._failures:
+            return
+        with self._lock:
+            failure = self._failures.pop(target, None)
+        if failure is not None:
+            self.log.info('%s recovered after %d failed check(s) in %ds',
+                          target, failure.count,
+                          int(self.clock() - failure.started),
+                          extra={'check_target': target})
+
+
+def get_failure_log():
+    """
+    Gets the shared failure log (initialized with defaults if needed).
+
+    :rtype: FailureLog
+    """
+    global _failure_log
+    with _lock:
+        if _failure_log is None:
+            _failure_log = FailureLog()
+        return _failure_log
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the records as single line json.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in JSON_EXTRA_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, sort_keys=True, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves the formatting (including tracebacks) to the
+    listener thread. Records are dropped (and counted) instead of blocking
+    the caller when the queue is full.
+    """
+
+    def prepare(self, record):
+        # Merge the args now as they may be mutated by the caller later
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            get_metrics().counter(
+                'log_records_dropped_total',
+                'Number of log records dropped (queue full)').inc()
+
+
+def start_async_logging(log=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Moves the handlers of the given logger behind a queue written from a
+    background thread.
+
+    :param log: Logger (defaults to root logger)
+    :type log: logging.Logger
+    :param queue_size: Maximum number of records waiting to be written
+    :type queue_size: int
+    :return: Started listener
+    :rtype: logging.handlers.QueueListener
+    """
+    log = log or logging.getLogger()
+    handlers = list(log.handlers)
+    records = queue.Queue(queue_size)
+    for handler in handlers:
+        log.removeHandler(handler)
+    log.addHandler(DeferredQueueHandler(records))
+    listener = QueueListener(records, *handlers)
+    listener.start()
+    return listener
+
+
+def stop_async_logging():
+    """
+    Writes the queued records and stops the background thread.
+    """
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def init_logging(parsed_args):
+    """
+    Initializes the logging using the parsed arguments (log_format,
+    log_async and log_summary_interval).
+
+    :param parsed_args: Parsed arguments
+    """
+    global _failure_log, _listener
+    root = logging.getLogger()
+    if parsed_args.log_format == LOG_FORMAT_JSON:
+        for handler in root.handlers:
+            handler.setFormatter(JsonFormatter())
+    with _lock:
+        _failure_log = FailureLog(parsed_args.log_summary_interval)
+        if parsed_args.log_async and _listener is None:
+            _listener = start_async_logging(root)
+            atexit.register(stop_async_logging)
+
+
+def add_logging_arguments(parser):
+    """
+    Adds the logging options to the argument parser.
+
+    :param parser: Argument parser
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        '--log-format', choices=(LOG_FORMAT_TEXT, LOG_FORMAT_JSON),
+        default=os.environ.get('DISCOVER_LOG_FORMAT', LOG_FORMAT_TEXT),
+        help='Log format (defaults to text)')
+    parser.add_argument(
+        '--log-async', action='store_true',
+        default=os.environ.get('DISCOVER_LOG_ASYNC', '').lower() in
+        ('1', 'true', 'yes'),
+        help='Format and write the logs from a background thread')
+    parser.add_argument(
+        '--log-summary-interval', metavar='<LOG_SUMMARY_INTERVAL>',
+        type=int,
+        default=os.environ.get('DISCOVER_LOG_SUMMARY_INTERVAL',
+                               DEFAULT_SUMMARY_INTERVAL),
+        help='Repeated identical failures of a target are logged as a '
+             'summary once per interval (in seconds). 0 logs every failure. '
+             'Defaults to %d' % DEFAULT_SUMMARY_INTERVAL)
@@ -0,0 +1,354 @@
+"""
+Lightweight in process metrics (counters, gauges and histograms) exported
+in the Prometheus text format, either over HTTP on a local port or by
+periodically writing a file.
+"""
+import bisect
+import contextlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from discover import logger
+
+METRIC_PREFIX = 'discover_'
+# Buckets (in seconds) used for latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+DEFAULT_METRICS_HOST = '127.0.0.1'
+DEFAULT_WRITE_INTERVAL = 15
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()
+                        if value is not None))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    labels = list(label_key) + list(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in labels)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base class for a metric family. Values are kept per label set.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, description):
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """
+        Gets the samples for the exposition.
+
+        :return: List of (suffix, label_key, extra_labels, value) tuples
+        :rtype: list
+        """
+        with self._lock:
+            return [('', label_key, (), value)
+                    for label_key, value in sorted(self.values.items())]
+
+    def remove(self, **labels):
+        with self._lock:
+            self.values.pop(_label_key(labels), None)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for suffix, label_key, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                                        _format_labels(label_key, extra),
+                                        _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, description):
+        super().__init__(name, description)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[_label_key(labels)] = value
+
+    def set_function(self, function, **labels):
+        """
+        Sets a function evaluated on every exposition (e.g. for values kept
+        by other components).
+        """
+        with self._lock:
+            self.functions[_label_key(labels)] = function
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for label_key, function in functions.items():
+            try:
+                values[label_key] = function()
+            except Exception:
+                logger.exception('Failed to evaluate gauge %s', self.name)
+        return [('', label_key, (), value)
+                for label_key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self.values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = [(label_key, list(counts), total) for
+                      label_key, (counts, total) in
+                      sorted(self.values.items())]
+        for label_key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', label_key,
+                                (('le', _format_value(bound)),), cumulative))
+            samples.append(('_sum', label_key, (), total))
+            samples.append(('_count', label_key, (), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Registry for all the metrics of the process.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, *args):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, *args)
+            return metric
+
+    def counter(self, name, description=''):
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name, description=''):
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name, description='', buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    @contextlib.contextmanager
+    def timed(self, operation, **labels):
+        """
+        Records the duration (discover_operation_duration_seconds) and the
+        outcome (discover_operations_total) of the wrapped block. The
+        outcome is 'error' if the block raises and 'success' otherwise.
+
+        :param operation: Operation name. e.g.: do_register
+        :type operation: str
+        :keyword labels: Additional labels (e.g. app and port)
+        """
+        started = time.time()
+        outcome = 'success'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self.observe(operation, time.time() - started, outcome, **labels)
+
+    def observe(self, operation, duration, outcome, **labels):
+        """
+        Records the duration and outcome of an operation.
+
+        :param operation: Operation name. e.g.: health_check
+        :type operation: str
+        :param duration: Duration in seconds
+        :type duration: float
+        :param outcome: Outcome. e.g.: success, error
+        :type outcome: str
+        """
+        self.histogram(
+            'operation_duration_seconds',
+            'Duration of discover operations in seconds').observe(
+            duration, operation=operation, outcome=outcome, **labels)
+        self.counter('operations_total', 'Number of discover operations') \
+            .inc(operation=operation, outcome=outcome, **labels)
+
+    def render(self):
+        with self._lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    return _registry
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Scrapes are not logged
+        pass
+
+
+def start_http_server(port, host=DEFAULT_METRICS_HOST):
+    """
+    Serves the metrics over HTTP (/metrics) from a daemon thread.
+
+    :param port: Port to listen on
+    :type port: int
+    :param host: Address to bind to (defaults to local only)
+    :type host: str
+    :return: HTTP server
+    :rtype: HTTPServer
+    """
+    server = HTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics on http://%s:%d/metrics', host, port)
+    return server
+
+
+def write_metrics(path):
+    """
+    Writes the metrics to the given file. The file is replaced atomically
+    so that readers never see a partial file.
+
+    :param path: Path of the metrics file
+    :type path: str
+    """
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as metrics_file:
+        metrics_file.write(get_metrics().render())
+    os.replace(tmp_path, path)
+
+
+def start_file_writer(path, interval=DEFAULT_WRITE_INTERVAL):
+    """
+    Writes the metrics to the given file periodically from a daemon thread.
+
+    :param path: Path of the metrics file
+    :type path: str
+    :param interval: Write interval in seconds
+    :type interval: int
+    :return: Writer thread
+    :rtype: threading.Thread
+    """
+    def write_loop():
+        while True:
+            try:
+                write_metrics(path)
+            except OSError:
+                logger.exception('Failed to write metrics to %s', path)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=write_loop, name='metrics-writer')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def add_metrics_arguments(parser):
+    """
+    Adds the (optional) metrics export options to the argument parser.
+
+    :param parser: Argument parser
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        '--metrics-port', metavar='<METRICS_PORT>', type=int,
+        default=os.environ.get('DISCOVER_METRICS_PORT'),
+        help='Local port for serving Prometheus metrics. Disabled by '
+             'default')
+    parser.add_argument(
+        '--metrics-host', metavar='<METRICS_HOST>',
+        default=os.environ.get('DISCOVER_METRICS_HOST',
+                               DEFAULT_METRICS_HOST),
+        help='Address for serving Prometheus metrics. Defaults to %s' %
+             DEFAULT_METRICS_HOST)
+    parser.add_argument(
+        '--metrics-file', metavar='<METRICS_FILE>',
+        default=os.environ.get('DISCOVER_METRICS_FILE'),
+        help='File to which Prometheus metrics are written periodically. '
+             'Disabled by default')
+    parser.add_argument(
+        '--metrics-interval', metavar='<METRICS_INTERVAL>', type=int,
+        default=os.environ.get('DISCOVER_METRICS_INTERVAL',
+                               DEFAULT_WRITE_INTERVAL),
+        help='Interval in seconds for writing the metrics file. '
+             'Defaults to %d' % DEFAULT_WRITE_INTERVAL)
+
+
+def init_metrics(parsed_args):
+    """
+    Starts the metrics exports enabled in the parsed arguments.
+
+    :param parsed_args: Parsed arguments (see add_metrics_arguments)
+    """
+    if parsed_args.metrics_port:
+        start_http_server(parsed_args.metrics_port,
+                          host=parsed_args.metrics_host)
+    if parsed_args.metrics_file:
+        start_file_writer(parsed_args.metrics_file,
+                          interval=parsed_args.metrics_interval)
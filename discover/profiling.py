@@ -0,0 +1,153 @@
+"""
+On demand profiling toggled at runtime using a signal. The first signal
+starts the profiler and the next one stops it and dumps the profile to
+disk.
+"""
+import cProfile
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from discover import logger
+
+PROFILE_SIGNAL = signal.SIGUSR2
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLING = 'sampling'
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all the threads at a fixed interval. The profile
+    is dumped as collapsed stacks (one 'frame;frame;frame count' line per
+    unique stack) which can be turned into a flame graph.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name
+                 for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def enable(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='sampling-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def dump_stats(self, path):
+        with open(path, 'w') as profile_file:
+            for stack, count in sorted(self.stacks.items()):
+                profile_file.write('%s %d\n' % (stack, count))
+
+
+class ProfileToggle:
+    """
+    Starts or stops (and dumps) the profiler on every call.
+    """
+
+    def __init__(self, profile_dir=None, mode=MODE_CPROFILE):
+        self.profile_dir = profile_dir or tempfile.gettempdir()
+        self.mode = mode
+        self.profiler = None
+
+    def start(self):
+        self.profiler = SamplingProfiler() if self.mode == MODE_SAMPLING \
+            else cProfile.Profile()
+        self.profiler.enable()
+        logger.info('Started %s profiler', self.mode)
+
+    def stop(self):
+        """
+        Stops the profiler and dumps the profile.
+
+        :return: Path of the dumped profile
+        :rtype: str
+        """
+        profiler, self.profiler = self.profiler, None
+        profiler.disable()
+        path = os.path.join(self.profile_dir, 'discover-%d-%d.%s' % (
+            os.getpid(), int(time.time()),
+            'folded' if self.mode == MODE_SAMPLING else 'prof'))
+        profiler.dump_stats(path)
+        logger.info('Stopped %s profiler. Profile written to %s', self.mode,
+                    path)
+        return path
+
+    def __call__(self, *args):
+        try:
+            if self.profiler:
+                self.stop()
+            else:
+                self.start()
+        except Exception:
+            logger.exception('Failed to toggle %s profiler', self.mode)
+
+
+def init_profile_handler(profile_dir=None, mode=MODE_CPROFILE):
+    """
+    Installs the signal handler (SIGUSR2) toggling the profiler. The
+    cprofile mode profiles the main thread (running the poll loop) only.
+    The sampling mode covers all the threads.
+
+    :param profile_dir: Directory to which profiles are dumped (defaults to
+        the temp directory)
+    :type profile_dir: str
+    :param mode: Profiler mode (cprofile or sampling)
+    :type mode: str
+    :return: Profile toggle
+    :rtype: ProfileToggle
+    """
+    toggle = ProfileToggle(profile_dir=profile_dir, mode=mode)
+    signal.signal(PROFILE_SIGNAL, toggle)
+    return toggle
+
+
+def add_profiling_arguments(parser):
+    """
+    Adds the profiling options to the argument parser.
+
+    :param parser: Argument parser
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        '--profile-dir', metavar='<PROFILE_DIR>',
+        default=os.environ.get('DISCOVER_PROFILE_DIR'),
+        help='Directory to which profiles (toggled using SIGUSR2) are '
+             'written. Defaults to the temp directory')
+    parser.add_argument(
+        '--profile-mode', choices=(MODE_CPROFILE, MODE_SAMPLING),
+        default=os.environ.get('DISCOVER_PROFILE_MODE', MODE_CPROFILE),
+        help='Profiler toggled using SIGUSR2 (cprofile or sampling). '
+             'Defaults to cprofile')
@@ -0,0 +1,109 @@
+"""
+Token bucket rate limiter with adaptive (exponential, jittered) backoff for
+throttled API calls.
+"""
+import random
+import threading
+import time
+
+from discover import logger
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30
+# Rate never drops below this fraction of the configured rate while backing
+# off
+MIN_RATE_FACTOR = 0.1
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the calls to a given rate (with burst). When the
+    API reports throttling, the call is retried with exponential backoff
+    (with full jitter) and the rate is halved. The rate recovers gradually
+    on successful calls.
+    """
+
+    def __init__(self, rate, burst=1, is_throttled=None,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 base_backoff=DEFAULT_BASE_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.is_throttled = is_throttled or (lambda error: False)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.updated_at = time.time()
+        # Metrics
+        self.wait_seconds = 0.0
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """
+        Blocks till a token is available.
+
+        :return: Time waited in seconds
+        :rtype: float
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.wait_seconds += waited
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def _backoff(self, attempt):
+        with self._lock:
+            self.throttled_count += 1
+            self.rate = max(self.rate / 2, self.max_rate * MIN_RATE_FACTOR)
+        delay = random.uniform(
+            0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+        with self._lock:
+            self.wait_seconds += delay
+        time.sleep(delay)
+
+    def _recover(self):
+        with self._lock:
+            self.rate = min(self.max_rate,
+                            self.rate + self.max_rate * MIN_RATE_FACTOR)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls the function once a token is available, retrying with backoff
+        while the call is throttled.
+
+        :param func: Function to be called
+        :type func: function
+        :return: Result of the function call
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                if not self.is_throttled(error) or \
+                        attempt >= self.max_retries:
+                    raise
+                logger.warn('Call to %s was throttled (attempt %d). '
+                            'Backing off...',
+                            getattr(func, '__name__', func), attempt + 1)
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            self._recover()
+            return result
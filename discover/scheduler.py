@@ -0,0 +1,91 @@
+"""
+Adaptive, jittered fixed rate schedule used by the register and presence
+loops.
+"""
+import random
+import time
+
+DEFAULT_JITTER = 0.1
+# Number of consecutive healthy runs after which the interval is lengthened
+DEFAULT_STABLE_RUNS = 3
+BACKOFF_FACTOR = 1.5
+# Buffer (in seconds) kept between the TTL and the worst case interval
+TTL_BUFFER_SECONDS = 10
+
+
+def max_interval_for_ttl(ttl):
+    """
+    Gets the longest poll interval that still leaves (at least) two polls
+    within the TTL.
+
+    :param ttl: TTL in seconds for the published keys
+    :type ttl: int
+    :rtype: float
+    """
+    return max((ttl - TTL_BUFFER_SECONDS) / 2.0, 1)
+
+
+class AdaptiveSchedule:
+    """
+    Fixed rate schedule (the next run is anchored to the previous scheduled
+    run, so it does not drift by the duration of the checks) with per task
+    jitter. The interval shrinks to min_interval while the target is failing
+    or newly started and grows (up to max_interval) while it is stable.
+    Jitter only ever shortens the interval so max_interval stays the worst
+    case.
+    """
+
+    def __init__(self, interval, min_interval=None, max_interval=None,
+                 jitter=DEFAULT_JITTER, stable_runs=DEFAULT_STABLE_RUNS):
+        self.interval = float(interval)
+        self.min_interval = float(min_interval or interval)
+        self.max_interval = float(max(max_interval or interval,
+                                      self.min_interval))
+        self.jitter = jitter
+        self.stable_runs = stable_runs
+        self.current_interval = self.min_interval
+        self.healthy_runs = 0
+        self.scheduled_at = None
+
+    def first_run(self):
+        """
+        Gets the time for the first run. Spread randomly over the jitter
+        window so that tasks started together do not run in phase.
+
+        :rtype: float
+        """
+        self.scheduled_at = time.time() + \
+            random.uniform(0, self.jitter * self.min_interval)
+        return self.scheduled_at
+
+    def next_run(self, healthy):
+        """
+        Gets the time for the next run.
+
+        :param healthy: True if the target was healthy in the last run
+        :type healthy: bool
+        :return: Time (epoch seconds) for the next run
+        :rtype: float
+        """
+        if healthy:
+            self.healthy_runs += 1
+            if self.healthy_runs >= self.stable_runs:
+                # The poll interval may exceed max_interval (capped by TTL)
+                base_interval = min(self.interval, self.max_interval)
+                if self.current_interval < base_interval:
+                    self.current_interval = base_interval
+                else:
+                    self.current_interval = min(
+                        self.current_interval * BACKOFF_FACTOR,
+                        self.max_interval)
+                self.healthy_runs = 0
+        else:
+            self.healthy_runs = 0
+            self.current_interval = self.min_interval
+
+        interval = self.current_interval * \
+            (1 - random.uniform(0, self.jitter))
+        now = time.time()
+        anchor = self.scheduled_at if self.scheduled_at is not None else now
+        self.scheduled_at = max(anchor + interval, now)
+        return self.scheduled_at
@@ -0,0 +1,192 @@
+"""
+Opt-in per iteration tracing. Each loop iteration is a trace made of timed
+phase spans (e.g. inspect, health_check, etcd_write, route53) which is
+emitted as a single structured (JSON) log line. When tracing is disabled,
+shared no-op objects are returned so the hot path costs nothing.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+TRACE_LOGGER_NAME = 'yoda-discover.trace'
+
+trace_logger = logging.getLogger(TRACE_LOGGER_NAME)
+_enabled = False
+# Only traces slower than the threshold (in seconds) are emitted
+_threshold = 0.0
+_local = threading.local()
+
+
+class _NoOp:
+    """
+    Shared no-op trace/span used while tracing is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NO_OP = _NoOp()
+
+
+class Span:
+
+    def __init__(self, trace, phase):
+        self.trace = trace
+        self.phase = phase
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.trace.add_span(self.phase, self.started, time.time())
+        return False
+
+
+class Trace:
+    """
+    Trace for a single loop iteration. Becomes the current trace of the
+    thread while entered so that nested calls can add spans using span().
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.spans = []
+        self.started = None
+        self.parent = None
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add_span(self, phase, started, ended):
+        self.spans.append((phase, started, ended))
+
+    def __enter__(self):
+        self.parent = getattr(_local, 'trace', None)
+        _local.trace = self
+        self.started = time.time()
+        return self
+
+    def __exit__(self, error_type, *args):
+        ended = time.time()
+        _local.trace = self.parent
+        if error_type:
+            self.fields['error'] = error_type.__name__
+        if ended - self.started >= _threshold:
+            trace_logger.info(json.dumps(self.to_dict(ended),
+                                         sort_keys=True, default=str))
+        return False
+
+    def to_dict(self, ended):
+        phases = {}
+        for phase, started, span_ended in self.spans:
+            phases[phase] = phases.get(phase, 0) + span_ended - started
+        return dict(self.fields, **{
+            'trace': self.name,
+            'duration_ms': round((ended - self.started) * 1000, 3),
+            'phases_ms': {phase: round(duration * 1000, 3)
+                          for phase, duration in phases.items()},
+            'spans': [{'phase': phase,
+                       'start_ms': round((started - self.started) * 1000, 3),
+                       'duration_ms': round((span_ended - started) * 1000, 3)}
+                      for phase, started, span_ended in self.spans]
+        })
+
+
+def trace(name, **fields):
+    """
+    Starts a trace for a loop iteration.
+
+    :param name: Trace name. e.g.: docker_container_poll
+    :type name: str
+    :keyword fields: Additional fields for the structured log
+    :return: Trace (context manager)
+    """
+    if not _enabled:
+        return _NO_OP
+    return Trace(name, **fields)
+
+
+def span(phase):
+    """
+    Times a phase of the current trace.
+
+    :param phase: Phase name. e.g.: health_check
+    :type phase: str
+    :return: Span (context manager)
+    """
+    if not _enabled:
+        return _NO_OP
+    current = getattr(_local, 'trace', None)
+    if current is None:
+        return _NO_OP
+    return Span(current, phase)
+
+
+def traced(iterable, phase):
+    """
+    Times the waits for the items of the given iterable (e.g. results of
+    concurrent health checks) as spans of the current trace.
+
+    :param iterable: Iterable to be traced
+    :param phase: Phase name
+    :type phase: str
+    :return: Iterable yielding the same items
+    """
+    if not _enabled:
+        return iterable
+    return _traced(iter(iterable), phase)
+
+
+def _traced(iterator, phase):
+    while True:
+        with span(phase):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def init_tracing(enabled, threshold_ms=0):
+    """
+    Enables or disables tracing.
+
+    :param enabled: True to enable tracing
+    :type enabled: bool
+    :param threshold_ms: Only traces slower than this are emitted
+    :type threshold_ms: int
+    """
+    global _enabled, _threshold
+    _enabled = bool(enabled)
+    _threshold = (threshold_ms or 0) / 1000.0
+
+
+def add_tracing_arguments(parser):
+    """
+    Adds the (optional) tracing options to the argument parser.
+
+    :param parser: Argument parser
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        '--trace', action='store_true',
+        default=os.environ.get('DISCOVER_TRACE', '').lower() in
+        ('1', 'true', 'yes'),
+        help='Log per phase timings of every loop iteration as JSON')
+    parser.add_argument(
+        '--trace-threshold-ms', metavar='<TRACE_THRESHOLD_MS>', type=int,
+        default=os.environ.get('DISCOVER_TRACE_THRESHOLD_MS', 0),
+        help='Only log iterations slower than the threshold (in ms). '
+             'Defaults to 0')
@@ -1,10 +1,14 @@
+import logging
 import socket
 import re
 import signal
-from urllib.request import urlopen
-from boto.utils import get_instance_metadata
 import sys
+import threading
+import time
 from discover import logger
+from discover.ec2_metadata import get_instance_metadata
+from discover.http_pool import get_http_pool
+from discover.logs import get_failure_log
 
 __author__ = 'sukrit'
 
@@ -19,24 +23,39 @@ def port_test(port, host, protocol='tcp', timeout_ms=DEFAULT_TIMEOUT_MS):
         port = int(port)
     sock_type = socket.SOCK_DGRAM if protocol == 'udp' else socket.SOCK_STREAM
     sock = socket.socket(socket.AF_INET, sock_type)
-    sock.settimeout(timeout_ms)
+    sock.settimeout(timeout_ms/1000)
+    target = '%s:%s' % (host, port)
     try:
         sock.connect((host, port))
         sock.shutdown(socket.SHUT_RDWR)
         sock.close()
+        get_failure_log().passed(target)
         return True
     except:
-        logger.exception('Port test failed for host: %s port: %s.', host, port)
+        get_failure_log().failed(
+            target, 'Port test failed for host: %s port: %s.', host, port,
+            exc_info=True, level=logging.ERROR)
         return False
 
 
 def http_test(port, host, path='/health', timeout_ms=DEFAULT_TIMEOUT_MS):
     check_url = 'http://%s:%s%s' % (host, port, path)
     try:
-        urlopen(check_url, None, timeout_ms/1000)
+        status = get_http_pool().get_status(host, port, path,
+                                            timeout_ms/1000)
+        # Redirects left after following them (e.g. to https or a redirect
+        # loop) are not healthy
+        if status >= 300:
+            get_failure_log().failed(
+                check_url, 'Deployment test failed for %s with status %d',
+                check_url, status)
+            return False
+        get_failure_log().passed(check_url)
         return True
     except:
-        logger.exception("Deployment test failed for %s", check_url)
+        get_failure_log().failed(
+            check_url, 'Deployment test failed for %s', check_url,
+            exc_info=True, level=logging.ERROR)
         return False
 
 
@@ -113,6 +132,58 @@ def map_proxy_host(proxy_host):
     return proxy_host
 
 
+def start_proxy_host_refresh(proxy_host, mapped_host, on_change, interval):
+    """
+    Re-maps the proxy host periodically (in background) and invokes on_change
+    with the new host if the mapped value changes. Nothing is started for
+    proxy hosts that do not need mapping.
+
+    :param proxy_host: Proxy host to be mapped. e.g.:
+        ec2:meta-data:public-hostname
+    :type proxy_host: str
+    :param mapped_host: Currently mapped host
+    :type mapped_host: str
+    :param on_change: Function invoked with the new host
+    :type on_change: function
+    :param interval: Interval in seconds
+    :type interval: int
+    :return: Refresh thread (None if the host does not need mapping)
+    :rtype: threading.Thread
+    """
+    if not proxy_host.lower().startswith('ec2:meta-data:'):
+        return None
+
+    def refresh():
+        current = mapped_host
+        while True:
+            time.sleep(interval)
+            try:
+                current = remap_proxy_host(proxy_host, current, on_change)
+            except Exception:
+                logger.exception('Failed to refresh proxy host %s',
+                                 proxy_host)
+
+    thread = threading.Thread(target=refresh, name='proxy-host-refresh')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def remap_proxy_host(proxy_host, current, on_change):
+    """
+    Maps the proxy host and invokes on_change if it differs from current.
+
+    :return: Mapped host
+    :rtype: str
+    """
+    mapped_host = map_proxy_host(proxy_host)
+    if mapped_host != current:
+        logger.info('Proxy host %s changed from %s to %s', proxy_host,
+                    current, mapped_host)
+        on_change(mapped_host)
+    return mapped_host
+
+
 def init_shutdown_handler(cleanup=None, args=None, kwargs=None):
 
     def shutdown(_signo, _stack_frame):
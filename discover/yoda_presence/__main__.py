@@ -1,52 +1,144 @@
-from discover.util import port_test, map_proxy_host, init_shutdown_handler
+from discover.util import port_test, map_proxy_host, init_shutdown_handler, \
+    start_proxy_host_refresh
 
 import os
 import argparse
+import json
 from discover import logger
+from discover.clients import yoda_client, etcd_client, reconnect_on_failure
+from discover.ec2_metadata import add_metadata_arguments, \
+    init_instance_metadata
+from discover.etcd3_leases import leased_keys, close_leased_keys, \
+    is_etcd3, add_etcd3_arguments, validate_etcd_api
+from discover.logs import add_logging_arguments, init_logging
+from discover.metrics import get_metrics, add_metrics_arguments, \
+    init_metrics
+from discover.scheduler import AdaptiveSchedule
+from discover.profiling import add_profiling_arguments, \
+    init_profile_handler
+from discover.tracing import trace, span, add_tracing_arguments, \
+    init_tracing
+from discover.yoda_presence.load import sample_load
 import random
 import sys
-import yoda
 import time
 
 __author__ = 'sukrit'
 
+# Etcd v3 key used for the proxy node
+PROXY_NODE_KEY_FORMAT = '{etcd_base}/proxy-nodes/{node_name}'
 
-def yoda_client(parsed_args):
-    return yoda.Client(etcd_host=parsed_args.etcd_host,
-                       etcd_port=parsed_args.etcd_port,
-                       etcd_base=parsed_args.etcd_base)
 
+def proxy_node_key(parsed_args):
+    return PROXY_NODE_KEY_FORMAT.format(etcd_base=parsed_args.etcd_base,
+                                        node_name=parsed_args.node_name)
 
+
+@reconnect_on_failure
 def on_delete(parsed_args):
-    yoda_cl = yoda_client(parsed_args)
     logger.info("Removing proxy node on exit %s", parsed_args.node_name)
+    if is_etcd3(parsed_args):
+        # Revoking the lease removes the proxy node (and its load)
+        close_leased_keys()
+        return
+    yoda_cl = yoda_client(parsed_args)
     yoda_cl.remove_proxy_node(parsed_args.node_name)
 
 
-def discover_proxy_nodes(parsed_args, poll=None):
-    logger.info('Started discovery for proxy node: %s', parsed_args.node_name)
-    poll = poll or (lambda: True)
-    while poll():
-        yoda_cl = yoda_client(parsed_args)
-        port_test_passed = True
-        for port in parsed_args.check_ports:
-            if not port_test(port, parsed_args.proxy_host):
-                logger.warn("Port test failed for %s:%s",
-                            parsed_args.proxy_host, port)
-                port_test_passed = False
-                break
-
+@reconnect_on_failure
+def discover_proxy_node(parsed_args, port_test_passed):
+    if is_etcd3(parsed_args):
+        leased = leased_keys(parsed_args)
         if port_test_passed:
-            logger.info("Registering proxy node to etcd: %s with host:%s",
-                        parsed_args.node_name, parsed_args.proxy_host)
-            yoda_cl.discover_proxy_node(parsed_args.node_name,
-                                        host=parsed_args.proxy_host)
-        else:
+            leased.put(proxy_node_key(parsed_args), parsed_args.proxy_host)
+        elif proxy_node_key(parsed_args) in leased:
             logger.info("Removing proxy node (port test failed) %s",
                         parsed_args.node_name)
-            yoda_cl.remove_proxy_node(parsed_args.node_name)
+            leased.delete(proxy_node_key(parsed_args))
+        return
+    yoda_cl = yoda_client(parsed_args)
+    if port_test_passed:
+        logger.info("Registering proxy node to etcd: %s with host:%s",
+                    parsed_args.node_name, parsed_args.proxy_host)
+        yoda_cl.discover_proxy_node(parsed_args.node_name,
+                                    host=parsed_args.proxy_host)
+    else:
+        logger.info("Removing proxy node (port test failed) %s",
+                    parsed_args.node_name)
+        yoda_cl.remove_proxy_node(parsed_args.node_name)
+
+
+@reconnect_on_failure
+def publish_load(parsed_args):
+    """
+    Samples the load of the proxy node and publishes it under a separate key
+    (<etcd_base>/proxy-nodes-load/<node_name>) so that watchers of the proxy
+    nodes are not woken up on every sample.
+
+    :param parsed_args: Parsed arguments
+    :return: Published load (None if load could not be sampled)
+    :rtype: float
+    """
+    with span('load_sample'):
+        load = sample_load(parsed_args.check_ports,
+                           stats_url=parsed_args.load_stats_url)
+    if load is None:
+        logger.warn('Could not sample load for proxy node %s',
+                    parsed_args.node_name)
+        return None
+    load_key = '%s/proxy-nodes-load/%s' % (parsed_args.etcd_base,
+                                           parsed_args.node_name)
+    logger.debug('Publishing load %s for proxy node %s', load,
+                 parsed_args.node_name)
+    with span('etcd_write'):
+        if is_etcd3(parsed_args):
+            leased_keys(parsed_args).put(
+                load_key, json.dumps({'connections': load}))
+        else:
+            etcd_client(parsed_args.etcd_host, parsed_args.etcd_port).set(
+                load_key, json.dumps({'connections': load}),
+                ttl=parsed_args.poll_interval * 3)
+    get_metrics().gauge('proxy_connections',
+                        'Active connections of the proxy node').set(
+        load, node=parsed_args.node_name)
+    return load
 
-        time.sleep(parsed_args.poll_interval)
+
+def discover_proxy_nodes(parsed_args, poll=None):
+    logger.info('Started discovery for proxy node: %s', parsed_args.node_name)
+    schedule = AdaptiveSchedule(
+        parsed_args.poll_interval,
+        min_interval=max(parsed_args.poll_interval // 4, 1),
+        max_interval=parsed_args.poll_interval)
+    next_run = schedule.first_run()
+    metrics = get_metrics()
+    poll = poll or (lambda: True)
+    while poll():
+        time.sleep(max(next_run - time.time(), 0))
+        metrics.gauge('poll_lag_seconds',
+                      'Delay of the last poll behind its schedule').set(
+            max(time.time() - next_run, 0), node=parsed_args.node_name)
+        with trace('discover_proxy_nodes', node=parsed_args.node_name):
+            port_test_passed = True
+            for port in parsed_args.check_ports:
+                started = time.time()
+                with span('port_test'):
+                    passed = port_test(port, parsed_args.proxy_host)
+                metrics.observe('port_test', time.time() - started,
+                                'passed' if passed else 'failed', port=port)
+                if not passed:
+                    logger.warn("Port test failed for %s:%s",
+                                parsed_args.proxy_host, port)
+                    port_test_passed = False
+                    break
+
+            with metrics.timed('discover_proxy_node',
+                               registered=port_test_passed), \
+                    span('etcd_write'):
+                discover_proxy_node(parsed_args, port_test_passed)
+            if port_test_passed and parsed_args.publish_load:
+                publish_load(parsed_args)
+        next_run = schedule.next_run(port_test_passed)
 
 
 def create_parser():
@@ -79,17 +171,37 @@ def create_parser():
         '--poll-interval', metavar='<POLL_INTERVAL">',
         help='Poll interval in seconds', type=int,
         default=180)
+    parser.add_argument(
+        '--publish-load', action='store_true',
+        default=os.environ.get('PUBLISH_LOAD', '').lower() in
+        ('1', 'true', 'yes'),
+        help='Publish the load (active connections) of the proxy node to '
+             'etcd for load aware route53 weights')
+    parser.add_argument(
+        '--load-stats-url', metavar='<LOAD_STATS_URL>',
+        default=os.environ.get('LOAD_STATS_URL'),
+        help='Local stats url (e.g. nginx stub_status) used for the load. '
+             'Defaults to counting established connections to the check '
+             'ports')
 
     parser.add_argument(
         'proxy_host', metavar='<PROXY_HOST>',
         help='Proxy host that needs to be registered.')
+    add_etcd3_arguments(parser)
+    add_metadata_arguments(parser)
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
+    add_tracing_arguments(parser)
+    add_profiling_arguments(parser)
 
     return parser
 
 
-def main():
+def main(argv=None, prog=None):
     parser = create_parser()
-    parsed_args = parser.parse_args()
+    if prog:
+        parser.prog = prog
+    parsed_args = parser.parse_args(argv)
     if parsed_args.check_ports:
         parsed_args.check_ports = [valid_port for valid_port in
                                    [port.strip() for port in
@@ -98,8 +210,21 @@ def main():
     else:
         parsed_args.check_ports = []
 
-    parsed_args.proxy_host = map_proxy_host(parsed_args.proxy_host)
+    init_logging(parsed_args)
+    init_instance_metadata(parsed_args.metadata_cache_file,
+                           parsed_args.metadata_ttl)
+    proxy_host = parsed_args.proxy_host
+    parsed_args.proxy_host = map_proxy_host(proxy_host)
+    validate_etcd_api(parser, parsed_args)
+    init_metrics(parsed_args)
+    init_tracing(parsed_args.trace, parsed_args.trace_threshold_ms)
+    init_profile_handler(parsed_args.profile_dir, parsed_args.profile_mode)
     init_shutdown_handler(on_delete, args=(parsed_args,))
+    # Proxy node is re-published with the new host on the next poll
+    start_proxy_host_refresh(
+        proxy_host, parsed_args.proxy_host,
+        lambda host: setattr(parsed_args, 'proxy_host', host),
+        parsed_args.metadata_ttl)
     discover_proxy_nodes(parsed_args)
 
 
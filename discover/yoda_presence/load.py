@@ -0,0 +1,105 @@
+"""
+Samples the load (active connections) of the proxy node.
+"""
+import json
+import re
+from urllib.request import urlopen
+
+from discover import logger
+
+PROC_NET_TCP_FILES = ('/proc/net/tcp', '/proc/net/tcp6')
+TCP_ESTABLISHED = '01'
+# nginx stub_status format. e.g.: Active connections: 291
+ACTIVE_CONNECTIONS_FORMAT = r'Active connections:\s*(\d+)'
+DEFAULT_STATS_TIMEOUT = 2
+
+
+def count_connections(ports, proc_files=PROC_NET_TCP_FILES):
+    """
+    Counts the established connections to the given local ports using
+    /proc/net/tcp (and tcp6).
+
+    :param ports: Local ports
+    :type ports: list
+    :param proc_files: Files to be read
+    :type proc_files: tuple
+    :return: Number of established connections
+    :rtype: int
+    """
+    ports = {int(port) for port in ports}
+    connections = 0
+    for proc_file in proc_files:
+        try:
+            with open(proc_file) as tcp_table:
+                # Skip header
+                next(tcp_table, None)
+                for line in tcp_table:
+                    fields = line.split()
+                    if len(fields) < 4 or fields[3] != TCP_ESTABLISHED:
+                        continue
+                    local_port = int(fields[1].rsplit(':', 1)[1], 16)
+                    if local_port in ports:
+                        connections += 1
+        except (IOError, OSError):
+            logger.debug('Could not read %s', proc_file)
+    return connections
+
+
+def parse_stats(body):
+    """
+    Parses the active connections from the stats response. Supports nginx
+    stub_status, a plain number or json with 'connections' key.
+
+    :param body: Response body
+    :type body: str
+    :return: Active connections or None if the body could not be parsed
+    :rtype: float
+    """
+    match = re.search(ACTIVE_CONNECTIONS_FORMAT, body)
+    if match:
+        return float(match.group(1))
+    try:
+        stats = json.loads(body)
+        if isinstance(stats, dict):
+            stats = stats.get('connections')
+        return float(stats)
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_stats_connections(stats_url, timeout=DEFAULT_STATS_TIMEOUT):
+    """
+    Gets the active connections from the local stats url.
+
+    :param stats_url: Stats URL. e.g.: http://localhost:8080/nginx_status
+    :type stats_url: str
+    :param timeout: Timeout in seconds
+    :type timeout: float
+    :return: Active connections or None if stats are not available
+    :rtype: float
+    """
+    try:
+        body = urlopen(stats_url, timeout=timeout).read().decode('utf-8')
+    except Exception:
+        logger.exception('Failed to fetch stats from %s', stats_url)
+        return None
+    return parse_stats(body)
+
+
+def sample_load(check_ports, stats_url=None):
+    """
+    Samples the load of the proxy node. Stats url is used if specified.
+    Otherwise established connections to the check ports are counted.
+
+    :param check_ports: Ports checked for the proxy node
+    :type check_ports: list
+    :param stats_url: Local stats URL (optional)
+    :type stats_url: str
+    :return: Active connections or None if load could not be sampled
+    :rtype: float
+    """
+    if stats_url:
+        return fetch_stats_connections(stats_url)
+    if not check_ports:
+        return None
+    return count_connections(check_ports)
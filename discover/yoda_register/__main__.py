@@ -1,20 +1,56 @@
+import copy
 import json
 import os
 import uuid
 
+import etcd
 import yoda
 import argparse
 import docker
 import time
 
 from discover import logger
-from requests.exceptions import HTTPError
+from discover.clients import yoda_client, etcd_client, \
+    reconnect_on_failure
+from discover.etcd3_leases import leased_keys, close_leased_keys, \
+    is_etcd3, add_etcd3_arguments, validate_etcd_api
+
+from discover.metrics import get_metrics, add_metrics_arguments, \
+    init_metrics
+from discover.profiling import add_profiling_arguments, \
+    init_profile_handler
+from discover.tracing import trace, span, traced, add_tracing_arguments, \
+    init_tracing
+from discover.http_pool import init_http_pool, DEFAULT_MAX_CONNECTIONS
+from discover.logs import get_failure_log, add_logging_arguments, \
+    init_logging
+from discover.health import HealthCheckEngine, HealthState, \
+    LatencyEstimate, split_thresholds, DEFAULT_MAX_CONCURRENT_CHECKS, \
+    DEFAULT_LATENCY_SMOOTHING, DEFAULT_LATENCY_THRESHOLD
+from discover.scheduler import AdaptiveSchedule, max_interval_for_ttl
+from discover.ec2_metadata import add_metadata_arguments, \
+    init_instance_metadata
+from discover.util import map_proxy_host, init_shutdown_handler, \
+    start_proxy_host_refresh
+from discover.yoda_register.containers import ContainerCache, \
+    get_container_info, start_event_watcher
 
-from discover.util import map_proxy_host, health_test, init_shutdown_handler
-
-# Polling interval in seconds
-DISCOVER_POLL_INTERVAL = 45
 DEPLOYMENT_BLUE_GREEN = 'blue-green'
+# Drain modes used on shutdown and when the container stops
+DRAIN_REMOVE = 'remove'
+DRAIN_META = 'meta'
+DEFAULT_DRAIN_SECONDS = 5
+# Etcd key used by yoda for storing the endpoint of a discovered node
+ENDPOINT_KEY_FORMAT = '{etcd_base}/upstreams/{upstream}/endpoints/{node_name}'
+# Etcd v3 keys for the upstream and endpoint meta (json)
+UPSTREAM_KEY_FORMAT = '{etcd_base}/upstreams/{upstream}'
+META_KEY_FORMAT = '{etcd_base}/upstreams/{upstream}/meta/{node_name}'
+# TTL refresh modes. auto: Refresh only if etcd supports it (2.3+). Older
+# etcd ignores the refresh flag and blanks the value of the key.
+ETCD_REFRESH_AUTO = 'auto'
+ETCD_REFRESH_ON = 'on'
+ETCD_REFRESH_OFF = 'off'
+REFRESH_MIN_ETCD_VERSION = (2, 3)
 
 
 def docker_client(parsed_args):
@@ -24,59 +60,603 @@ def docker_client(parsed_args):
         timeout=10)
 
 
-def parse_container_env(env_cfg):
-    parsed_env = dict()
-    for env_entry in env_cfg:
-        env_name, env_value = env_entry.split('=', 1)
-        parsed_env[env_name] = env_value
-    return parsed_env
-
-
-def yoda_client(parsed_args):
-    return yoda.Client(etcd_host=parsed_args.etcd_host,
-                       etcd_port=parsed_args.etcd_port,
-                       etcd_base=parsed_args.etcd_base)
-
-
-def do_register(parsed_args, app_name, app_version, private_port, public_port,
-                deployment_mode, ttl, service_name=None, node_num=None):
+def get_upstream(app_name, app_version, private_port, deployment_mode):
     use_version = app_version if deployment_mode == DEPLOYMENT_BLUE_GREEN \
         else None
-    upstream = yoda.as_upstream(app_name, private_port,
-                                app_version=use_version)
-    endpoint = yoda.as_endpoint(parsed_args.proxy_host, public_port)
+    return yoda.as_upstream(app_name, private_port, app_version=use_version)
+
+
+def get_meta(service_name=None, node_num=None, draining=False,
+             latency_ms=None):
     meta = {}
     if service_name:
         meta['service-name'] = service_name
     if node_num:
         meta['node-num'] = node_num
+    if draining:
+        meta['draining'] = True
+    if latency_ms is not None:
+        meta['latency-ms'] = latency_ms
+    return meta
+
+
+@reconnect_on_failure
+def do_register(parsed_args, app_name, app_version, private_port, public_port,
+                deployment_mode, ttl, service_name=None, node_num=None,
+                draining=False, latency_ms=None):
+    upstream = get_upstream(app_name, app_version, private_port,
+                            deployment_mode)
+    endpoint = yoda.as_endpoint(parsed_args.proxy_host, public_port)
+    meta = get_meta(service_name=service_name, node_num=node_num,
+                    draining=draining, latency_ms=latency_ms)
+    if is_etcd3(parsed_args):
+        # Draining endpoints get their own lease so that they expire after
+        # the drain window (instead of living as long as the process)
+        register_leased(parsed_args, upstream, endpoint, meta,
+                        ttl=ttl if draining else None)
+        return
 
     yoda_client(parsed_args).discover_node(
         upstream, parsed_args.discover_name, endpoint, ttl=ttl, meta=meta)
 
 
+@reconnect_on_failure
 def renew_upstream(parsed_args, app_name, app_version, private_port,
                    deployment_mode, ttl=3600):
-    use_version = app_version if deployment_mode == DEPLOYMENT_BLUE_GREEN \
-        else None
-    upstream = yoda.as_upstream(app_name, private_port,
-                                app_version=use_version)
+    upstream = get_upstream(app_name, app_version, private_port,
+                            deployment_mode)
+    if is_etcd3(parsed_args):
+        # Upstreams are shared by multiple processes. Hence these get their
+        # own lease instead of the one of the process.
+        leased_keys(parsed_args).put_with_ttl(
+            UPSTREAM_KEY_FORMAT.format(etcd_base=parsed_args.etcd_base,
+                                       upstream=upstream), upstream, ttl)
+        return
     yoda_client(parsed_args).renew_upstream(upstream, ttl=ttl)
 
 
-def get_container_info(docker_cl, node_name):
+def register_leased(parsed_args, upstream, endpoint, meta, ttl=None):
+    """
+    Publishes the endpoint (and its meta) attached to the lease of the
+    process (etcd v3). Keys are only written when their value changes.
+    If a TTL is given, the keys are written with their own lease instead.
+
+    :param parsed_args: Parsed arguments
+    :param upstream: Upstream for the endpoint
+    :type upstream: str
+    :param endpoint: Endpoint. e.g.: host:port
+    :type endpoint: str
+    :param meta: Endpoint meta
+    :type meta: dict
+    :param ttl: TTL in seconds for keys with their own lease (e.g. draining
+        endpoints). None to attach the keys to the lease of the process
+    :type ttl: int
+    :return: None
+    """
+    leased = leased_keys(parsed_args)
+    key_args = {'etcd_base': parsed_args.etcd_base, 'upstream': upstream,
+                'node_name': parsed_args.discover_name}
+    endpoint_key = ENDPOINT_KEY_FORMAT.format(**key_args)
+    meta_key = META_KEY_FORMAT.format(**key_args)
+    if ttl is not None:
+        leased.put_with_ttl(endpoint_key, endpoint, ttl)
+        if meta:
+            leased.put_with_ttl(meta_key, json.dumps(meta, sort_keys=True),
+                                ttl)
+        elif meta_key in leased:
+            leased.delete(meta_key)
+        return
+    leased.put(endpoint_key, endpoint)
+    if meta:
+        leased.put(meta_key, json.dumps(meta, sort_keys=True))
+    elif meta_key in leased:
+        leased.delete(meta_key)
+
+
+def supports_refresh(parsed_args):
+    """
+    Checks if the TTL of the keys can be refreshed without re-writing their
+    value (etcd 2.3+ unless forced using --etcd-refresh).
+
+    :param parsed_args: Parsed arguments
+    :rtype: bool
+    """
+    if parsed_args.etcd_refresh != ETCD_REFRESH_AUTO:
+        return parsed_args.etcd_refresh == ETCD_REFRESH_ON
+    try:
+        # Version is cached by the shared client
+        version = etcd_client(parsed_args.etcd_host,
+                              parsed_args.etcd_port).version
+        return tuple(int(part) for part in version.split('.')[:2]) >= \
+            REFRESH_MIN_ETCD_VERSION
+    except Exception:
+        logger.warn('Could not get etcd version. Using full writes instead '
+                    'of TTL refresh', exc_info=True)
+        return False
+
+
+def refresh_node(parsed_args, upstream, ttl, meta=False):
+    """
+    Refreshes the TTL of an already published endpoint (and its meta)
+    without re-writing its value (etcd 2.3+). Watchers are not notified for
+    refreshes.
+
+    :param parsed_args: Parsed arguments
+    :param upstream: Upstream for the endpoint
+    :type upstream: str
+    :param ttl: New TTL in seconds
+    :type ttl: int
+    :param meta: True if the endpoint was published with meta
+    :type meta: bool
+    :return: True if the TTL was refreshed. False if the endpoint needs to be
+        re-published (e.g. it expired meanwhile or refresh is not supported)
+    :rtype: bool
+    """
+    key_args = {'etcd_base': parsed_args.etcd_base, 'upstream': upstream,
+                'node_name': parsed_args.discover_name}
+    node_key = ENDPOINT_KEY_FORMAT.format(**key_args)
+    if is_etcd3(parsed_args):
+        # Kept alive by the lease of the process
+        return node_key in leased_keys(parsed_args)
+    if not supports_refresh(parsed_args):
+        return False
+    keys = [node_key]
+    if meta:
+        keys.append(META_KEY_FORMAT.format(**key_args))
+    try:
+        etcd_cl = etcd_client(parsed_args.etcd_host, parsed_args.etcd_port)
+        for key in keys:
+            etcd_cl.refresh(key, ttl)
+        return True
+    except (KeyError, etcd.EtcdKeyError):
+        return False
+    except etcd.EtcdException:
+        logger.exception('Failed to refresh ttl for %s', node_key)
+        return False
+
+
+def remove_node(parsed_args, upstream):
+    """
+    Removes the published endpoint right away (instead of letting its TTL
+    run out).
+
+    :param parsed_args: Parsed arguments
+    :param upstream: Upstream for the endpoint
+    :type upstream: str
+    :return: None
+    """
+    node_key = ENDPOINT_KEY_FORMAT.format(
+        etcd_base=parsed_args.etcd_base, upstream=upstream,
+        node_name=parsed_args.discover_name)
+    if is_etcd3(parsed_args):
+        leased = leased_keys(parsed_args)
+        leased.delete(node_key)
+        meta_key = META_KEY_FORMAT.format(
+            etcd_base=parsed_args.etcd_base, upstream=upstream,
+            node_name=parsed_args.discover_name)
+        if meta_key in leased:
+            leased.delete(meta_key)
+        return
     try:
-        return docker_cl.inspect_container(node_name)
-    except HTTPError as error:
-        if error.response.status_code == 404:
-            logger.warn('Container with name %s could not be found. '
-                        'Aborting...', node_name)
+        etcd_client(parsed_args.etcd_host, parsed_args.etcd_port).delete(
+            node_key)
+    except (KeyError, etcd.EtcdKeyError):
+        # Already expired or removed
+        pass
+    except etcd.EtcdException:
+        logger.exception('Failed to remove %s. Leaving it to expire.',
+                         node_key)
+
+
+class ContainerRegistration:
+    """
+    Registration state for a single discovered container.
+    """
+
+    def __init__(self, parsed_args, view, health_engine):
+        self.parsed_args = parsed_args
+        self.health_engine = health_engine
+        self.node_name = parsed_args.node_name
+        self.config = config = view.config
+        self.schedule = AdaptiveSchedule(
+            config['poll_interval'],
+            min_interval=config['min_poll_interval'],
+            max_interval=min(config['max_poll_interval'],
+                             max_interval_for_ttl(config['discover_ttl'])),
+            jitter=config['poll_jitter'])
+        self.next_poll = self.schedule.first_run()
+        # Last published (upstream, endpoint, meta) keyed by private port
+        self.published = {}
+        # Public port of the published endpoint keyed by private port
+        self.public_ports = {}
+        # Time (epoch seconds) at which upstream needs to be renewed
+        self.upstream_renewals = {}
+        # Health (with rise/fall hysteresis) keyed by private port
+        self.health = {}
+        # Smoothed latency of passed checks keyed by private port
+        self.latency = {}
+
+    def labels(self, private_port):
+        return {'app': self.config['app_name'], 'port': private_port}
+
+    def count_endpoint(self, private_port, outcome):
+        get_metrics().counter(
+            'endpoints_total',
+            'Number of endpoints registered, failed, skipped or removed') \
+            .inc(outcome=outcome, **self.labels(private_port))
+
+    def record_latency(self, private_port, latency):
+        """
+        Records the latency of a passed check (if latency is published).
+        """
+        if not self.parsed_args.publish_latency or latency is None:
+            return
+        estimate = self.latency.get(private_port)
+        if estimate is None:
+            estimate = self.latency[private_port] = LatencyEstimate(
+                self.parsed_args.latency_smoothing)
+        get_metrics().gauge(
+            'endpoint_latency_seconds',
+            'Smoothed latency of the passed health checks').set(
+            estimate.update(latency), **self.labels(private_port))
+
+    def latency_ms(self, private_port):
+        """
+        Gets the latency to be published in the endpoint meta. It only
+        changes once the smoothed latency moves past the threshold.
+        """
+        estimate = self.latency.get(private_port)
+        if estimate is None:
             return None
+        return estimate.publish(self.parsed_args.latency_threshold)
+
+    def renew_upstream(self, private_port):
+        """
+        Renews the upstream once half of its TTL is elapsed (instead of on
+        every poll).
+        """
+        config = self.config
+        upstream = get_upstream(config['app_name'], config['app_version'],
+                                private_port, config['deployment_mode'])
+        if self.upstream_renewals.get(upstream, 0) > time.time():
+            return
+        with get_metrics().timed('renew_upstream',
+                                 **self.labels(private_port)), \
+                span('etcd_write'):
+            renew_upstream(self.parsed_args, config['app_name'],
+                           config['app_version'], private_port,
+                           config['deployment_mode'],
+                           ttl=config['upstream_ttl'])
+        self.upstream_renewals[upstream] = \
+            time.time() + config['upstream_ttl'] / 2
+
+    def publish(self, private_port, public_port):
+        """
+        Publishes the endpoint. The endpoint is only re-written when the
+        endpoint, meta or version changed since the last write. Otherwise
+        only its TTL is refreshed.
+        """
+        parsed_args = self.parsed_args
+        config = self.config
+        upstream = get_upstream(config['app_name'], config['app_version'],
+                                private_port, config['deployment_mode'])
+        endpoint = yoda.as_endpoint(parsed_args.proxy_host, public_port)
+        latency_ms = self.latency_ms(private_port)
+        state = (upstream, endpoint,
+                 get_meta(service_name=parsed_args.service_name,
+                          node_num=parsed_args.node_num,
+                          latency_ms=latency_ms))
+        metrics = get_metrics()
+        labels = self.labels(private_port)
+        if self.published.get(private_port) == state:
+            with metrics.timed('refresh_node', **labels), \
+                    span('etcd_write'):
+                refreshed = refresh_node(parsed_args, upstream,
+                                         config['discover_ttl'],
+                                         meta=bool(state[2]))
+            if refreshed:
+                logger.debug('Refreshed %s (%s) : %s', self.node_name,
+                             parsed_args.discover_name, endpoint)
+                return
+
+        logger.info('Publishing %s (%s) : %s', self.node_name,
+                    parsed_args.discover_name, endpoint)
+        with metrics.timed('do_register', **labels), span('etcd_write'):
+            do_register(parsed_args, config['app_name'],
+                        config['app_version'], private_port, public_port,
+                        config['deployment_mode'],
+                        ttl=config['discover_ttl'],
+                        node_num=parsed_args.node_num,
+                        service_name=parsed_args.service_name,
+                        latency_ms=latency_ms)
+        self.published[private_port] = state
+        self.public_ports[private_port] = public_port
+
+    def unpublish(self, private_port):
+        """
+        Removes the endpoint for a port that went down.
+        """
+        config = self.config
+        upstream = get_upstream(config['app_name'], config['app_version'],
+                                private_port, config['deployment_mode'])
+        logger.info('Removing %s (%s) for port %s', self.node_name,
+                    self.parsed_args.discover_name, private_port)
+        with get_metrics().timed('remove_node',
+                                 **self.labels(private_port)), \
+                span('etcd_write'):
+            remove_node(self.parsed_args, upstream)
+        self.published.pop(private_port, None)
+        self.public_ports.pop(private_port, None)
+        self.count_endpoint(private_port, 'removed')
+
+    def mark_draining(self, private_port, ttl):
+        """
+        Re-publishes the endpoint with draining meta and a short TTL so that
+        it expires once the drain window is over.
+        """
+        parsed_args = self.parsed_args
+        config = self.config
+        self.published.pop(private_port, None)
+        public_port = self.public_ports.pop(private_port)
+        logger.info('Draining %s (%s) for port %s', self.node_name,
+                    parsed_args.discover_name, private_port)
+        with get_metrics().timed('do_register',
+                                 **self.labels(private_port)), \
+                span('etcd_write'):
+            do_register(parsed_args, config['app_name'],
+                        config['app_version'], private_port, public_port,
+                        config['deployment_mode'], ttl=ttl,
+                        node_num=parsed_args.node_num,
+                        service_name=parsed_args.service_name,
+                        draining=True)
+        self.count_endpoint(private_port, 'draining')
+
+    def deregister(self, mode=DRAIN_REMOVE, drain_seconds=0):
+        """
+        Removes (or marks as draining) all the published endpoints of the
+        container right away instead of waiting for their TTL to run out.
+
+        :param mode: Drain mode. remove: Endpoints are removed from etcd.
+            meta: Endpoints are marked as draining and expire after the drain
+            window
+        :type mode: str
+        :param drain_seconds: Drain window in seconds
+        :type drain_seconds: int
+        :return: Number of deregistered endpoints
+        :rtype: int
+        """
+        private_ports = list(self.published)
+        for private_port in private_ports:
+            if mode == DRAIN_META:
+                self.mark_draining(private_port, max(drain_seconds, 1))
+            else:
+                self.unpublish(private_port)
+        get_metrics().gauge('published_endpoints').set(
+            0, app=self.config['app_name'], node=self.node_name)
+        return len(private_ports)
+
+    def health_checks(self, view):
+        """
+        Gets the health checks for all the exposed ports of the container
+        (renewing their upstreams).
+
+        :param view: Cached view of the container
+        :type view: discover.yoda_register.containers.ContainerView
+        :return: Tuple of (checks, labels) where checks is a list of
+            ((private_port, public_port), port, host, health_check) tuples
+            and labels are the metric labels keyed by check id
+        :rtype: tuple
+        """
+        parsed_args = self.parsed_args
+        config = self.config
+        # Time by which the poll is running behind its schedule
+        get_metrics().gauge(
+            'poll_lag_seconds',
+            'Delay of the last poll behind its schedule').set(
+            max(time.time() - self.next_poll, 0),
+            app=config['app_name'], node=self.node_name)
+        checks = []
+        labels = {}
+        for port_key in view.exposed_ports:
+            private_port, protocol = port_key.split('/')
+            if config['discover_ports'] and \
+                    private_port not in config['discover_ports']:
+                logger.debug('Skip proxy for port %s', private_port)
+                continue
+
+            with span('port_lookup'):
+                public_port = view.public_port(port_key)
+            if not public_port:
+                logger.info('Public port not found for %s. Skipping...',
+                            private_port)
+                self.count_endpoint(private_port, 'skipped')
+                continue
+            # Renew upstream (Whether health check fail or passes)
+            self.renew_upstream(private_port)
+            health_check, rise, fall = split_thresholds(dict(
+                {'protocol': protocol},
+                **config['health_checks'].get(private_port, {})))
+            if private_port not in self.health:
+                self.health[private_port] = HealthState(rise=rise, fall=fall)
+            check_id = (private_port, public_port)
+            checks.append((check_id, int(public_port),
+                           parsed_args.proxy_host, health_check))
+            labels[check_id] = self.labels(private_port)
+        return checks, labels
+
+    def record_check(self, private_port, public_port, passed, latency):
+        """
+        Records the result of a health check and publishes (or removes) the
+        endpoint accordingly.
+
+        :return: True if the check passed
+        :rtype: bool
+        """
+        health = self.health[private_port]
+        changed = health.record(passed)
+        check_target = 'Node %s:%s->%s' % (self.node_name, public_port,
+                                           private_port)
+        if passed:
+            get_failure_log().passed(check_target)
+            self.record_latency(private_port, latency)
         else:
-            raise
-
-
-def docker_container_poll(parsed_args, poll=None):
+            get_failure_log().failed(
+                check_target, 'Health check failed for node %s:%s->%s '
+                '(%d/%d)', self.node_name, public_port, private_port,
+                health.failures, health.fall)
+        if health.up:
+            self.publish(private_port, public_port)
+            self.count_endpoint(private_port,
+                                'registered' if passed else 'failed')
+        elif changed:
+            self.unpublish(private_port)
+        elif passed:
+            logger.info('Health check passed for node %s:%s->%s. '
+                        'Waiting for %d/%d passed checks before '
+                        'publishing', self.node_name, public_port,
+                        private_port, health.successes, health.rise)
+            self.count_endpoint(private_port, 'skipped')
+        else:
+            self.count_endpoint(private_port, 'failed')
+        return passed
+
+    def schedule_next(self, all_healthy):
+        """
+        Schedules the next registration pass (after all the checks of this
+        pass are recorded).
+        """
+        get_metrics().gauge(
+            'published_endpoints',
+            'Number of endpoints currently published').set(
+            len(self.published), app=self.config['app_name'],
+            node=self.node_name)
+        self.next_poll = self.schedule.next_run(all_healthy)
+
+    def register(self, view):
+        """
+        Performs a single registration pass for all exposed ports of the
+        container. Health checks for all the ports run concurrently. An
+        endpoint is published after `rise` consecutive passed checks and
+        removed after `fall` consecutive failed checks (DISCOVER_HEALTH).
+
+        :param view: Cached view of the container
+        :type view: discover.yoda_register.containers.ContainerView
+        :return: None
+        """
+        register_all(self.health_engine, [(self, view)])
+
+
+def register_all(health_engine, due):
+    """
+    Performs a registration pass for all the given containers. Health checks
+    of all the containers run at once (bounded by the concurrency cap of the
+    engine) so that a slow or hung container does not delay the others.
+
+    :param health_engine: Health check engine
+    :type health_engine: discover.health.HealthCheckEngine
+    :param due: List of (registration, view) tuples
+    :type due: list
+    :return: None
+    """
+    checks = []
+    labels = {}
+    all_healthy = {}
+    for index, (registration, view) in enumerate(due):
+        all_healthy[index] = True
+        registration_checks, registration_labels = \
+            registration.health_checks(view)
+        for check_id, port, host, health_check in registration_checks:
+            checks.append(((index,) + check_id, port, host, health_check))
+            labels[(index,) + check_id] = registration_labels[check_id]
+
+    for (index, private_port, public_port), passed, latency in traced(
+            health_engine.run_timed(checks, labels=labels), 'health_check'):
+        passed = due[index][0].record_check(private_port, public_port,
+                                            passed, latency)
+        all_healthy[index] = all_healthy[index] and passed
+
+    for index, (registration, _view) in enumerate(due):
+        registration.schedule_next(all_healthy[index])
+
+
+def container_args(parsed_args, view):
+    """
+    Creates the per container arguments used for registering a container
+    discovered by the host wide daemon.
+
+    :param parsed_args: Daemon arguments
+    :param view: Cached view of the container
+    :type view: discover.yoda_register.containers.ContainerView
+    :return: Copy of parsed arguments for the given container
+    """
+    args = copy.copy(parsed_args)
+    args.node_name = view.name
+    args.discover_name = view.name
+    args.node_num = view.config['node_num'] or parsed_args.node_num
+    args.service_name = view.config['service_name'] or \
+        parsed_args.service_name
+    return args
+
+
+def drain_registrations(parsed_args, registrations):
+    """
+    Deregisters all the containers on shutdown and waits for the drain window
+    so that in-flight requests complete before the process exits.
+
+    :param parsed_args: Parsed arguments
+    :param registrations: Registrations keyed by container id
+    :type registrations: dict
+    :return: None
+    """
+    deregistered = 0
+    for registration in list(registrations.values()):
+        try:
+            deregistered += registration.deregister(
+                parsed_args.drain_mode, parsed_args.drain_seconds)
+        except Exception:
+            logger.exception('Failed to deregister %s. Leaving it to expire.',
+                             registration.node_name)
+    if deregistered and parsed_args.drain_seconds > 0:
+        logger.info('Deregistered %d endpoint(s). Draining for %ds',
+                    deregistered, parsed_args.drain_seconds)
+        time.sleep(parsed_args.drain_seconds)
+    if is_etcd3(parsed_args):
+        # Removes whatever is still attached to the lease
+        close_leased_keys()
+
+
+def update_proxy_host(parsed_args, registrations, proxy_host):
+    """
+    Switches the registrations to the new (re-mapped) proxy host. Endpoints
+    get re-published on the next poll as their value changed.
+
+    :param parsed_args: Parsed arguments
+    :param registrations: Registrations keyed by container id
+    :type registrations: dict
+    :param proxy_host: New proxy host
+    :type proxy_host: str
+    :return: None
+    """
+    parsed_args.proxy_host = proxy_host
+    now = time.time()
+    for registration in list(registrations.values()):
+        registration.parsed_args.proxy_host = proxy_host
+        registration.next_poll = min(registration.next_poll, now)
+
+
+def docker_container_poll(parsed_args, poll=None, registrations=None):
+    """
+    Registers a single container (sidecar mode).
+
+    :param parsed_args: Parsed arguments
+    :param poll: Lambda or function that evaluates if polling should
+        continue. Added for ease of unit testing
+    :type poll: function
+    :param registrations: Dict to which the registration (keyed by container
+        id) is added so that it can be drained on shutdown
+    :type registrations: dict
+    :return: None
+    """
     logger.info('Started discovery for %s (discover_name: %s)',
                 parsed_args.node_name, parsed_args.discover_name)
     docker_cl = docker_client(parsed_args)
@@ -84,78 +664,127 @@ def docker_container_poll(parsed_args, poll=None):
     if not container_info:
         return
 
-    env_cfg = container_info['Config']['Env']
-    parsed_env = parse_container_env(env_cfg)
-
-    app_name = parsed_env.get('DISCOVER_APP_NAME', 'not-set')
-    app_version = parsed_env.get('DISCOVER_APP_VERSION')
-    health_checks = parsed_env.get('DISCOVER_HEALTH', '{}')
-    deployment_mode = parsed_env.get('DISCOVER_MODE', 'blue-green').lower()
-    health_checks = json.loads(health_checks) if health_checks else {}
-    discover_ports = parsed_env.get('DISCOVER_PORTS', '')
-    discover_ports = [valid_port for valid_port in
-                      [port.strip() for port in discover_ports.split(',')]
-                      if valid_port]
-    poll_interval = int(parsed_env.get('DISCOVER_POLL_INTERVAL',
-                                       DISCOVER_POLL_INTERVAL))
-
-    # Set default ttl to 4 times the poll_interval (plus buffer) which
-    # gives 4 chances for bad node to survive bad health test
-    discover_ttl = int(parsed_env.get('DISCOVER_TTL', poll_interval*4+10))
-    upstream_ttl = int(parsed_env.get('DISCOVER_UPSTREAM_TTL', '86400'))
-
+    container_id = container_info['Id']
+    cache = ContainerCache(docker_cl, container_filter=lambda cid:
+                           cid == container_id)
+    start_event_watcher(lambda: docker_client(parsed_args), cache)
+    view = cache.get(container_id) or cache.refresh(container_id)
+    if not view:
+        return
+    health_engine = HealthCheckEngine(parsed_args.max_concurrent_checks)
+    registration = ContainerRegistration(parsed_args, view, health_engine)
+    if registrations is not None:
+        registrations[container_id] = registration
     poll = poll or (lambda: True)
 
     while poll():
-        container_info = get_container_info(docker_cl, parsed_args.node_name)
-        if not container_info:
-            return
+        with trace('docker_container_poll', node=parsed_args.node_name):
+            with span('inspect'):
+                view = cache.get(container_id)
+            if not view or not view.running:
+                # A removed container (e.g. docker rm -f sends die and
+                # destroy back to back) is drained like a stopped one
+                logger.info('Stopping container poll (Main node is not '
+                            '%s) %s', 'running' if view else 'found',
+                            parsed_args.node_name)
+                if registration.deregister(parsed_args.drain_mode,
+                                           parsed_args.drain_seconds) and \
+                        parsed_args.drain_seconds > 0:
+                    logger.info('Draining for %ds',
+                                parsed_args.drain_seconds)
+                    time.sleep(parsed_args.drain_seconds)
+                break
+
+            version = cache.version
+            if registration.next_poll <= time.time():
+                registration.register(view)
+        # Sleep till the next poll. Wake up early if the container changes
+        # (e.g. it dies)
+        cache.wait(version, max(registration.next_poll - time.time(), 0))
+
+
+def sync_registrations(parsed_args, cache, registrations, health_engine):
+    """
+    Syncs the registrations with the discoverable containers currently
+    running on the host. Registrations for new containers are added and the
+    ones for containers that are no longer running are dropped.
+
+    :param parsed_args: Daemon arguments
+    :param cache: Container cache
+    :type cache: discover.yoda_register.containers.ContainerCache
+    :param registrations: Registrations keyed by container id
+    :type registrations: dict
+    :param health_engine: Health check engine shared by all containers
+    :type health_engine: discover.health.HealthCheckEngine
+    :return: None
+    """
+    running_ids = set()
+    for view in cache.all():
+        if not view.running or not view.discoverable:
+            continue
+        running_ids.add(view.id)
+        if view.id not in registrations:
+            args = container_args(parsed_args, view)
+            logger.info('Started discovery for %s (discover_name: %s)',
+                        args.node_name, args.discover_name)
+            registrations[view.id] = ContainerRegistration(args, view,
+                                                           health_engine)
+
+    for container_id in set(registrations) - running_ids:
+        registration = registrations.pop(container_id)
+        logger.info('Stopping container poll (Container is not running) %s',
+                    registration.node_name)
+        try:
+            registration.deregister(parsed_args.drain_mode,
+                                    parsed_args.drain_seconds)
+        except Exception:
+            logger.exception('Failed to deregister %s. Leaving it to expire.',
+                             registration.node_name)
+        labels = {'app': registration.config['app_name'],
+                  'node': registration.node_name}
+        metrics = get_metrics()
+        metrics.gauge('poll_lag_seconds').remove(**labels)
+        metrics.gauge('published_endpoints').remove(**labels)
+
+
+def docker_host_poll(parsed_args, poll=None, registrations=None):
+    """
+    Registers all discoverable containers running on the docker host from a
+    single process.
+
+    :param parsed_args: Parsed arguments
+    :param poll: Lambda or function that evaluates if polling should
+        continue. Added for ease of unit testing
+    :type poll: function
+    :param registrations: Dict in which registrations (keyed by container id)
+        are kept so that they can be drained on shutdown
+    :type registrations: dict
+    :return: None
+    """
+    logger.info('Started discovery for all containers on %s',
+                parsed_args.docker_url)
+    cache = ContainerCache(docker_client(parsed_args))
+    start_event_watcher(lambda: docker_client(parsed_args), cache)
+    registrations = {} if registrations is None else registrations
+    health_engine = HealthCheckEngine(parsed_args.max_concurrent_checks)
+    poll = poll or (lambda: True)
 
-        if container_info['State']['Running']:
-            for port_key in container_info['Config']['ExposedPorts']:
-                private_port, protocol = port_key.split('/')
-                if discover_ports and private_port not in discover_ports:
-                    logger.debug('Skip proxy for port %s', private_port)
-                    continue
-
-                docker_port = \
-                    docker_cl.port(parsed_args.node_name,
-                                   private_port)
-                if docker_port:
-                    public_port = docker_port[0]['HostPort']
-                else:
-                    logger.info('Public port not found for %s. Skipping...',
-                                private_port)
-                    continue
-                # Renew upstream (Whether health check fail or passes)
-                renew_upstream(parsed_args, app_name, app_version,
-                               private_port, deployment_mode, ttl=upstream_ttl)
-                health_check = health_checks.get(private_port, {})
-                if health_test(int(public_port), parsed_args.proxy_host,
-                               protocol=protocol, **health_check):
-                    endpoint = yoda.as_endpoint(parsed_args.proxy_host,
-                                                public_port)
-
-                    logger.info('Publishing %s (%s) : %s',
-                                parsed_args.node_name,
-                                parsed_args.discover_name,
-                                endpoint)
-
-                    do_register(parsed_args, app_name, app_version,
-                                private_port, public_port, deployment_mode,
-                                ttl=discover_ttl,
-                                node_num=parsed_args.node_num,
-                                service_name=parsed_args.service_name)
-
-                else:
-                    logger.warn('Health check failed for node %s:%s->%s',
-                                parsed_args.node_name, public_port,
-                                private_port)
-            time.sleep(poll_interval)
-        else:
-            logger.info('Stopping container poll (Main node is not running)%s',
-                        parsed_args.node_name)
-            break
+    while poll():
+        version = cache.version
+        sync_registrations(parsed_args, cache, registrations, health_engine)
+        due = []
+        for container_id, registration in list(registrations.items()):
+            view = cache.get(container_id)
+            if view and registration.next_poll <= time.time():
+                due.append((registration, view))
+        if due:
+            # Checks of all the due containers run at once
+            with trace('docker_host_poll', containers=len(due)):
+                register_all(health_engine, due)
+        next_poll = min([registration.next_poll for registration in
+                         registrations.values()] or [time.time() + 60])
+        # Sleep till the next registration is due or a container changes
+        cache.wait(version, max(next_poll - time.time(), 0))
 
 
 def create_parser():
@@ -196,18 +825,105 @@ def create_parser():
         help='Node name to be used for discovery. If not specified a random '
              'uuid is used')
     parser.add_argument(
-        'node_name', metavar='<NODE_NAME>',
-        help='Container name to be discovered')
+        '--max-concurrent-checks', metavar='<MAX_CONCURRENT_CHECKS>',
+        default=os.environ.get('DISCOVER_MAX_CONCURRENT_CHECKS',
+                               DEFAULT_MAX_CONCURRENT_CHECKS), type=int,
+        help='Maximum number of health checks running concurrently '
+             '(defaults to %d)' % DEFAULT_MAX_CONCURRENT_CHECKS)
+    parser.add_argument(
+        '--max-http-connections', metavar='<MAX_HTTP_CONNECTIONS>',
+        default=os.environ.get('DISCOVER_MAX_HTTP_CONNECTIONS',
+                               DEFAULT_MAX_CONNECTIONS), type=int,
+        help='Maximum number of open (keep-alive) connections used for http '
+             'health checks (defaults to %d)' % DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument(
+        '--all-containers', action='store_true',
+        default=os.environ.get('DISCOVER_ALL_CONTAINERS', '').lower() in
+        ('1', 'true', 'yes'),
+        help='Discover all containers (with DISCOVER_* env) running on the '
+             'docker host from a single process')
+    parser.add_argument(
+        '--drain-mode', choices=(DRAIN_REMOVE, DRAIN_META),
+        default=os.environ.get('DISCOVER_DRAIN_MODE', DRAIN_REMOVE),
+        help='On shutdown or container stop, remove the endpoints (remove) '
+             'or mark them as draining in meta till the drain window is over '
+             '(meta). Defaults to remove')
+    parser.add_argument(
+        '--drain-seconds', metavar='<DRAIN_SECONDS>',
+        default=os.environ.get('DISCOVER_DRAIN_SECONDS',
+                               DEFAULT_DRAIN_SECONDS), type=int,
+        help='Drain window (in seconds) to wait for in-flight requests after '
+             'deregistration before exiting (defaults to %d)' %
+             DEFAULT_DRAIN_SECONDS)
+    parser.add_argument(
+        '--etcd-refresh',
+        choices=(ETCD_REFRESH_AUTO, ETCD_REFRESH_ON, ETCD_REFRESH_OFF),
+        default=os.environ.get('DISCOVER_ETCD_REFRESH', ETCD_REFRESH_AUTO),
+        help='Refresh only the TTL of unchanged endpoints (on) or re-write '
+             'them (off). auto refreshes if etcd supports it (2.3+). '
+             'Defaults to auto')
+    parser.add_argument(
+        '--publish-latency', action='store_true',
+        default=os.environ.get('DISCOVER_PUBLISH_LATENCY', '').lower() in
+        ('1', 'true', 'yes'),
+        help='Publish the smoothed health check latency (latency-ms) in the '
+             'endpoint meta so that the proxy can prefer faster backends')
+    parser.add_argument(
+        '--latency-smoothing', metavar='<LATENCY_SMOOTHING>', type=float,
+        default=os.environ.get('DISCOVER_LATENCY_SMOOTHING',
+                               DEFAULT_LATENCY_SMOOTHING),
+        help='Weight (0-1) of the latest check in the smoothed latency '
+             '(defaults to %s)' % DEFAULT_LATENCY_SMOOTHING)
+    parser.add_argument(
+        '--latency-threshold', metavar='<LATENCY_THRESHOLD>', type=float,
+        default=os.environ.get('DISCOVER_LATENCY_THRESHOLD',
+                               DEFAULT_LATENCY_THRESHOLD),
+        help='Relative change of the smoothed latency needed before the '
+             'endpoint meta is re-written (defaults to %s)' %
+             DEFAULT_LATENCY_THRESHOLD)
+    add_etcd3_arguments(parser)
+    add_metadata_arguments(parser)
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
+    add_tracing_arguments(parser)
+    add_profiling_arguments(parser)
+    parser.add_argument(
+        'node_name', metavar='<NODE_NAME>', nargs='?',
+        help='Container name to be discovered. Required unless '
+             '--all-containers is specified')
     return parser
 
 
-def main():
+def main(argv=None, prog=None):
     parser = create_parser()
-    parsed_args = parser.parse_args()
-    parsed_args.proxy_host = map_proxy_host(parsed_args.proxy_host)
-
-    init_shutdown_handler()
-    docker_container_poll(parsed_args)
+    if prog:
+        parser.prog = prog
+    parsed_args = parser.parse_args(argv)
+    init_logging(parsed_args)
+    init_instance_metadata(parsed_args.metadata_cache_file,
+                           parsed_args.metadata_ttl)
+    proxy_host = parsed_args.proxy_host
+    parsed_args.proxy_host = map_proxy_host(proxy_host)
+    validate_etcd_api(parser, parsed_args)
+
+    init_http_pool(max_connections=parsed_args.max_http_connections)
+    init_metrics(parsed_args)
+    init_tracing(parsed_args.trace, parsed_args.trace_threshold_ms)
+    init_profile_handler(parsed_args.profile_dir, parsed_args.profile_mode)
+    registrations = {}
+    init_shutdown_handler(drain_registrations,
+                          args=(parsed_args, registrations))
+    start_proxy_host_refresh(
+        proxy_host, parsed_args.proxy_host,
+        lambda host: update_proxy_host(parsed_args, registrations, host),
+        parsed_args.metadata_ttl)
+    if parsed_args.all_containers:
+        docker_host_poll(parsed_args, registrations=registrations)
+    elif parsed_args.node_name:
+        docker_container_poll(parsed_args, registrations=registrations)
+    else:
+        parser.error('<NODE_NAME> is required unless --all-containers is '
+                     'specified')
 
 
 if __name__ == "__main__":
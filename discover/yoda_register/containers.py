@@ -0,0 +1,344 @@
+"""
+Cached view of docker containers kept up to date using the docker events
+stream.
+"""
+import json
+import threading
+import time
+
+from requests.exceptions import HTTPError
+
+from discover import logger
+from discover.logs import get_failure_log
+from discover.scheduler import DEFAULT_JITTER
+from discover.tracing import trace, span
+
+# Polling interval in seconds
+DISCOVER_POLL_INTERVAL = 45
+DISCOVER_ENV_PREFIX = 'DISCOVER_'
+
+# Events that require the container to be re-inspected. A kill event is
+# also emitted for signals that do not stop the container (e.g. HUP) and a
+# paused container is still running (its health checks fail instead).
+REFRESH_EVENTS = ('start', 'restart', 'kill', 'pause', 'unpause',
+                  'health_status')
+# Events after which the container is no longer running
+STOP_EVENTS = ('die', 'stop', 'destroy')
+
+# Delay in seconds before reconnecting to a broken events stream
+EVENTS_RECONNECT_DELAY = 5
+
+
+def parse_container_env(env_cfg):
+    parsed_env = dict()
+    for env_entry in env_cfg:
+        env_name, env_value = env_entry.split('=', 1)
+        parsed_env[env_name] = env_value
+    return parsed_env
+
+
+def parse_discover_config(container_info):
+    """
+    Parses the discover configuration (DISCOVER_* environment) for the given
+    container.
+
+    :param container_info: Container info as returned by docker inspect
+    :type container_info: dict
+    :return: Parsed discover configuration
+    :rtype: dict
+    """
+    parsed_env = parse_container_env(container_info['Config']['Env'] or [])
+    health_checks = parsed_env.get('DISCOVER_HEALTH', '{}')
+    discover_ports = parsed_env.get('DISCOVER_PORTS', '')
+    poll_interval = int(parsed_env.get('DISCOVER_POLL_INTERVAL',
+                                       DISCOVER_POLL_INTERVAL))
+    return {
+        # Interval is shortened while failing or newly started and
+        # lengthened (bounded by the TTL) while stable
+        'min_poll_interval': int(parsed_env.get(
+            'DISCOVER_MIN_POLL_INTERVAL', max(poll_interval // 3, 1))),
+        'max_poll_interval': int(parsed_env.get(
+            'DISCOVER_MAX_POLL_INTERVAL', poll_interval * 2)),
+        'poll_jitter': float(parsed_env.get('DISCOVER_POLL_JITTER',
+                                            DEFAULT_JITTER)),
+        'app_name': parsed_env.get('DISCOVER_APP_NAME', 'not-set'),
+        'app_version': parsed_env.get('DISCOVER_APP_VERSION'),
+        'deployment_mode': parsed_env.get('DISCOVER_MODE',
+                                          'blue-green').lower(),
+        'health_checks': json.loads(health_checks) if health_checks else {},
+        'discover_ports': [valid_port for valid_port in
+                           [port.strip() for port in discover_ports.split(',')]
+                           if valid_port],
+        'poll_interval': poll_interval,
+        # Set default ttl to 4 times the poll_interval (plus buffer) which
+        # gives 4 chances for bad node to survive bad health test
+        'discover_ttl': int(parsed_env.get('DISCOVER_TTL',
+                                           poll_interval*4+10)),
+        'upstream_ttl': int(parsed_env.get('DISCOVER_UPSTREAM_TTL', '86400')),
+        'node_num': parsed_env.get('DISCOVER_NODE_NUM'),
+        'service_name': parsed_env.get('DISCOVER_SERVICE_NAME'),
+    }
+
+
+def is_discoverable(container_info):
+    """
+    Checks if the container carries discover configuration (DISCOVER_* env).
+
+    :param container_info: Container info as returned by docker inspect
+    :type container_info: dict
+    :rtype: bool
+    """
+    return any(env_entry.startswith(DISCOVER_ENV_PREFIX)
+               for env_entry in container_info['Config']['Env'] or [])
+
+
+def parse_port_mappings(container_info):
+    """
+    Parses the public port mappings from NetworkSettings.Ports
+
+    :param container_info: Container info as returned by docker inspect
+    :type container_info: dict
+    :return: Public host port keyed by exposed port (e.g. 8080/tcp)
+    :rtype: dict
+    """
+    network_ports = (container_info.get('NetworkSettings') or {}) \
+        .get('Ports') or {}
+    return {port_key: host_ports[0]['HostPort']
+            for port_key, host_ports in network_ports.items()
+            if host_ports}
+
+
+def get_container_info(docker_cl, node_name):
+    try:
+        return docker_cl.inspect_container(node_name)
+    except HTTPError as error:
+        if error.response.status_code == 404:
+            logger.warn('Container with name %s could not be found. '
+                        'Aborting...', node_name)
+            return None
+        else:
+            raise
+
+
+class ContainerView:
+    """
+    Parsed view of an inspected container. Created once per inspect so that
+    the register loop does not need to talk to docker for every iteration.
+    """
+
+    def __init__(self, container_info):
+        self.id = container_info['Id']
+        self.name = container_info['Name'].lstrip('/')
+        self.running = bool(container_info['State']['Running'])
+        self.discoverable = is_discoverable(container_info)
+        self.config = parse_discover_config(container_info)
+        self.exposed_ports = list(
+            container_info['Config']['ExposedPorts'] or {})
+        self.ports = parse_port_mappings(container_info)
+
+    def public_port(self, port_key):
+        """
+        Gets the public (host) port for the given exposed port.
+
+        :param port_key: Exposed port. e.g.: 8080/tcp
+        :type port_key: str
+        :return: Public port or None if port is not published
+        :rtype: str
+        """
+        return self.ports.get(port_key)
+
+
+class ContainerCache:
+    """
+    Thread safe cache of container views. Views are only re-inspected when
+    a docker event is received for the container.
+    """
+
+    def __init__(self, docker_cl, container_filter=None):
+        self.docker_cl = docker_cl
+        self.container_filter = container_filter
+        self.views = {}
+        self.version = 0
+        self._condition = threading.Condition()
+
+    def _notify(self):
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def refresh(self, container_id):
+        """
+        Re-inspects the container and updates the cached view. Containers
+        with invalid discover configuration are skipped (and logged).
+
+        :param container_id: Container id or name
+        :type container_id: str
+        :return: Updated view or None if container no longer exists (or its
+            configuration is invalid)
+        :rtype: ContainerView
+        """
+        with span('inspect'):
+            container_info = get_container_info(self.docker_cl,
+                                                container_id)
+        view = None
+        if container_info:
+            try:
+                view = ContainerView(container_info)
+            except (ValueError, TypeError) as error:
+                get_failure_log().failed(
+                    'Container %s' % container_id,
+                    'Skipping container %s with invalid discover '
+                    'configuration: %s', container_id, error)
+                return None
+        with self._condition:
+            if view:
+                self.views[view.id] = view
+            else:
+                for cached_id, cached_view in list(self.views.items()):
+                    if container_id in (cached_id, cached_view.name):
+                        del self.views[cached_id]
+        self._notify()
+        return view
+
+    def mark_stopped(self, container_id):
+        with self._condition:
+            view = self.views.get(container_id)
+            if view:
+                view.running = False
+        self._notify()
+
+    def remove(self, container_id):
+        with self._condition:
+            self.views.pop(container_id, None)
+        self._notify()
+
+    def resync(self):
+        """
+        Re-inspects all running containers. Used on startup and after the
+        events stream reconnects so that no change is lost.
+        """
+        running_ids = set()
+        for container in self.docker_cl.containers():
+            if self.accepts(container['Id']):
+                running_ids.add(container['Id'])
+                self.refresh(container['Id'])
+        with self._condition:
+            for container_id, view in self.views.items():
+                if container_id not in running_ids:
+                    view.running = False
+        self._notify()
+
+    def accepts(self, container_id):
+        return not self.container_filter or \
+            self.container_filter(container_id)
+
+    def get(self, container_id):
+        with self._condition:
+            view = self.views.get(container_id)
+            if view:
+                return view
+            for cached_view in self.views.values():
+                if cached_view.name == container_id:
+                    return cached_view
+
+    def all(self):
+        with self._condition:
+            return list(self.views.values())
+
+    def wait(self, version, timeout):
+        """
+        Waits till the cache changes (from the given version) or the timeout
+        expires.
+
+        :param version: Cache version seen by the caller
+        :type version: int
+        :param timeout: Timeout in seconds
+        :type timeout: float
+        :return: Current cache version
+        :rtype: int
+        """
+        with self._condition:
+            if self.version == version:
+                self._condition.wait(timeout)
+            return self.version
+
+    def handle_event(self, event):
+        """
+        Applies a docker event to the cache.
+
+        :param event: Decoded docker event
+        :type event: dict
+        :return: None
+        """
+        status = (event.get('status') or '').split(':')[0]
+        container_id = event.get('id')
+        if not container_id or not self.accepts(container_id):
+            return
+        if status in REFRESH_EVENTS:
+            self.refresh(container_id)
+        elif status == 'destroy':
+            self.remove(container_id)
+        elif status in STOP_EVENTS:
+            self.mark_stopped(container_id)
+
+
+def watch_events(docker_cl_factory, cache, should_watch=None, events=None):
+    """
+    Watches the docker events stream and applies the events to the
+    container cache. The stream is re-opened (followed by a full resync of
+    the cache) when it breaks.
+
+    :param docker_cl_factory: Function creating a docker client dedicated to
+        the events stream
+    :type docker_cl_factory: function
+    :param cache: Container cache to be updated
+    :type cache: ContainerCache
+    :param should_watch: Lambda or function that evaluates if watching should
+        continue. Added for ease of unit testing
+    :type should_watch: function
+    :param events: Already opened events stream (optional)
+    :return: None
+    """
+    should_watch = should_watch or (lambda: True)
+    while should_watch():
+        try:
+            if events is None:
+                # Open the stream before resync so that no event is lost in
+                # between.
+                events = docker_cl_factory().events()
+                cache.resync()
+            for raw_event in events:
+                event = json.loads(raw_event)
+                with trace('docker_event', status=event.get('status'),
+                           container=event.get('id')):
+                    cache.handle_event(event)
+            logger.warn('Docker events stream closed. Reconnecting...')
+        except Exception:
+            logger.exception('Failed to watch docker events. Will retry '
+                             'in %ds', EVENTS_RECONNECT_DELAY)
+            time.sleep(EVENTS_RECONNECT_DELAY)
+        events = None
+
+
+def start_event_watcher(docker_cl_factory, cache):
+    """
+    Populates the cache and starts watching docker events in a background
+    thread.
+
+    :param docker_cl_factory: Function creating a docker client dedicated to
+        the events stream
+    :type docker_cl_factory: function
+    :param cache: Container cache to be updated
+    :type cache: ContainerCache
+    :return: Watcher thread
+    :rtype: threading.Thread
+    """
+    events = docker_cl_factory().events()
+    cache.resync()
+    watcher = threading.Thread(target=watch_events,
+                               args=(docker_cl_factory, cache),
+                               kwargs={'events': events},
+                               name='docker-events')
+    watcher.daemon = True
+    watcher.start()
+    return watcher
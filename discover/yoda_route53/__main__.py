@@ -5,19 +5,43 @@ import argparse
 import time
 import random
 import os
+import uuid
 
-from boto.route53.record import ResourceRecordSets
 from urllib3.exceptions import ReadTimeoutError
 import yoda
 import etcd
 import boto
 
 from discover import logger
+from discover.clients import etcd_client as shared_etcd_client
+from discover.logs import add_logging_arguments, init_logging
+from discover.metrics import get_metrics, add_metrics_arguments, \
+    init_metrics
 from discover.util import init_shutdown_handler
+from discover.profiling import add_profiling_arguments, \
+    init_profile_handler
+from discover.tracing import trace, span, add_tracing_arguments, \
+    init_tracing
+from discover.ratelimit import RateLimiter
+from discover.yoda_route53.leader import LeaderElection, DEFAULT_LEASE_TTL
+from discover.yoda_route53.weights import LoadWeights, parse_load, \
+    DEFAULT_MAX_WEIGHT, DEFAULT_MIN_WEIGHT, DEFAULT_DAMPING, \
+    DEFAULT_MIN_CHANGE, DEFAULT_WEIGHT_INTERVAL
+from discover.yoda_route53.records import RecordSetCache, collapse_events, \
+    RateLimitedConnection, is_throttled, DEFAULT_REFRESH_INTERVAL, \
+    DEFAULT_REQUESTS_PER_SECOND, DEFAULT_BURST
+from discover.yoda_route53.targets import Route53Targets, TargetWorker, \
+    parse_targets, target_args, apply_desired, apply_nodes, apply_weights, \
+    DEFAULT_TARGET_TIMEOUT
+
+# Timeout in seconds used for draining pending events into a batch
+DRAIN_TIMEOUT = 1
+MAX_BATCH_EVENTS = 1000
+WATCH_TIMEOUT = 300
 
 
 def etcd_client(parsed_args):
-    return etcd.Client(host=parsed_args.etcd_host, port=parsed_args.etcd_port)
+    return shared_etcd_client(parsed_args.etcd_host, parsed_args.etcd_port)
 
 
 def yoda_client(etcd_cl):
@@ -29,7 +53,7 @@ def job_lock(etcd_cl, etcd_base):
     try:
         node = etcd_cl.write(lock_key, True, ttl=60, prevExist=False)
         return node.modifiedIndex
-    except KeyError:
+    except (KeyError, etcd.EtcdAlreadyExist):
         return None
 
 
@@ -38,7 +62,8 @@ def job_unlock(etcd_cl, etcd_base, lock):
         lock_key = '%s/route53/_lock' % etcd_base
         try:
             etcd_cl.delete(lock_key, prevIndex=lock)
-        except KeyError:
+        except (KeyError, etcd.EtcdKeyError, etcd.EtcdCompareFailed):
+            # Lock expired (and possibly taken by another node) meanwhile
             logger.warn('Failed to unlock route53 job %d', lock)
             return False
     else:
@@ -49,7 +74,8 @@ class ApplyLock:
     def __init__(self, etcd_cl, etcd_base):
         self.etcd_cl = etcd_cl
         self.etcd_base = etcd_base
-        self.lock = job_lock(etcd_cl, etcd_base)
+        with span('lock'):
+            self.lock = job_lock(etcd_cl, etcd_base)
 
     def __enter__(self):
         return self.lock
@@ -60,78 +86,368 @@ class ApplyLock:
 
 def set_sync_index(etcd_cl, etcd_base, sync_index):
     sync_key = '%s/route53/sync-index/' % etcd_base
-    etcd_cl.write(sync_key, sync_index)
+    with span('etcd_write'):
+        etcd_cl.write(sync_key, sync_index)
 
 
 def get_sync_index(etcd_cl, etcd_base):
     sync_key = '%s/route53/sync-index/' % etcd_base
     try:
         return int(etcd_cl.read(sync_key, consistent=True).value)
-    except KeyError:
+    except (KeyError, etcd.EtcdKeyError):
         pass
 
 
+def check_sync_index(records, sync_index):
+    """
+    Invalidates the cached route53 records if the sync index is not the one
+    written after the last changes applied by this process (i.e. another
+    replica changed the records in between).
+
+    :param records: Cached route53 records (or route53 targets)
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param sync_index: Current sync index
+    :type sync_index: int
+    :return: None
+    """
+    if sync_index != records.synced_index:
+        logger.info('Sync index moved by another node. Refreshing cached '
+                    'route53 records')
+        records.invalidate()
+
+
+def save_sync_index(etcd_cl, records, parsed_args, index):
+    """
+    Persists the sync index after the changes up to the given index were
+    applied. Route53 targets keep applying in background, so only the lowest
+    index applied by every target is persisted (changes still pending for a
+    slow target are then not skipped by the next sync).
+
+    :param etcd_cl: Etcd client
+    :param records: Cached route53 records (or route53 targets)
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments
+    :param index: Etcd index of the submitted changes
+    :type index: int
+    :return: Persisted sync index (None if not persisted)
+    :rtype: int
+    """
+    if isinstance(records, Route53Targets):
+        index = records.applied_index
+    if index is None or index == records.synced_index:
+        return index
+    set_sync_index(etcd_cl, parsed_args.etcd_base, index)
+    records.synced_index = index
+    return index
+
+
 def remove_sync_index(etcd_cl, etcd_base):
     sync_key = '%s/route53/sync-index/' % etcd_base
     try:
         etcd_cl.delete(sync_key)
-    except KeyError:
+    except (KeyError, etcd.EtcdKeyError):
         pass
 
 
-def update_route53(node_name, value, parsed_args):
-    conn = boto.connect_route53(
+def route53_connection(parsed_args, **labels):
+    limiter = RateLimiter(parsed_args.route53_rate,
+                          burst=parsed_args.route53_burst,
+                          is_throttled=is_throttled)
+    metrics = get_metrics()
+    metrics.gauge('route53_rate_limit_wait_seconds',
+                  'Total time spent waiting on the route53 rate limiter') \
+        .set_function(lambda: limiter.wait_seconds, **labels)
+    metrics.gauge('route53_throttled_calls',
+                  'Number of route53 calls throttled by the API') \
+        .set_function(lambda: limiter.throttled_count, **labels)
+    metrics.gauge('route53_request_rate',
+                  'Current route53 request rate (requests per second)') \
+        .set_function(lambda: limiter.rate, **labels)
+    return RateLimitedConnection(boto.connect_route53(
         aws_access_key_id=parsed_args.access_key_id,
-        aws_secret_access_key=parsed_args.secret_access_key)
-    records = conn.get_all_rrsets(parsed_args.zone_id,
-                                  type=parsed_args.record_type,
-                                  name=parsed_args.dns_record,
-                                  identifier=node_name, maxitems=1)
-    changes = ResourceRecordSets(conn, parsed_args.zone_id)
-    change = changes.add_change(
-        'UPSERT', name=parsed_args.dns_record,
-        type=parsed_args.record_type, ttl=parsed_args.dns_ttl,
-        identifier=node_name, weight=parsed_args.record_weight)
-    change.add_value(value)
-    if len(records) > 0 and records[0].name == parsed_args.dns_record + '.' \
-            and records[0].identifier == node_name:
-        if len(records[0].resource_records) > 0 and \
-                records[0].resource_records[0] == value:
-            logger.info('No change in Record %s. Skipping...',
-                        parsed_args.dns_record)
-        else:
-            logger.info('Modifying record: %s:%s with identifier:%s',
-                        parsed_args.dns_record, value, node_name)
-            changes.commit()
-    else:
-        logger.info('Adding record: %s:%s with identifier:%s',
-                    parsed_args.dns_record, value, node_name)
-        changes.commit()
+        aws_secret_access_key=parsed_args.secret_access_key), limiter)
 
 
-def delete_route53(node_name, parsed_args):
-    conn = boto.connect_route53(
-        aws_access_key_id=parsed_args.access_key_id,
-        aws_secret_access_key=parsed_args.secret_access_key)
-    records = conn.get_all_rrsets(parsed_args.zone_id,
-                                  name=parsed_args.dns_record,
-                                  type=parsed_args.record_type,
-                                  identifier=node_name, maxitems=1)
-    changes = ResourceRecordSets(conn, parsed_args.zone_id)
-    change = changes.add_change(
-        'DELETE', name=parsed_args.dns_record, identifier=node_name,
-        type=parsed_args.record_type, ttl=records[0].ttl,
-        weight=records[0].weight)
-    change.add_value(records[0].resource_records[0])
-    if len(records) > 0 and records[0].name == parsed_args.dns_record + '.' \
-            and records[0].identifier == node_name:
-
-        logger.info('Deleting record: %s with identifier %s',
-                    parsed_args.dns_record, node_name)
-        changes.commit()
+def drain_events(etcd_cl, proxy_nodes_key, first_event,
+                 drain_timeout=DRAIN_TIMEOUT, max_events=MAX_BATCH_EVENTS):
+    """
+    Reads all the events that are pending after the given event (without
+    waiting for new ones longer than the drain timeout).
+
+    :param etcd_cl: Etcd client
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :param first_event: First event of the batch
+    :param drain_timeout: Timeout in seconds for reading pending events
+    :type drain_timeout: float
+    :param max_events: Maximum number of events in a batch
+    :type max_events: int
+    :return: List of events (in order of modified index)
+    :rtype: list
+    """
+    events = [first_event]
+    with span('drain'):
+        while len(events) < max_events:
+            try:
+                event = etcd_cl.read(
+                    proxy_nodes_key, recursive=True, wait=True,
+                    waitIndex=events[-1].modifiedIndex + 1,
+                    timeout=drain_timeout)
+            except (ReadTimeoutError, etcd.EtcdWatchTimedOut):
+                break
+            events.append(event)
+    return events
+
+
+def record_set_cache(parsed_args, **labels):
+    return RecordSetCache(
+        route53_connection(parsed_args, **labels), parsed_args.zone_id,
+        parsed_args.dns_record, parsed_args.record_type,
+        refresh_interval=parsed_args.records_refresh_interval)
+
+
+def route53_records(parsed_args):
+    """
+    Creates the cached route53 records for the managed record or, if
+    multiple targets are specified, the (started) workers for the targets.
+
+    :param parsed_args: Parsed arguments
+    :return: Cached route53 records or route53 targets
+    :rtype: discover.yoda_route53.records.RecordSetCache or
+        discover.yoda_route53.targets.Route53Targets
+    """
+    if not parsed_args.targets:
+        return record_set_cache(parsed_args)
+    workers = []
+    for target in parsed_args.targets:
+        args = target_args(parsed_args, target)
+        workers.append(TargetWorker(
+            args, record_set_cache(args, zone=args.zone_id,
+                                   record=args.dns_record),
+            weights=load_weights(args)))
+    logger.info('Syncing %d route53 target(s): %s', len(workers),
+                ', '.join('%s (%s)' % (worker.parsed_args.dns_record,
+                                       worker.parsed_args.zone_id)
+                          for worker in workers))
+    return Route53Targets(workers, timeout=parsed_args.target_timeout).start()
+
+
+def load_weights(parsed_args):
+    """
+    Creates the load aware weights (if enabled).
+
+    :param parsed_args: Parsed arguments
+    :return: Load aware weights or None if static weight is used
+    :rtype: discover.yoda_route53.weights.LoadWeights
+    """
+    if not parsed_args.load_aware_weights:
+        return None
+    return LoadWeights(max_weight=parsed_args.max_record_weight,
+                       min_weight=parsed_args.min_record_weight,
+                       damping=parsed_args.weight_damping,
+                       min_change=parsed_args.weight_min_change)
+
+
+def read_proxy_loads(etcd_cl, etcd_base):
+    """
+    Reads the loads published by the presence agents.
+
+    :param etcd_cl: Etcd client
+    :param etcd_base: Yoda base key
+    :type etcd_base: str
+    :return: Load keyed by proxy node name
+    :rtype: dict
+    """
+    loads_key = '%s/proxy-nodes-load' % etcd_base
+    try:
+        result = etcd_cl.read(loads_key, recursive=True)
+    except (KeyError, etcd.EtcdKeyError):
+        return {}
+    loads = {}
+    for node_name, value in collapse_events(
+            [leaf for leaf in result.leaves if not leaf.dir],
+            loads_key).items():
+        load = parse_load(value)
+        if load is not None:
+            loads[node_name] = load
+    return loads
+
+
+def apply_load_weights(etcd_cl, records, weights, parsed_args):
+    """
+    Re-computes the weights from the latest loads and updates the records
+    whose weight changed beyond the minimum change.
+
+    :param etcd_cl: Etcd client
+    :param records: Cached route53 records (or route53 targets)
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param weights: Load aware weights
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :param parsed_args: Parsed arguments
+    :return: Applied changes (None for route53 targets)
+    :rtype: list
+    """
+    with span('etcd_read'):
+        weights.loads = read_proxy_loads(etcd_cl, parsed_args.etcd_base)
+    if isinstance(records, Route53Targets):
+        records.submit(loads=weights.loads)
+        return None
+    return apply_weights(records, parsed_args, weights)
+
+
+def apply_events(events, records, parsed_args, proxy_nodes_key,
+                 weights=None):
+    """
+    Collapses the events into the final desired state per proxy node and
+    applies it to route53 as batched change sets.
+
+    :param events: Etcd events (in order of modified index)
+    :type events: list
+    :param records: Cached route53 records (or route53 targets)
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :param weights: Load aware weights (None for static weight)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :return: None
+    """
+    desired = collapse_events(events, proxy_nodes_key)
+    get_metrics().counter(
+        'route53_events_total',
+        'Number of proxy node events processed').inc(len(events))
+    if not desired:
+        return
+    if isinstance(records, Route53Targets):
+        records.submit(desired=desired, index=events[-1].modifiedIndex)
+        return
+    changes = apply_desired(records, parsed_args, desired, weights)
+    logger.info('Applied %d change(s) for %d event(s) to %s',
+                len(changes), len(events), parsed_args.dns_record)
+
+
+def record_sync_lag(etcd_index, sync_index):
+    """
+    Records how far (in etcd indexes) the applied sync index is behind the
+    etcd head.
+
+    :param etcd_index: Etcd head index (X-Etcd-Index) of the last response
+    :type etcd_index: int
+    :param sync_index: Last applied index
+    :type sync_index: int
+    """
+    if etcd_index and sync_index:
+        get_metrics().gauge(
+            'route53_sync_index_lag',
+            'Number of etcd indexes the route53 sync is behind the head') \
+            .set(max(etcd_index - sync_index, 0))
+
+
+def watch_proxy_nodes(etcd_cl, proxy_nodes_key, **watch_args):
+    """
+    Watches the proxy nodes, recording the duration of the watch and its
+    outcome (success, timeout or error).
+
+    :param etcd_cl: Etcd client
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :keyword watch_args: Additional arguments for the etcd read
+    :return: Etcd event
+    """
+    started = time.time()
+    outcome = 'error'
+    try:
+        result = etcd_cl.read(proxy_nodes_key, recursive=True, wait=True,
+                              **watch_args)
+        outcome = 'success'
+        return result
+    except (ReadTimeoutError, etcd.EtcdWatchTimedOut):
+        outcome = 'timeout'
+        raise
+    finally:
+        get_metrics().observe('etcd_watch', time.time() - started, outcome)
+
+
+def read_proxy_nodes(etcd_cl, proxy_nodes_key):
+    """
+    Reads the full proxy nodes tree.
+
+    :param etcd_cl: Etcd client
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :return: Tuple of (record value keyed by node name, etcd index at which
+        the tree was read)
+    :rtype: tuple
+    """
+    try:
+        result = etcd_cl.read(proxy_nodes_key, recursive=True)
+    except (KeyError, etcd.EtcdKeyError):
+        return {}, None
+    nodes = collapse_events(
+        [leaf for leaf in result.leaves if not leaf.dir], proxy_nodes_key)
+    return nodes, result.etcd_index
+
+
+def apply_snapshot(etcd_cl, records, parsed_args, proxy_nodes_key,
+                   weights=None):
+    """
+    Applies the full snapshot of proxy nodes in etcd to route53 (instead of
+    relying on the event stream) and resets the sync index to the snapshot
+    index. Only the differences are applied to route53.
+
+    :param etcd_cl: Etcd client
+    :param records: Cached route53 records (or route53 targets)
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :param weights: Load aware weights (None for static weight)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :return: Etcd index of the applied snapshot
+    :rtype: int
+    """
+    with span('etcd_read'):
+        nodes, etcd_index = read_proxy_nodes(etcd_cl, proxy_nodes_key)
+        if weights is not None:
+            weights.loads = read_proxy_loads(etcd_cl, parsed_args.etcd_base)
+    if isinstance(records, Route53Targets):
+        records.submit(snapshot=nodes,
+                       loads=weights.loads if weights is not None else None,
+                       index=etcd_index)
     else:
-        logger.info('Skip delete  for non existing record: %s with '
-                    'identifier:%s', parsed_args.dns_record, node_name)
+        changes, current = apply_nodes(records, parsed_args, nodes, weights)
+        logger.info('Reconciled %d proxy node(s) with %d record(s). '
+                    'Applied %d change(s)', len(nodes), len(current),
+                    len(changes))
+    if etcd_index:
+        record_sync_lag(etcd_index, save_sync_index(
+            etcd_cl, records, parsed_args, etcd_index))
+    return etcd_index
+
+
+def reconcile(etcd_cl, records, parsed_args, proxy_nodes_key, weights=None):
+    """
+    Reconciles route53 with the full snapshot of proxy nodes in etcd (while
+    holding the job lock).
+
+    :param etcd_cl: Etcd client
+    :param records: Cached route53 records
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :param weights: Load aware weights (None for static weight)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :return: Etcd index of the reconciled snapshot or None if the job is
+        locked by another node
+    :rtype: int
+    """
+    with ApplyLock(etcd_cl, parsed_args.etcd_base) as lock:
+        if not lock:
+            logger.info('Job locked by another node. Skipping reconcile')
+            return None
+        return apply_snapshot(etcd_cl, records, parsed_args, proxy_nodes_key,
+                              weights=weights)
 
 
 def route53_sync(parsed_args, poll=None):
@@ -147,13 +463,40 @@ def route53_sync(parsed_args, poll=None):
     etcd_cl = etcd_client(parsed_args)
     proxy_nodes_key = '%s/%s' % (parsed_args.etcd_base, 'proxy-nodes')
     etcd_args = {
-        'key': proxy_nodes_key,
-        'recursive': True,
-        'wait': True,
-        'timeout': 300
+        'timeout': WATCH_TIMEOUT
     }
+    records = weights = None
+    next_reconcile = 0
+    next_weights = float('inf')
     poll = poll or (lambda: True)
     while poll():
+        if records is None:
+            # Single route53 connection (and record cache) per target for
+            # the process
+            records = route53_records(parsed_args)
+            weights = load_weights(parsed_args)
+        if time.time() >= next_reconcile:
+            with trace('route53_reconcile'):
+                reconcile(etcd_cl, records, parsed_args, proxy_nodes_key,
+                          weights=weights)
+            next_reconcile = time.time() + parsed_args.reconcile_interval
+            if weights:
+                next_weights = time.time() + parsed_args.weight_interval
+        elif time.time() >= next_weights:
+            with trace('route53_weights'), \
+                    ApplyLock(etcd_cl, parsed_args.etcd_base) as lock:
+                if lock:
+                    # Weights are applied on top of the cached records, so
+                    # refresh them if another node synced (e.g. reconciled
+                    # a stale index) in between
+                    check_sync_index(records, get_sync_index(
+                        etcd_cl, parsed_args.etcd_base))
+                    apply_load_weights(etcd_cl, records, weights,
+                                       parsed_args)
+            next_weights = time.time() + parsed_args.weight_interval
+        etcd_args['timeout'] = max(
+            1, min(WATCH_TIMEOUT, next_reconcile - time.time(),
+                   next_weights - time.time()))
         sync_index = get_sync_index(etcd_cl, parsed_args.etcd_base)
         if sync_index:
             etcd_args['waitIndex'] = int(sync_index) + 1
@@ -161,18 +504,21 @@ def route53_sync(parsed_args, poll=None):
             del(etcd_args['waitIndex'])
         logger.info('Watching for changes for %s', proxy_nodes_key)
         try:
-            result = etcd_cl.read(**etcd_args)
-        except ReadTimeoutError:
+            result = watch_proxy_nodes(etcd_cl, proxy_nodes_key,
+                                       **etcd_args)
+        except (ReadTimeoutError, etcd.EtcdWatchTimedOut):
             logger.info('Did not receive any changes. Will restart polling...')
             continue
         except etcd.EtcdException as etcd_error:
             etcd_msg = str(etcd_error).lower()
-            if etcd_msg.startswith(
-                    'the event in requested index is outdated and cleared'):
-                logger.warn('Wait Index is stale. Removing the waitIndex')
-                remove_sync_index(etcd_cl, parsed_args.etcd_base)
-                # Adding a sleep to prevent high cpu during infinite looping.
-                time.sleep(5)
+            if is_stale_index(etcd_error):
+                logger.warn('Wait Index is stale. Reconciling from snapshot')
+                if reconcile(etcd_cl, records, parsed_args,
+                             proxy_nodes_key, weights=weights) is None:
+                    remove_sync_index(etcd_cl, parsed_args.etcd_base)
+                    # Adding a sleep to prevent high cpu during infinite
+                    # looping.
+                    time.sleep(5)
                 continue
             elif etcd_msg.startswith('unable to decode server response:'):
                 # Let the job retry after 5s. This seems intermittent issue.
@@ -181,25 +527,24 @@ def route53_sync(parsed_args, poll=None):
             else:
                 raise
 
-        with ApplyLock(etcd_cl, parsed_args.etcd_base) as lock:
+        with trace('route53_sync', modified_index=result.modifiedIndex), \
+                ApplyLock(etcd_cl, parsed_args.etcd_base) as lock:
             if lock:
                 sync_index = get_sync_index(etcd_cl, parsed_args.etcd_base)
                 if sync_index and sync_index >= result.modifiedIndex:
                     # Change is already processed by another node. Skip
                     continue
                 else:
-                    node_name = os.path.basename(result.key)
-                    if result.action not in ('delete', 'expire'):
-                        update_route53(node_name, result.value, parsed_args)
-                    else:
-                        delete_route53(node_name, parsed_args)
-                    # Persist the new sync index so that other nodes can poll
-                    # from sync_index+1
-                    set_sync_index(etcd_cl, parsed_args.etcd_base,
-                                   result.modifiedIndex)
-                    etcd_args['waitIndex'] = result.modifiedIndex + 1
-                    # Sleep for 5s before releasing lock. AWS API Limit
-                    time.sleep(5)
+                    check_sync_index(records, sync_index)
+                    events = drain_events(etcd_cl, proxy_nodes_key, result)
+                    apply_events(events, records, parsed_args,
+                                 proxy_nodes_key, weights=weights)
+                    # Persist the new sync index (once per batch) so that
+                    # other nodes can poll from sync_index+1
+                    last_index = events[-1].modifiedIndex
+                    record_sync_lag(events[-1].etcd_index, save_sync_index(
+                        etcd_cl, records, parsed_args, last_index))
+                    etcd_args['waitIndex'] = last_index + 1
             else:
                 # Sleep for 5s before next poll.
                 logger.info('Job locked by another node. '
@@ -210,13 +555,122 @@ def route53_sync(parsed_args, poll=None):
                 # fails
                 etcd_args['waitIndex'] = result.modifiedIndex
 
-        if lock:
-            # This node will not poll for next 11-15 seconds.
-            # To give other nodes a fair chance
-            time.sleep(random.randint(11, 15))
 
+def is_stale_index(etcd_error):
+    return str(etcd_error).lower().startswith(
+        'the event in requested index is outdated and cleared')
 
-if __name__ == "__main__":
+
+def leader_sync(etcd_cl, election, records, parsed_args, proxy_nodes_key,
+                poll, weights=None):
+    """
+    Processes the proxy nodes event stream continuously while this node
+    holds the leadership. The sync index is read once on takeover and
+    persisted after every batch so that the next leader continues from it.
+
+    :param etcd_cl: Etcd client
+    :param election: Leader election
+    :type election: discover.yoda_route53.leader.LeaderElection
+    :param records: Cached route53 records
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :param poll: Lambda or function that evaluates if polling should
+        continue
+    :type poll: function
+    :param weights: Load aware weights (None for static weight)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :return: None
+    """
+    sync_index = get_sync_index(etcd_cl, parsed_args.etcd_base)
+    check_sync_index(records, sync_index)
+    # Continue from the sync index handed over by the previous leader.
+    # Without one, start from a full snapshot.
+    next_reconcile = time.time() + parsed_args.reconcile_interval \
+        if sync_index else 0
+    next_weights = 0 if weights else float('inf')
+    while poll() and election.is_leader():
+        if time.time() >= next_reconcile:
+            with trace('route53_reconcile'):
+                sync_index = apply_snapshot(etcd_cl, records, parsed_args,
+                                            proxy_nodes_key, weights=weights)
+            next_reconcile = time.time() + parsed_args.reconcile_interval
+            if weights:
+                next_weights = time.time() + parsed_args.weight_interval
+        elif time.time() >= next_weights:
+            with trace('route53_weights'):
+                apply_load_weights(etcd_cl, records, weights, parsed_args)
+            next_weights = time.time() + parsed_args.weight_interval
+        watch_args = {'waitIndex': sync_index + 1} if sync_index else {}
+        try:
+            # Keep the watch shorter than the lease so that lost leadership
+            # is noticed in time.
+            result = watch_proxy_nodes(etcd_cl, proxy_nodes_key,
+                                       timeout=max(1, election.ttl / 3.0),
+                                       **watch_args)
+        except (ReadTimeoutError, etcd.EtcdWatchTimedOut):
+            continue
+        except etcd.EtcdException as etcd_error:
+            if is_stale_index(etcd_error):
+                logger.warn('Wait Index is stale. Reconciling from snapshot')
+                next_reconcile = 0
+                continue
+            raise
+
+        with trace('route53_sync', modified_index=result.modifiedIndex):
+            events = drain_events(etcd_cl, proxy_nodes_key, result)
+            if not election.is_leader():
+                logger.warn('Lost route53 sync leadership. Skipping %d '
+                            'event(s)', len(events))
+                break
+            apply_events(events, records, parsed_args, proxy_nodes_key,
+                         weights=weights)
+            # Keep watching from the submitted index while only the index
+            # applied by every target is handed over to the next leader
+            sync_index = events[-1].modifiedIndex
+            record_sync_lag(events[-1].etcd_index, save_sync_index(
+                etcd_cl, records, parsed_args, sync_index))
+
+
+def route53_leader_sync(parsed_args, poll=None):
+    """
+    Syncs yoda proxy nodes with route53 using leader election. Only the
+    replica holding the lease processes the events. Others stand by till the
+    lease is released or expires.
+
+    :param parsed_args: Parsed arguments
+    :param poll: Lambda or function that evaluates if polling should
+        continue. Added for ease of unit testing
+    :type poll: function
+    :return: None
+    """
+    logger.info('Started leader election for syncing yoda proxy nodes with '
+                'route53')
+    etcd_cl = etcd_client(parsed_args)
+    proxy_nodes_key = '%s/%s' % (parsed_args.etcd_base, 'proxy-nodes')
+    election = LeaderElection(etcd_cl, '%s/route53/_leader' %
+                              parsed_args.etcd_base, str(uuid.uuid4()),
+                              ttl=parsed_args.lease_ttl)
+    records = weights = None
+    poll = poll or (lambda: True)
+    while poll():
+        if not election.acquire():
+            logger.info('Standing by for route53 sync leadership')
+            election.wait_for_vacancy()
+            continue
+        election.start_renewal()
+        try:
+            if records is None:
+                records = route53_records(parsed_args)
+                weights = load_weights(parsed_args)
+            leader_sync(etcd_cl, election, records, parsed_args,
+                        proxy_nodes_key, poll, weights=weights)
+        finally:
+            election.release()
+
+
+def create_parser():
     parser = argparse.ArgumentParser(
         description='Syncs route53 nodes with etcd')
 
@@ -249,6 +703,41 @@ if __name__ == "__main__":
         '--poll-interval', metavar='<POLL_INTERVAL">',
         help='Poll interval in seconds', type=int,
         default=os.environ.get('POLL_INTERVAL', '180'))
+    parser.add_argument(
+        '--reconcile-interval', metavar='<RECONCILE_INTERVAL>', type=int,
+        help='Interval in seconds for reconciling route53 with the full '
+             'snapshot of proxy nodes. Defaults to 900',
+        default=os.environ.get('ROUTE53_RECONCILE_INTERVAL', '900'))
+    parser.add_argument(
+        '--records-refresh-interval', metavar='<RECORDS_REFRESH_INTERVAL>',
+        type=int,
+        help='Interval in seconds for refreshing the cached route53 records. '
+             'Defaults to %d' % DEFAULT_REFRESH_INTERVAL,
+        default=os.environ.get('ROUTE53_RECORDS_REFRESH_INTERVAL',
+                               DEFAULT_REFRESH_INTERVAL))
+    parser.add_argument(
+        '--route53-rate', metavar='<ROUTE53_REQUESTS_PER_SECOND>',
+        type=float,
+        help='Maximum route53 API requests per second. Defaults to %d' %
+             DEFAULT_REQUESTS_PER_SECOND,
+        default=os.environ.get('ROUTE53_REQUESTS_PER_SECOND',
+                               DEFAULT_REQUESTS_PER_SECOND))
+    parser.add_argument(
+        '--route53-burst', metavar='<ROUTE53_BURST>', type=int,
+        help='Maximum burst of route53 API requests. Defaults to %d' %
+             DEFAULT_BURST,
+        default=os.environ.get('ROUTE53_BURST', DEFAULT_BURST))
+    parser.add_argument(
+        '--leader-election', action='store_true',
+        default=os.environ.get('ROUTE53_LEADER_ELECTION', '').lower() in
+        ('1', 'true', 'yes'),
+        help='Use lease based leader election instead of locking the job '
+             'for every change')
+    parser.add_argument(
+        '--lease-ttl', metavar='<ROUTE53_LEASE_TTL>', type=int,
+        help='TTL in seconds for the leader lease (bounds failover time). '
+             'Defaults to %d' % DEFAULT_LEASE_TTL,
+        default=os.environ.get('ROUTE53_LEASE_TTL', DEFAULT_LEASE_TTL))
     parser.add_argument(
         '--dns-ttl', metavar='<ROUTE53_DNS_RECORD_TTL>', type=int,
         help='DNS Record TTL in seconds. Defaults to 60.',
@@ -257,18 +746,103 @@ if __name__ == "__main__":
         '--record-weight', metavar='<ROUTE53_DNS_RECORD_WEIGHT>', type=int,
         help='Weight of the dns record for this node. Defaults to 1',
         default=os.environ.get('ROUTE53_DNS_RECORD_WEIGHT', '1'))
+    parser.add_argument(
+        '--load-aware-weights', action='store_true',
+        default=os.environ.get('ROUTE53_LOAD_AWARE_WEIGHTS', '').lower() in
+        ('1', 'true', 'yes'),
+        help='Derive record weights from the load published by the proxy '
+             'presence agents instead of using the static record weight')
+    parser.add_argument(
+        '--max-record-weight', metavar='<ROUTE53_MAX_RECORD_WEIGHT>',
+        type=int,
+        help='Weight of a proxy with average (or unknown) load. '
+             'Defaults to %d' % DEFAULT_MAX_WEIGHT,
+        default=os.environ.get('ROUTE53_MAX_RECORD_WEIGHT',
+                               DEFAULT_MAX_WEIGHT))
+    parser.add_argument(
+        '--min-record-weight', metavar='<ROUTE53_MIN_RECORD_WEIGHT>',
+        type=int,
+        help='Lowest weight given to a hot proxy. Defaults to %d' %
+             DEFAULT_MIN_WEIGHT,
+        default=os.environ.get('ROUTE53_MIN_RECORD_WEIGHT',
+                               DEFAULT_MIN_WEIGHT))
+    parser.add_argument(
+        '--weight-damping', metavar='<ROUTE53_WEIGHT_DAMPING>', type=float,
+        help='Fraction of the distance to the target weight applied per '
+             'update. Defaults to %s' % DEFAULT_DAMPING,
+        default=os.environ.get('ROUTE53_WEIGHT_DAMPING', DEFAULT_DAMPING))
+    parser.add_argument(
+        '--weight-min-change', metavar='<ROUTE53_WEIGHT_MIN_CHANGE>',
+        type=float,
+        help='Minimum relative difference from the target weight for a '
+             'record to be updated. Defaults to %s' % DEFAULT_MIN_CHANGE,
+        default=os.environ.get('ROUTE53_WEIGHT_MIN_CHANGE',
+                               DEFAULT_MIN_CHANGE))
+    parser.add_argument(
+        '--weight-interval', metavar='<ROUTE53_WEIGHT_INTERVAL>', type=int,
+        help='Interval in seconds for updating load aware weights. '
+             'Defaults to %d' % DEFAULT_WEIGHT_INTERVAL,
+        default=os.environ.get('ROUTE53_WEIGHT_INTERVAL',
+                               DEFAULT_WEIGHT_INTERVAL))
     parser.add_argument(
         '--record-type', metavar='<ROUTE53_DNS_RECORD_TYPE>',
         help='Type of dns record (CNAME, A). Defaults to CNAME',
         default=os.environ.get('ROUTE53_DNS_RECORD_TYPE', 'CNAME'))
     parser.add_argument(
-        'zone_id', metavar='<ROUTE53_HOSTED_ZONE_ID>',
-        help='Hosted zone id for route53.')
+        '--targets', metavar='<ROUTE53_TARGETS>',
+        default=os.environ.get('ROUTE53_TARGETS'),
+        help='Multiple route53 targets synced from a single etcd watch. '
+             'Comma separated zone_id:dns_record[:record_type[:weight]] or '
+             'a json list of objects with zone_id, dns_record and optionally '
+             'record_type, record_weight, dns_ttl, route53_rate and '
+             'route53_burst. Each target gets its own rate limit (keep the '
+             'sum within the route53 account limit)')
     parser.add_argument(
-        'dns_record', metavar='<ROUTE53_DNS_RECORD>',
-        help='DNS Record e.g. (mycluster.abc.com)')
-
-    parsed_args = parser.parse_args()
+        '--target-timeout', metavar='<ROUTE53_TARGET_TIMEOUT>', type=int,
+        help='Time in seconds to wait for the targets to apply a batch '
+             'before moving on (slow targets continue in background). '
+             'Defaults to %d' % DEFAULT_TARGET_TIMEOUT,
+        default=os.environ.get('ROUTE53_TARGET_TIMEOUT',
+                               DEFAULT_TARGET_TIMEOUT))
+    parser.add_argument(
+        'zone_id', metavar='<ROUTE53_HOSTED_ZONE_ID>', nargs='?',
+        help='Hosted zone id for route53. Required unless --targets is '
+             'specified')
+    parser.add_argument(
+        'dns_record', metavar='<ROUTE53_DNS_RECORD>', nargs='?',
+        help='DNS Record e.g. (mycluster.abc.com). Required unless '
+             '--targets is specified')
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
+    add_tracing_arguments(parser)
+    add_profiling_arguments(parser)
+    return parser
+
+
+def main(argv=None, prog=None):
+    parser = create_parser()
+    if prog:
+        parser.prog = prog
+    parsed_args = parser.parse_args(argv)
     parsed_args.check_ports = parsed_args.check_ports.split(',')
+    if parsed_args.targets:
+        try:
+            parsed_args.targets = parse_targets(parsed_args.targets)
+        except ValueError as error:
+            parser.error('Invalid --targets: %s' % error)
+    elif not parsed_args.zone_id or not parsed_args.dns_record:
+        parser.error('<ROUTE53_HOSTED_ZONE_ID> and <ROUTE53_DNS_RECORD> are '
+                     'required unless --targets is specified')
+    init_logging(parsed_args)
+    init_metrics(parsed_args)
+    init_tracing(parsed_args.trace, parsed_args.trace_threshold_ms)
+    init_profile_handler(parsed_args.profile_dir, parsed_args.profile_mode)
     init_shutdown_handler()
-    route53_sync(parsed_args)
+    if parsed_args.leader_election:
+        route53_leader_sync(parsed_args)
+    else:
+        route53_sync(parsed_args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Lease based leader election (using an etcd key with TTL) for the route53
+sync job.
+"""
+import threading
+import time
+
+import etcd
+from urllib3.exceptions import ReadTimeoutError
+
+from discover import logger
+
+DEFAULT_LEASE_TTL = 30
+# Leadership is considered lost this many seconds before the lease expires
+# so that a new leader never overlaps with the old one.
+LEASE_SAFETY_MARGIN = 2
+
+
+class LeaderElection:
+    """
+    Leader election using a renewable lease. The leader holds the lease key
+    (with TTL) and renews it in a background thread. Failover is bounded by
+    the lease TTL.
+    """
+
+    def __init__(self, etcd_cl, lease_key, node_id, ttl=DEFAULT_LEASE_TTL):
+        self.etcd_cl = etcd_cl
+        self.lease_key = lease_key
+        self.node_id = node_id
+        self.ttl = ttl
+        self.lease_expires = 0
+        self._stop = threading.Event()
+        self._renewer = None
+
+    def is_leader(self):
+        return time.time() < self.lease_expires
+
+    def _lease_granted(self, started):
+        self.lease_expires = started + self.ttl - LEASE_SAFETY_MARGIN
+
+    def acquire(self):
+        """
+        Tries to acquire the lease.
+
+        :return: True if this node is the leader
+        :rtype: bool
+        """
+        started = time.time()
+        try:
+            self.etcd_cl.write(self.lease_key, self.node_id, ttl=self.ttl,
+                               prevExist=False)
+        except (KeyError, etcd.EtcdKeyError):
+            # Lease is held by other node
+            return False
+        logger.info('Acquired route53 sync leadership (%s)', self.node_id)
+        self._lease_granted(started)
+        return True
+
+    def renew(self):
+        """
+        Renews the lease if it is still held by this node.
+
+        :return: True if the lease was renewed
+        :rtype: bool
+        """
+        started = time.time()
+        try:
+            # Refresh does not notify the watchers (standby nodes)
+            self.etcd_cl.refresh(self.lease_key, self.ttl,
+                                 prevValue=self.node_id)
+        except (KeyError, ValueError, etcd.EtcdException):
+            logger.exception('Failed to renew route53 sync leadership (%s)',
+                             self.node_id)
+            self.lease_expires = 0
+            return False
+        self._lease_granted(started)
+        return True
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3.0):
+            if not self.renew():
+                break
+
+    def start_renewal(self):
+        self._stop.clear()
+        self._renewer = threading.Thread(target=self._renew_loop,
+                                         name='route53-lease')
+        self._renewer.daemon = True
+        self._renewer.start()
+
+    def release(self):
+        """
+        Stops renewing and releases the lease (if still held) so that a
+        standby node can take over right away.
+        """
+        self._stop.set()
+        was_leader = self.is_leader()
+        self.lease_expires = 0
+        if was_leader:
+            try:
+                self.etcd_cl.delete(self.lease_key, prevValue=self.node_id)
+                logger.info('Released route53 sync leadership (%s)',
+                            self.node_id)
+            except (KeyError, ValueError, etcd.EtcdException):
+                logger.warn('Failed to release route53 sync leadership (%s)',
+                            self.node_id)
+
+    def wait_for_vacancy(self):
+        """
+        Standby: Waits till the current lease is released or expires (at
+        most one lease TTL).
+        """
+        try:
+            self.etcd_cl.read(self.lease_key, wait=True, timeout=self.ttl)
+        except (KeyError, etcd.EtcdKeyError):
+            # No leader at the moment
+            pass
+        except (ReadTimeoutError, etcd.EtcdException):
+            # Includes watch timeouts. Simply retry acquiring the lease.
+            pass
@@ -0,0 +1,318 @@
+"""
+Helpers for computing and submitting batched changes to the weighted
+route53 records managed by the sync job.
+"""
+import time
+
+from boto.route53.exception import DNSServerError
+from boto.route53.record import ResourceRecordSets, Record
+
+from discover import logger
+from discover.metrics import get_metrics
+
+# Route53 allows up to 1000 records (and 32000 characters) per change
+# request. Each weighted change carries a single value, so 100 changes per
+# request stays well within both limits.
+MAX_CHANGES_PER_REQUEST = 100
+# Interval in seconds after which cached records are re-listed from route53
+DEFAULT_REFRESH_INTERVAL = 300
+# Route53 allows 5 requests per second per account (shared with other tools)
+DEFAULT_REQUESTS_PER_SECOND = 5
+DEFAULT_BURST = 5
+THROTTLING_ERRORS = ('Throttling', 'PriorRequestNotComplete')
+# Route53 API calls going through the rate limiter
+RATE_LIMITED_CALLS = ('get_all_rrsets', 'change_rrsets', 'get_change')
+
+
+def is_throttled(error):
+    """
+    Checks if the error is a route53 throttling error.
+
+    :param error: Error raised by the route53 call
+    :type error: Exception
+    :rtype: bool
+    """
+    return isinstance(error, DNSServerError) and \
+        error.error_code in THROTTLING_ERRORS
+
+
+class RateLimitedConnection:
+    """
+    Route53 connection proxy sending every API call through the rate
+    limiter. Record sets created using this connection (e.g. while
+    committing) are rate limited as well. Record sets returned by
+    get_all_rrsets are bound to the wrapped connection, so the listing is
+    paginated explicitly (see list_weighted_records).
+    """
+
+    def __init__(self, conn, limiter):
+        self.conn = conn
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.conn, name)
+        if name not in RATE_LIMITED_CALLS:
+            return attr
+
+        def rate_limited(*args, **kwargs):
+            with get_metrics().timed('route53_%s' % name):
+                return self.limiter.call(attr, *args, **kwargs)
+        return rate_limited
+
+
+def normalize_name(name):
+    """
+    Normalizes dns name to the fully qualified form returned by route53.
+
+    :param name: DNS name. e.g.: mycluster.abc.com
+    :type name: str
+    :rtype: str
+    """
+    return name.rstrip('.').lower() + '.'
+
+
+def list_weighted_records(conn, zone_id, dns_record, record_type):
+    """
+    Lists all weighted records for the given name and type, paginating
+    through the hosted zone listing. Pages are requested through the given
+    connection (so that every page is rate limited) instead of letting boto
+    fetch them using its own connection.
+
+    :param conn: Route53 connection
+    :param zone_id: Hosted zone id
+    :type zone_id: str
+    :param dns_record: DNS Record e.g. (mycluster.abc.com)
+    :type dns_record: str
+    :param record_type: Type of record (CNAME, A)
+    :type record_type: str
+    :return: Records keyed by set identifier
+    :rtype: dict
+    """
+    dns_name = normalize_name(dns_record)
+    records = {}
+    page_args = {'type': record_type, 'name': dns_record}
+    while page_args:
+        page = conn.get_all_rrsets(zone_id, **page_args)
+        # Iterate the current page only (iterating the record sets pages
+        # through the connection bound by boto)
+        for record in page[:]:
+            if normalize_name(record.name) != dns_name or \
+                    record.type != record_type:
+                # Listing is sorted by name and type. No more matching
+                # records.
+                return records
+            if record.identifier:
+                records[record.identifier] = record
+        page_args = None
+        if getattr(page, 'is_truncated', False):
+            page_args = {'type': page.next_record_type,
+                         'name': page.next_record_name,
+                         'identifier': page.next_record_identifier}
+    return records
+
+
+def collapse_events(events, proxy_nodes_key):
+    """
+    Collapses the etcd events into the final desired state per proxy node.
+
+    :param events: Etcd events (in order of modified index)
+    :type events: list
+    :param proxy_nodes_key: Etcd key for the proxy nodes
+    :type proxy_nodes_key: str
+    :return: Desired record value (None for removal) keyed by node name
+    :rtype: dict
+    """
+    desired = {}
+    for event in events:
+        node_name = event.key[len(proxy_nodes_key):].strip('/')
+        if not node_name or '/' in node_name:
+            continue
+        if event.action in ('delete', 'expire'):
+            desired[node_name] = None
+        else:
+            desired[node_name] = event.value
+    return desired
+
+
+def plan_changes(desired, current, weight, ttl):
+    """
+    Computes the route53 changes needed to move the current records to the
+    desired state.
+
+    :param desired: Desired record value (None for removal) keyed by node
+    :type desired: dict
+    :param current: Current records keyed by set identifier
+    :type current: dict
+    :param weight: Weight for the desired records
+    :type weight: int or dict
+    :param ttl: DNS TTL for the desired records
+    :type ttl: int
+    :return: List of (action, identifier, value, ttl, weight) tuples
+    :rtype: list
+    """
+    changes = []
+    for identifier, value in sorted(desired.items()):
+        record = current.get(identifier)
+        record_weight = weight.get(identifier) \
+            if isinstance(weight, dict) else weight
+        if value is None:
+            if record:
+                changes.append(('DELETE', identifier,
+                                record.resource_records[0], record.ttl,
+                                record.weight))
+            else:
+                logger.info('Skip delete for non existing record with '
+                            'identifier:%s', identifier)
+        elif record and record.resource_records == [value] and \
+                str(record.weight) == str(record_weight) and \
+                str(record.ttl) == str(ttl):
+            logger.info('No change in record with identifier:%s. '
+                        'Skipping...', identifier)
+        else:
+            changes.append(('UPSERT', identifier, value, ttl, record_weight))
+    return changes
+
+
+def chunk_changes(changes, size=MAX_CHANGES_PER_REQUEST):
+    return [changes[index:index + size]
+            for index in range(0, len(changes), size)]
+
+
+def commit_changes(conn, zone_id, dns_record, record_type, changes):
+    """
+    Submits the changes to route53 in as few requests as the API limits
+    allow.
+
+    :param conn: Route53 connection
+    :param zone_id: Hosted zone id
+    :type zone_id: str
+    :param dns_record: DNS Record e.g. (mycluster.abc.com)
+    :type dns_record: str
+    :param record_type: Type of record (CNAME, A)
+    :type record_type: str
+    :param changes: List of (action, identifier, value, ttl, weight) tuples
+    :type changes: list
+    :return: Number of change requests submitted
+    :rtype: int
+    """
+    requests = 0
+    for batch in chunk_changes(changes):
+        change_set = ResourceRecordSets(conn, zone_id)
+        for action, identifier, value, ttl, weight in batch:
+            logger.info('%s record: %s:%s with identifier:%s', action,
+                        dns_record, value, identifier)
+            change = change_set.add_change(
+                action, name=dns_record, type=record_type, ttl=ttl,
+                identifier=identifier, weight=weight)
+            change.add_value(value)
+        change_set.commit()
+        requests += 1
+    return requests
+
+
+class RecordSetCache:
+    """
+    In memory view of the weighted records for the managed name (keyed by
+    set identifier). Kept up to date from our own successful commits and
+    refreshed from route53 periodically, after a conflict or when another
+    replica applied changes in between (see synced_index).
+    """
+
+    def __init__(self, conn, zone_id, dns_record, record_type,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.conn = conn
+        self.zone_id = zone_id
+        self.dns_record = dns_record
+        self.record_type = record_type
+        self.refresh_interval = refresh_interval
+        self.records = {}
+        self.refreshed_at = None
+        # Sync index written after the last changes applied by this process
+        self.synced_index = None
+
+    def invalidate(self):
+        """
+        Marks the cached records as stale so that they are listed from
+        route53 on next use.
+        """
+        self.refreshed_at = None
+
+    def refresh(self):
+        self.records = list_weighted_records(self.conn, self.zone_id,
+                                             self.dns_record,
+                                             self.record_type)
+        self.refreshed_at = time.time()
+        return self.records
+
+    def get_records(self):
+        """
+        Gets the cached records, refreshing them from route53 if the cache
+        is stale.
+
+        :return: Records keyed by set identifier
+        :rtype: dict
+        """
+        if self.refreshed_at is None or \
+                time.time() - self.refreshed_at >= self.refresh_interval:
+            self.refresh()
+        return self.records
+
+    def commit(self, changes):
+        """
+        Commits the changes to route53 and updates the cached records.
+
+        :param changes: List of (action, identifier, value, ttl, weight)
+            tuples
+        :type changes: list
+        :return: Number of change requests submitted
+        :rtype: int
+        """
+        requests = 0
+        for batch in chunk_changes(changes):
+            requests += commit_changes(self.conn, self.zone_id,
+                                       self.dns_record, self.record_type,
+                                       batch)
+            for action, identifier, value, ttl, weight in batch:
+                if action == 'DELETE':
+                    self.records.pop(identifier, None)
+                else:
+                    self.records[identifier] = Record(
+                        name=normalize_name(self.dns_record),
+                        type=self.record_type, ttl=ttl,
+                        resource_records=[value], identifier=identifier,
+                        weight=weight)
+        return requests
+
+    def apply(self, desired, weight, ttl):
+        """
+        Applies the desired state using the cached records. Records are
+        refreshed before deleting a record missing from the cache. On a
+        conflict (e.g. records modified outside of this job) the cache is
+        refreshed and the changes are planned and applied again.
+
+        :param desired: Desired record value (None for removal) keyed by node
+        :type desired: dict
+        :param weight: Weight for the desired records
+        :type weight: int or dict
+        :param ttl: DNS TTL for the desired records
+        :type ttl: int
+        :return: Applied changes
+        :rtype: list
+        """
+        refreshed_at = self.refreshed_at
+        current = self.get_records()
+        if refreshed_at == self.refreshed_at and any(
+                value is None and identifier not in current
+                for identifier, value in desired.items()):
+            # Record may have been created by another replica
+            current = self.refresh()
+        changes = plan_changes(desired, current, weight, ttl)
+        try:
+            self.commit(changes)
+        except DNSServerError:
+            logger.exception('Failed to apply changes to %s. Refreshing '
+                             'records and retrying', self.dns_record)
+            self.refresh()
+            changes = plan_changes(desired, self.records, weight, ttl)
+            self.commit(changes)
+        return changes
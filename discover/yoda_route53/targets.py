@@ -0,0 +1,404 @@
+"""
+Fan-out of the proxy node changes from a single etcd watch to multiple
+route53 targets (zone, record, type and weight). Every target has its own
+worker thread, route53 connection and rate limiter so that a slow or
+throttled zone does not hold up the others.
+"""
+import copy
+import json
+import threading
+import time
+
+from discover import logger
+from discover.metrics import get_metrics
+from discover.tracing import span
+
+# Keys that can be specified per target (others are taken from the parsed
+# arguments)
+TARGET_KEYS = ('zone_id', 'dns_record', 'record_type', 'record_weight',
+               'dns_ttl', 'route53_rate', 'route53_burst')
+COMPACT_TARGET_KEYS = ('zone_id', 'dns_record', 'record_type',
+                       'record_weight')
+# Time in seconds to wait for the targets to apply a batch before moving on
+DEFAULT_TARGET_TIMEOUT = 30
+# Time in seconds to wait before retrying failed changes for a target
+RETRY_DELAY = 5
+
+
+def parse_targets(value):
+    """
+    Parses the route53 targets. Targets are specified either as a json list
+    (e.g. [{"zone_id": "Z1", "dns_record": "a.abc.com", "route53_rate": 2}])
+    or as comma separated zone_id:dns_record[:record_type[:record_weight]]
+    (e.g. Z1:a.abc.com,Z2:a.internal:A:10).
+
+    :param value: Targets
+    :type value: str
+    :return: List of targets
+    :rtype: list
+    :raises ValueError: If the targets are invalid
+    """
+    value = (value or '').strip()
+    if value.startswith('['):
+        targets = json.loads(value)
+    else:
+        targets = []
+        for spec in value.split(','):
+            if not spec.strip():
+                continue
+            parts = [part.strip() for part in spec.split(':')]
+            if len(parts) > len(COMPACT_TARGET_KEYS):
+                raise ValueError('Invalid route53 target: %s' % spec)
+            targets.append(dict(zip(COMPACT_TARGET_KEYS, parts)))
+    for target in targets:
+        unknown = set(target) - set(TARGET_KEYS)
+        if unknown:
+            raise ValueError('Unknown route53 target keys: %s' %
+                             ', '.join(sorted(unknown)))
+        if not target.get('zone_id') or not target.get('dns_record'):
+            raise ValueError('zone_id and dns_record are required for '
+                             'route53 target: %s' % target)
+        for key in ('record_weight', 'dns_ttl', 'route53_burst'):
+            if key in target:
+                target[key] = int(target[key])
+        if 'route53_rate' in target:
+            target['route53_rate'] = float(target['route53_rate'])
+    return targets
+
+
+def target_args(parsed_args, target):
+    """
+    Creates the arguments for a single target.
+
+    :param parsed_args: Parsed arguments
+    :param target: Target (as returned by parse_targets)
+    :type target: dict
+    :return: Copy of parsed arguments for the given target
+    """
+    args = copy.copy(parsed_args)
+    for key, value in target.items():
+        setattr(args, key, value)
+    return args
+
+
+def record_weights(parsed_args, weights, identifiers, current):
+    """
+    Gets the weight to be used for the given records.
+
+    :param parsed_args: Parsed arguments
+    :param weights: Load aware weights (None for static weight)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :param identifiers: Record identifiers
+    :type identifiers: iterable
+    :param current: Current records keyed by set identifier
+    :type current: dict
+    :return: Static weight or weight keyed by identifier
+    :rtype: int or dict
+    """
+    if weights is None:
+        return parsed_args.record_weight
+    return weights.weights(identifiers, current)
+
+
+def apply_desired(records, parsed_args, desired, weights=None, **labels):
+    """
+    Applies the desired state per proxy node to the route53 records.
+
+    :param records: Cached route53 records
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments (for the target)
+    :param desired: Desired record value (None for removal) keyed by node
+    :type desired: dict
+    :param weights: Load aware weights (None for static weight)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :keyword labels: Metric labels
+    :return: Applied changes
+    :rtype: list
+    """
+    metrics = get_metrics()
+    with metrics.timed('update_route53', **labels), span('route53'):
+        changes = records.apply(
+            desired, record_weights(parsed_args, weights, desired,
+                                    records.get_records()),
+            parsed_args.dns_ttl)
+    metrics.counter('route53_changes_total',
+                    'Number of changes applied to route53').inc(
+        len(changes), **labels)
+    return changes
+
+
+def apply_nodes(records, parsed_args, nodes, weights=None, **labels):
+    """
+    Applies the full snapshot of proxy nodes to the route53 records
+    (records without a proxy node get removed). Only the differences are
+    applied.
+
+    :param records: Cached route53 records
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments (for the target)
+    :param nodes: Record value keyed by proxy node name
+    :type nodes: dict
+    :param weights: Load aware weights (None for static weight)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :keyword labels: Metric labels
+    :return: Tuple of (applied changes, records before the changes)
+    :rtype: tuple
+    """
+    with span('route53'):
+        current = records.refresh()
+    desired = {identifier: None for identifier in current}
+    desired.update(nodes)
+    with get_metrics().timed('reconcile_route53', **labels), span('route53'):
+        changes = records.apply(
+            desired, record_weights(parsed_args, weights, desired, current),
+            parsed_args.dns_ttl)
+    return changes, current
+
+
+def apply_weights(records, parsed_args, weights, **labels):
+    """
+    Updates the records whose load aware weight changed beyond the minimum
+    change.
+
+    :param records: Cached route53 records
+    :type records: discover.yoda_route53.records.RecordSetCache
+    :param parsed_args: Parsed arguments (for the target)
+    :param weights: Load aware weights (with the latest loads)
+    :type weights: discover.yoda_route53.weights.LoadWeights
+    :keyword labels: Metric labels
+    :return: Applied changes
+    :rtype: list
+    """
+    current = records.get_records()
+    desired = {identifier: record.resource_records[0]
+               for identifier, record in current.items()
+               if record.resource_records}
+    with get_metrics().timed('update_route53_weights', **labels), \
+            span('route53'):
+        changes = records.apply(
+            desired, weights.weights(desired, current), parsed_args.dns_ttl)
+    if changes:
+        logger.info('Updated weights for %d record(s) of %s', len(changes),
+                    parsed_args.dns_record)
+    return changes
+
+
+class TargetWorker:
+    """
+    Applies the changes for a single target from its own thread. Changes
+    submitted while the worker is busy (e.g. throttled) are coalesced into
+    the final desired state per proxy node.
+    """
+
+    def __init__(self, parsed_args, records, weights=None):
+        """
+        :param parsed_args: Parsed arguments for the target
+        :param records: Cached route53 records for the target
+        :type records: discover.yoda_route53.records.RecordSetCache
+        :param weights: Load aware weights (None for static weight)
+        :type weights: discover.yoda_route53.weights.LoadWeights
+        """
+        self.parsed_args = parsed_args
+        self.records = records
+        self.weights = weights
+        self.labels = {'zone': parsed_args.zone_id,
+                       'record': parsed_args.dns_record}
+        self._condition = threading.Condition()
+        self._snapshot = None
+        self._desired = {}
+        self._loads = None
+        self._index = None
+        self._busy = False
+        self._thread = None
+        # Etcd index of the latest changes applied by the worker
+        self.applied_index = None
+
+    def _pending(self):
+        return self._snapshot is not None or bool(self._desired) or \
+            self._loads is not None
+
+    def submit(self, desired=None, snapshot=None, loads=None, index=None):
+        """
+        Submits changes for the target.
+
+        :param desired: Desired record value (None for removal) keyed by
+            node
+        :type desired: dict
+        :param snapshot: Full snapshot of proxy nodes (replaces the pending
+            changes)
+        :type snapshot: dict
+        :param loads: Latest proxy loads (for load aware weights)
+        :type loads: dict
+        :param index: Etcd index of the changes
+        :type index: int
+        """
+        with self._condition:
+            if index is not None:
+                self._index = index
+            if snapshot is not None:
+                self._snapshot = dict(snapshot)
+                self._desired = {}
+            if desired:
+                self._desired.update(desired)
+            if loads is not None and self.weights is not None:
+                self._loads = loads
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Waits till the submitted changes are applied.
+
+        :param timeout: Timeout in seconds
+        :type timeout: float
+        :return: True if all the changes were applied
+        :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._busy and not self._pending(), timeout)
+
+    def _take(self):
+        with self._condition:
+            self._condition.wait_for(self._pending)
+            work = (self._snapshot, self._desired, self._loads, self._index)
+            self._snapshot, self._desired, self._loads = None, {}, None
+            self._index = None
+            self._busy = True
+            return work
+
+    def _restore(self, snapshot, desired, loads, index):
+        # Re-queue failed changes (unless superseded by newer ones)
+        with self._condition:
+            if self._snapshot is None and snapshot is not None:
+                self._snapshot = snapshot
+            elif snapshot is not None:
+                desired = {}
+            merged = dict(desired)
+            merged.update(self._desired)
+            self._desired = merged
+            if self._loads is None:
+                self._loads = loads
+            if self._index is None:
+                self._index = index
+
+    def apply(self, snapshot, desired, loads, index=None):
+        if loads is not None:
+            self.weights.loads = loads
+        if snapshot is not None:
+            changes, current = apply_nodes(
+                self.records, self.parsed_args, snapshot, self.weights,
+                **self.labels)
+            logger.info('Reconciled %d proxy node(s) with %d record(s) of '
+                        '%s. Applied %d change(s)', len(snapshot),
+                        len(current), self.parsed_args.dns_record,
+                        len(changes))
+        if desired:
+            changes = apply_desired(self.records, self.parsed_args, desired,
+                                    self.weights, **self.labels)
+            logger.info('Applied %d change(s) to %s', len(changes),
+                        self.parsed_args.dns_record)
+        elif snapshot is None and loads is not None:
+            apply_weights(self.records, self.parsed_args, self.weights,
+                          **self.labels)
+        if index is not None:
+            with self._condition:
+                self.applied_index = max(self.applied_index or 0, index)
+
+    def _run(self):
+        while True:
+            work = self._take()
+            failed = False
+            try:
+                self.apply(*work)
+            except Exception:
+                failed = True
+                logger.exception('Failed to apply changes to %s. Retrying '
+                                 'in %ds', self.parsed_args.dns_record,
+                                 RETRY_DELAY)
+                get_metrics().counter(
+                    'route53_target_failures_total',
+                    'Number of failed change sets per route53 target').inc(
+                    **self.labels)
+                self._restore(*work)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+            if failed:
+                time.sleep(RETRY_DELAY)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='route53-%s' % self.parsed_args.dns_record)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+
+class Route53Targets:
+    """
+    Fans the changes out to the target workers. After submitting a batch,
+    waits (bounded by the timeout) for the workers to apply it. Workers that
+    are still busy keep applying in background, so only the lowest index
+    applied by every target (applied_index) is safe to be persisted.
+    """
+
+    def __init__(self, workers, timeout=DEFAULT_TARGET_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        # Sync index written after the last changes applied by this process
+        self.synced_index = None
+
+    def invalidate(self):
+        """
+        Marks the cached records of all the targets as stale.
+        """
+        for worker in self.workers:
+            worker.records.invalidate()
+
+    @property
+    def applied_index(self):
+        """
+        Gets the etcd index of the latest changes applied by all the targets.
+
+        :return: Lowest applied index of the targets (None if a target did
+            not apply any changes yet)
+        :rtype: int
+        """
+        indexes = [worker.applied_index for worker in self.workers]
+        if not indexes or None in indexes:
+            return None
+        return min(indexes)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def submit(self, desired=None, snapshot=None, loads=None, index=None):
+        """
+        Submits the changes to all the targets and waits for them to be
+        applied.
+
+        :return: True if all the targets applied the changes in time
+        :rtype: bool
+        """
+        for worker in self.workers:
+            worker.submit(desired=desired, snapshot=snapshot, loads=loads,
+                          index=index)
+        return self.wait()
+
+    def wait(self):
+        deadline = time.time() + self.timeout
+        applied = True
+        for worker in self.workers:
+            if not worker.wait(max(deadline - time.time(), 0)):
+                applied = False
+                logger.warn('Route53 target %s is still applying changes. '
+                            'Continuing in background',
+                            worker.parsed_args.dns_record)
+                get_metrics().counter(
+                    'route53_target_timeouts_total',
+                    'Number of batches not applied by a route53 target in '
+                    'time').inc(**worker.labels)
+        return applied
@@ -0,0 +1,102 @@
+"""
+Load aware weights for the weighted route53 records. Proxies with more
+load than the average get a lower weight. Changes are damped and only
+applied when they exceed a minimum change so that route53 is not updated
+on every load sample.
+"""
+import json
+
+DEFAULT_MAX_WEIGHT = 100
+DEFAULT_MIN_WEIGHT = 10
+# Fraction of the distance to the target weight moved in one update
+DEFAULT_DAMPING = 0.5
+# Minimum relative change in weight for a record to be updated
+DEFAULT_MIN_CHANGE = 0.2
+DEFAULT_WEIGHT_INTERVAL = 60
+
+
+def parse_load(value):
+    """
+    Parses the load published by the presence agent.
+
+    :param value: Published value. e.g.: {"connections": 10}
+    :type value: str
+    :return: Load or None if the value is invalid
+    :rtype: float
+    """
+    try:
+        load = json.loads(value)
+        if isinstance(load, dict):
+            load = load.get('connections')
+        return float(load) if load is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LoadWeights:
+    """
+    Computes record weights from the load of the proxies. The current
+    weight is taken from the route53 record itself so that every sync
+    replica computes the same weights.
+    """
+
+    def __init__(self, max_weight=DEFAULT_MAX_WEIGHT,
+                 min_weight=DEFAULT_MIN_WEIGHT, damping=DEFAULT_DAMPING,
+                 min_change=DEFAULT_MIN_CHANGE):
+        self.max_weight = max_weight
+        self.min_weight = min(min_weight, max_weight)
+        self.damping = damping
+        self.min_change = min_change
+        # Load keyed by proxy node name
+        self.loads = {}
+
+    def target(self, identifier):
+        """
+        Gets the target weight for the proxy. A proxy with average load (or
+        without a published load) gets the max weight. Others get a weight
+        inversely proportional to their load.
+
+        :param identifier: Record identifier (proxy node name)
+        :type identifier: str
+        :rtype: int
+        """
+        load = self.loads.get(identifier)
+        if load is None or not self.loads:
+            return self.max_weight
+        mean = sum(self.loads.values()) / len(self.loads)
+        weight = int(round(self.max_weight * (mean + 1) / (load + 1)))
+        return max(self.min_weight, min(weight, self.max_weight))
+
+    def weight(self, identifier, record=None):
+        """
+        Gets the damped weight for the proxy.
+
+        :param identifier: Record identifier (proxy node name)
+        :type identifier: str
+        :param record: Current route53 record (if any)
+        :type record: boto.route53.record.Record
+        :rtype: int
+        """
+        target = self.target(identifier)
+        try:
+            current = int(record.weight)
+        except (AttributeError, TypeError, ValueError):
+            # New record
+            return target
+        if abs(target - current) < max(self.min_change * current, 1):
+            return current
+        return int(round(current + self.damping * (target - current)))
+
+    def weights(self, identifiers, records):
+        """
+        Gets the weights for the given records.
+
+        :param identifiers: Record identifiers
+        :type identifiers: iterable
+        :param records: Current records keyed by set identifier
+        :type records: dict
+        :return: Weight keyed by identifier
+        :rtype: dict
+        """
+        return {identifier: self.weight(identifier, records.get(identifier))
+                for identifier in identifiers}
@@ -0,0 +1,171 @@
+import etcd
+from boto.route53.exception import DNSServerError
+from boto.route53.record import ResourceRecordSets
+from nose.tools import eq_, raises
+from benchmarks.fakes import FakeEtcdServer, FakeRoute53Connection
+from benchmarks.register import percentile
+from benchmarks.route53 import create_parser as route53_parser, replay, \
+    rolling_replace, mass_expiry, minimal_changes
+from benchmarks.startup import heavy_modules, failures, COMMANDS
+
+
+def test_percentile():
+
+    # When: I get percentiles for 100 values
+    values = list(range(1, 101))
+
+    # Then: Nearest rank is returned
+    eq_(percentile(values, 50), 50)
+    eq_(percentile(values, 99), 99)
+    eq_(percentile([], 50), None)
+
+
+def _with_fake_etcd(test):
+    def wrapper():
+        server = FakeEtcdServer().start()
+        try:
+            test(server, etcd.Client(host='127.0.0.1', port=server.port))
+        finally:
+            server.stop()
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+@_with_fake_etcd
+def test_fake_etcd_write_refresh_and_delete(server, etcd_cl):
+    # When: I write, refresh and delete a key
+    etcd_cl.write('/yoda/mock', 'value', ttl=10)
+    etcd_cl.refresh('/yoda/mock', 20)
+    eq_([leaf.value for leaf in etcd_cl.read('/yoda', recursive=True).leaves],
+        ['value'])
+    etcd_cl.delete('/yoda/mock')
+
+    # Then: All writes are counted
+    eq_(server.writes, 3)
+
+
+@raises(etcd.EtcdAlreadyExist)
+@_with_fake_etcd
+def test_fake_etcd_write_with_prev_exist_false(server, etcd_cl):
+    # Given: Existing key
+    etcd_cl.write('/yoda/mock', 'value')
+
+    # When: I create the key again
+    etcd_cl.write('/yoda/mock', 'value', prevExist=False)
+
+    # Then: EtcdAlreadyExist is raised
+
+
+@_with_fake_etcd
+def test_fake_etcd_watch_from_index(server, etcd_cl):
+    # Given: Key written after index 1
+    etcd_cl.write('/yoda/proxy-nodes/mock', 'value')
+
+    # When: I watch from index 1
+    result = etcd_cl.read('/yoda/proxy-nodes', recursive=True, wait=True,
+                          waitIndex=1, timeout=5)
+
+    # Then: Past event is returned
+    eq_(result.key, '/yoda/proxy-nodes/mock')
+    eq_(result.modifiedIndex, 1)
+
+
+def test_register_and_presence_do_not_import_boto():
+    # When: I check heavy modules imported by register and presence
+    register_modules = heavy_modules(COMMANDS['register'])
+    presence_modules = heavy_modules(COMMANDS['presence'])
+
+    # Then: boto is only imported by route53
+    eq_('boto' in register_modules, False)
+    eq_('boto' in presence_modules, False)
+    eq_('docker' in presence_modules, False)
+
+
+def test_etcd3_is_only_imported_when_used():
+    # When: I check heavy modules imported by the etcd3 capable tools
+    register_modules = heavy_modules(COMMANDS['register'])
+    presence_modules = heavy_modules(COMMANDS['presence'])
+
+    # Then: etcd3 (and its grpc stack) is not imported up front
+    eq_('etcd3' in register_modules, False)
+    eq_('etcd3' in presence_modules, False)
+    eq_('grpc' in register_modules, False)
+
+
+def test_startup_failures():
+    # Given: Startup results with an unexpected import and a slow start up
+    results = {'results': {
+        'register': {'p50_seconds': 2.0, 'unexpected_modules': ['boto']},
+        'presence': {'p50_seconds': 0.1, 'unexpected_modules': []},
+    }}
+
+    # When: I get failures
+    found = failures(results, max_seconds=1.0)
+
+    # Then: Both regressions are reported
+    eq_(sorted(found), ['register imports boto',
+                        'register starts in 2.0s (max: 1.0s)'])
+
+
+def test_rolling_replace_scenario():
+    # When: I generate a rolling replace of 2 nodes
+    scenario = rolling_replace(2)
+
+    # Then: Every node is replaced by a new one
+    eq_(sorted(scenario['initial']), ['node-0', 'node-1'])
+    eq_([(event['action'], event['node']) for event in scenario['events']],
+        [('set', 'node-2'), ('delete', 'node-0'), ('set', 'node-3'),
+         ('delete', 'node-1')])
+
+
+def test_minimal_changes():
+    # When: I get minimal changes between initial and final records
+    # Then: Added, removed and updated records are counted
+    eq_(minimal_changes({'node1': 'a', 'node2': 'b', 'node3': 'c'},
+                        {'node1': 'a', 'node2': 'x', 'node4': 'd'}), 3)
+
+
+@raises(DNSServerError)
+def test_fake_route53_throttles():
+    # Given: Fake route53 allowing a single request
+    route53 = FakeRoute53Connection(rate=0.001, burst=1)
+    route53.get_all_rrsets('Z1')
+
+    # When: I make another request
+    route53.get_all_rrsets('Z1')
+
+    # Then: Throttling error is raised
+
+
+def test_fake_route53_rejects_delete_of_changed_record():
+    # Given: Fake route53 with a record
+    route53 = FakeRoute53Connection(rate=100, burst=10)
+    route53.seed('a.abc.com', 'CNAME', {'node1': 'host1'}, 60, 1)
+    change_set = ResourceRecordSets(route53, 'Z1')
+    change_set.add_change('DELETE', 'a.abc.com', 'CNAME', ttl=60,
+                          identifier='node1', weight=1).add_value('host2')
+
+    # When: I delete the record with a stale value
+    try:
+        change_set.commit()
+        raise AssertionError('DNSServerError not raised')
+    except DNSServerError as error:
+        # Then: Batch is rejected
+        eq_(error.error_code, 'InvalidChangeBatch')
+    eq_(route53.values('a.abc.com', 'CNAME'), {'node1': 'host1'})
+
+
+def test_replay_mass_expiry():
+    # Given: Mass expiry of 2 out of 4 proxy nodes
+    parsed_args = route53_parser().parse_args([
+        'replay', '--speed', '100', '--converge-timeout', '20',
+        '--route53-latency', '0'])
+
+    # When: I replay it into the route53 sync
+    results = replay(mass_expiry(4), parsed_args)['results']
+
+    # Then: Records converge with the minimal changes
+    eq_(results['converged'], True)
+    eq_(results['changes'], 2)
+    eq_(results['redundant_changes'], 0)
+    eq_(results['missing_records'] + results['unexpected_records'], 0)
@@ -0,0 +1,53 @@
+from collections import namedtuple
+import etcd
+from mock import patch, MagicMock
+from nose.tools import eq_, raises
+from discover.clients import yoda_client, reset_clients, \
+    reconnect_on_failure
+
+Args = namedtuple('Args', 'etcd_host etcd_port etcd_base')
+
+
+@patch('yoda.Client')
+@patch('etcd.Client')
+def test_yoda_client_is_shared(m_etcd_cl, m_yoda_cl):
+    # Given: No existing clients
+    reset_clients()
+
+    # When: I get yoda client multiple times
+    clients = [yoda_client(Args('mockhost', 4001, '/yoda'))
+               for _ in range(3)]
+
+    # Then: Clients are created only once
+    eq_(clients, [m_yoda_cl.return_value] * 3)
+    m_etcd_cl.assert_called_once_with(host='mockhost', port=4001)
+    m_yoda_cl.assert_called_once_with(etcd_cl=m_etcd_cl.return_value,
+                                      etcd_base='/yoda')
+
+
+@patch('discover.clients.reset_clients')
+def test_reconnect_on_failure(m_reset_clients):
+    # Given: Function failing once with connection error
+    func = MagicMock(__name__='func', side_effect=[
+        etcd.EtcdConnectionFailed('mock'), 'success'])
+
+    # When: I call the decorated function
+    result = reconnect_on_failure(func)('mockarg')
+
+    # Then: Function is retried with fresh clients
+    eq_(result, 'success')
+    eq_(func.call_count, 2)
+    m_reset_clients.assert_called_once_with()
+
+
+@raises(etcd.EtcdConnectionFailed)
+@patch('discover.clients.reset_clients')
+def test_reconnect_on_failure_retries_only_once(m_reset_clients):
+    # Given: Function always failing with connection error
+    func = MagicMock(__name__='func', side_effect=etcd.EtcdConnectionFailed(
+        'mock'))
+
+    # When: I call the decorated function
+    reconnect_on_failure(func)()
+
+    # Then: EtcdConnectionFailed is raised
@@ -0,0 +1,30 @@
+from mock import patch
+from nose.tools import eq_
+from discover.__main__ import main
+
+
+@patch('discover.__main__.importlib')
+def test_main_runs_command(m_importlib):
+    # When: I run register command
+    main(['register', '--all-containers', '--etcd-host', 'mockhost'])
+
+    # Then: Only register module is imported and run with remaining args
+    m_importlib.import_module.assert_called_once_with(
+        'discover.yoda_register.__main__')
+    m_importlib.import_module.return_value.main.assert_called_once_with(
+        ['--all-containers', '--etcd-host', 'mockhost'],
+        prog='python -m discover register')
+
+
+@patch('discover.__main__.importlib')
+def test_main_rejects_unknown_command(m_importlib):
+    # When: I run an unknown command
+    try:
+        main(['unknown'])
+        exited = False
+    except SystemExit:
+        exited = True
+
+    # Then: Parser exits without importing any command
+    eq_(exited, True)
+    eq_(m_importlib.import_module.called, False)
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from mock import MagicMock
+from nose.tools import eq_, raises
+from discover.ec2_metadata import InstanceMetadata
+
+
+def _with_cache_dir(test):
+    def wrapper():
+        cache_dir = tempfile.mkdtemp()
+        try:
+            test(os.path.join(cache_dir, 'metadata.json'))
+        finally:
+            shutil.rmtree(cache_dir)
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+@_with_cache_dir
+def test_get_fetches_only_requested_key(cache_file):
+    # Given: Instance metadata without cached values
+    fetch = MagicMock(return_value='mockhost')
+    metadata = InstanceMetadata(cache_file=cache_file, fetch=fetch)
+
+    # When: I get the metadata value
+    value = metadata['public-hostname']
+
+    # Then: Only the requested key is fetched and cached on disk
+    eq_(value, 'mockhost')
+    fetch.assert_called_once_with('public-hostname', timeout=2)
+    with open(cache_file) as cache:
+        eq_(json.load(cache)['public-hostname']['value'], 'mockhost')
+
+
+@_with_cache_dir
+def test_get_uses_cache_shared_by_processes(cache_file):
+    # Given: Value cached by another process
+    InstanceMetadata(cache_file=cache_file,
+                     fetch=MagicMock(return_value='mockhost'))['local-ipv4']
+    fetch = MagicMock()
+    metadata = InstanceMetadata(cache_file=cache_file, fetch=fetch)
+
+    # When: I get the metadata value
+    value = metadata['local-ipv4']
+
+    # Then: Cached value is returned without fetching
+    eq_(value, 'mockhost')
+    eq_(fetch.called, False)
+
+
+@_with_cache_dir
+def test_get_refetches_expired_value(cache_file):
+    # Given: Expired cached value
+    with open(cache_file, 'w') as cache:
+        json.dump({'local-ipv4': {'value': 'oldhost',
+                                  'fetched': time.time() - 100}}, cache)
+    fetch = MagicMock(return_value='newhost')
+    metadata = InstanceMetadata(cache_file=cache_file, ttl=10, fetch=fetch)
+
+    # When: I get the metadata value
+    value = metadata['local-ipv4']
+
+    # Then: Value is re-fetched
+    eq_(value, 'newhost')
+    eq_(fetch.call_count, 1)
+
+
+@_with_cache_dir
+def test_get_uses_stale_value_on_fetch_failure(cache_file):
+    # Given: Expired cached value and metadata service failing
+    with open(cache_file, 'w') as cache:
+        json.dump({'local-ipv4': {'value': 'oldhost',
+                                  'fetched': time.time() - 100}}, cache)
+    fetch = MagicMock(side_effect=Exception('mock'))
+    metadata = InstanceMetadata(cache_file=cache_file, ttl=10, fetch=fetch)
+
+    # When: I get the metadata value
+    value = metadata['local-ipv4']
+
+    # Then: Stale value is returned
+    eq_(value, 'oldhost')
+
+
+@raises(Exception)
+@_with_cache_dir
+def test_get_fails_without_cached_value(cache_file):
+    # Given: Metadata service failing and no cached value
+    metadata = InstanceMetadata(
+        cache_file=cache_file, fetch=MagicMock(side_effect=Exception('mock')))
+
+    # When: I get the metadata value
+    metadata['local-ipv4']
+
+
+@_with_cache_dir
+def test_get_creates_missing_cache_dir(cache_file):
+    # Given: Instance metadata cached in a directory that does not exist yet
+    cache_file = os.path.join(os.path.dirname(cache_file), 'missing',
+                              'metadata.json')
+    metadata = InstanceMetadata(cache_file=cache_file,
+                                fetch=MagicMock(return_value='mockhost'))
+
+    # When: I get the metadata value
+    eq_(metadata['public-hostname'], 'mockhost')
+
+    # Then: Value is cached on disk
+    with open(cache_file) as cache:
+        eq_(json.load(cache)['public-hostname']['value'], 'mockhost')
@@ -0,0 +1,182 @@
+import os
+import time
+from unittest import SkipTest
+from mock import patch
+from nose.tools import eq_
+from benchmarks.fakes import FakeEtcd3Connection
+from discover import etcd3_leases
+from discover.etcd3_leases import LeasedKeys, Etcd3Connection
+from discover.yoda_register.__main__ import do_register, refresh_node, \
+    remove_node, renew_upstream
+from tests.unit.test_yoda_register import create_mock_args
+
+
+def test_put_writes_changed_values_only():
+    # Given: Leased keys
+    conn = FakeEtcd3Connection()
+    leased = LeasedKeys(conn, ttl=10)
+
+    # When: I put the same value twice and then a new value
+    eq_(leased.put('/yoda/key', 'value1'), True)
+    eq_(leased.put('/yoda/key', 'value1'), False)
+    eq_(leased.put('/yoda/key', 'value2'), True)
+
+    # Then: Only changed values are written using a single lease
+    eq_(conn.operations, {'grant': 1, 'put': 2})
+    eq_(conn.values(), {'/yoda/key': 'value2'})
+
+
+def test_keepalive_regrants_lost_lease():
+    # Given: Leased keys whose lease expired (e.g. process was paused)
+    conn = FakeEtcd3Connection()
+    leased = LeasedKeys(conn, ttl=10)
+    leased.put('/yoda/key1', 'value1')
+    leased.put('/yoda/key2', 'value2')
+    conn.revoke(leased.lease_id)
+    eq_(conn.values(), {})
+
+    # When: I run a single keepalive
+    leased._stop.set()
+    leased.keepalive()
+
+    # Then: New lease is granted and all the keys are re-written
+    eq_(leased.lease_id, 2)
+    eq_(conn.values(), {'/yoda/key1': 'value1', '/yoda/key2': 'value2'})
+
+
+def test_keepalive_keeps_keys_alive():
+    # Given: Started leased keys with a short TTL
+    conn = FakeEtcd3Connection()
+    leased = LeasedKeys(conn, ttl=1).start()
+    leased.put('/yoda/key', 'value')
+
+    try:
+        # When: TTL is elapsed
+        time.sleep(1.5)
+
+        # Then: Key is kept alive over a single keepalive stream
+        eq_(conn.values(), {'/yoda/key': 'value'})
+        eq_(conn.operations['grant'], 1)
+        eq_(conn.operations['put'], 1)
+    finally:
+        leased.close()
+
+
+def test_close_revokes_lease():
+    # Given: Leased keys
+    conn = FakeEtcd3Connection()
+    leased = LeasedKeys(conn, ttl=10)
+    leased.put('/yoda/key1', 'value1')
+    leased.put('/yoda/key2', 'value2')
+
+    # When: I close the leased keys
+    leased.close()
+
+    # Then: All keys are removed at once
+    eq_(conn.values(), {})
+    eq_(conn.operations['revoke'], 1)
+    eq_(leased.keys, {})
+
+
+def _with_leased_keys(test):
+    def wrapper():
+        conn = FakeEtcd3Connection()
+        leased = LeasedKeys(conn, ttl=10)
+        with patch('discover.yoda_register.__main__.leased_keys',
+                   return_value=leased):
+            test(conn, leased)
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+@_with_leased_keys
+def test_register_with_etcd3(conn, leased):
+    # Given: Arguments for etcd v3 api
+    args = create_mock_args(etcd_api='v3', node_num='1')
+
+    # When: I register the node
+    do_register(args, 'mock-app', 'v1', '8080', '49153', 'red-green', 60,
+                node_num='1')
+
+    # Then: Endpoint and meta are attached to the lease
+    eq_(conn.values(), {
+        '/yoda/upstreams/mock-app-8080/endpoints/mock-discover':
+            'mockproxy:49153',
+        '/yoda/upstreams/mock-app-8080/meta/mock-discover':
+            '{"node-num": "1"}'
+    })
+
+    # And: Node is refreshed without writes
+    eq_(refresh_node(args, 'mock-app-8080', 60), True)
+    eq_(conn.operations['put'], 2)
+
+    # When: I remove the node
+    remove_node(args, 'mock-app-8080')
+
+    # Then: Endpoint and meta are removed
+    eq_(conn.values(), {})
+    eq_(refresh_node(args, 'mock-app-8080', 60), False)
+
+
+@_with_leased_keys
+def test_draining_with_etcd3_uses_own_lease(conn, leased):
+    # Given: Node registered using etcd v3 api
+    args = create_mock_args(etcd_api='v3')
+    do_register(args, 'mock-app', 'v1', '8080', '49153', 'red-green', 60)
+
+    # When: I mark the node as draining
+    do_register(args, 'mock-app', 'v1', '8080', '49153', 'red-green', 5,
+                draining=True)
+
+    # Then: Endpoint and meta are detached from the lease of the process
+    eq_(leased.keys, {})
+    eq_(conn.operations['grant'], 3)
+    endpoint_key = '/yoda/upstreams/mock-app-8080/endpoints/mock-discover'
+    meta_key = '/yoda/upstreams/mock-app-8080/meta/mock-discover'
+    drain_leases = {conn.keys[endpoint_key][1], conn.keys[meta_key][1]}
+    eq_(leased.lease_id in drain_leases, False)
+    eq_(conn.leases[conn.keys[endpoint_key][1]][1], 5)
+
+    # And: Draining keys are not re-written on the lease of the process
+    leased.regrant()
+    eq_(drain_leases, {conn.keys[endpoint_key][1], conn.keys[meta_key][1]})
+
+    # And: Draining keys are removed once the drain lease expires
+    for lease_id in drain_leases:
+        conn.revoke(lease_id)
+    eq_(conn.values(), {})
+
+
+@_with_leased_keys
+def test_renew_upstream_with_etcd3(conn, leased):
+    # When: I renew the upstream using etcd v3 api
+    renew_upstream(create_mock_args(etcd_api='v3'), 'mock-app', 'v1',
+                   '8080', 'red-green', ttl=3600)
+
+    # Then: Upstream gets its own lease
+    eq_(conn.values(), {'/yoda/upstreams/mock-app-8080': 'mock-app-8080'})
+    eq_(leased.lease_id, None)
+
+
+def test_leased_keys_with_local_etcd():
+    # Runs only against a locally started etcd (e.g. ETCD3_TEST_HOST=
+    # 127.0.0.1 with `etcd --listen-client-urls http://127.0.0.1:2379`)
+    host = os.environ.get('ETCD3_TEST_HOST')
+    if not host or etcd3_leases.import_etcd3() is None:
+        raise SkipTest('ETCD3_TEST_HOST is not set or etcd3 is missing')
+    conn = Etcd3Connection(host, os.environ.get('ETCD3_TEST_PORT', 2379))
+    leased = LeasedKeys(conn, ttl=2).start()
+    try:
+        # When: I put a key and wait for longer than the TTL
+        leased.put('/yoda-test/key', 'value')
+        time.sleep(3)
+
+        # Then: Key is kept alive
+        value, _meta = conn.client.get('/yoda-test/key')
+        eq_(value, b'value')
+    finally:
+        leased.close()
+
+    # And: Key is removed once the lease is revoked
+    value, _meta = conn.client.get('/yoda-test/key')
+    eq_(value, None)
@@ -0,0 +1,175 @@
+import time
+from mock import patch
+from nose.tools import eq_
+from discover.health import HealthCheckEngine, HealthState, \
+    LatencyEstimate, check_deadline, split_thresholds
+
+
+def test_check_deadline():
+
+    # When: I get deadline for health check with timeout
+    deadline = check_deadline({'timeout': '5s'})
+
+    # Then: Timeout (plus grace period) is returned in seconds
+    eq_(deadline, 6)
+
+
+@patch('discover.health.health_test')
+def test_engine_runs_all_checks(m_health_test):
+    # Given: Health test that fails for port 8081
+    m_health_test.side_effect = lambda port, host, **kwargs: port != 8081
+
+    # When: I run checks for multiple ports
+    results = dict(HealthCheckEngine(max_concurrent=2).run([
+        ('a', 8080, 'mockhost', {}),
+        ('b', 8081, 'mockhost', {'uri': '/health'}),
+        ('c', 8082, 'mockhost', {'protocol': 'udp'}),
+    ]))
+
+    # Then: Results are returned for all checks
+    eq_(results, {'a': True, 'b': False, 'c': True})
+    m_health_test.assert_any_call(8081, 'mockhost', uri='/health')
+
+
+@patch('discover.health.health_test')
+def test_engine_runs_checks_concurrently(m_health_test):
+    # Given: Health test that is slow for port 8080
+    def slow_test(port, host, **kwargs):
+        time.sleep(0.5 if port == 8080 else 0)
+        return True
+    m_health_test.side_effect = slow_test
+
+    # When: I run checks for multiple ports
+    results = list(HealthCheckEngine().run([
+        ('slow', 8080, 'mockhost', {}),
+        ('fast', 8081, 'mockhost', {}),
+    ]))
+
+    # Then: Results are yielded as checks finish
+    eq_(results, [('fast', True), ('slow', True)])
+
+
+@patch('discover.health.health_test')
+def test_engine_fails_checks_beyond_deadline(m_health_test):
+    # Given: Health test that hangs
+    m_health_test.side_effect = lambda port, host, **kwargs: time.sleep(2)
+
+    # When: I run check with short timeout
+    with patch('discover.health.DEADLINE_GRACE_SECONDS', 0):
+        results = list(HealthCheckEngine().run([
+            ('hung', 8080, 'mockhost', {'timeout': '100ms'}),
+        ]))
+
+    # Then: Check is reported as failed
+    eq_(results, [('hung', False)])
+
+
+@patch('discover.health.health_test')
+def test_engine_runs_timed_checks(m_health_test):
+    # Given: Health test that fails for port 8081
+    m_health_test.side_effect = lambda port, host, **kwargs: port != 8081
+
+    # When: I run timed checks
+    results = {check_id: (healthy, latency) for check_id, healthy, latency
+               in HealthCheckEngine().run_timed([
+                   ('a', 8080, 'mockhost', {}),
+                   ('b', 8081, 'mockhost', {})])}
+
+    # Then: Latency is returned with the outcome of every check
+    eq_(results['a'][0], True)
+    eq_(results['b'][0], False)
+    eq_(results['a'][1] >= 0, True)
+
+
+def test_engine_with_no_checks():
+
+    # When: I run no checks
+    results = list(HealthCheckEngine().run([]))
+
+    # Then: No results are returned
+    eq_(results, [])
+
+
+def test_split_thresholds():
+
+    # When: I split thresholds from health check configuration
+    health_check, rise, fall = split_thresholds(
+        {'uri': '/health', 'rise': '2', 'fall': 4})
+
+    # Then: Thresholds are removed from the health check
+    eq_(health_check, {'uri': '/health'})
+    eq_((rise, fall), (2, 4))
+
+
+def test_health_state_rise_and_fall():
+    # Given: Health state with rise of 2 and fall of 3
+    health = HealthState(rise=2, fall=3)
+
+    # When: Checks pass twice
+    changes = [health.record(True), health.record(True)]
+
+    # Then: State goes up only after the second passed check
+    eq_(changes, [False, True])
+    eq_(health.up, True)
+
+    # When: Checks fail twice, pass once and then fail thrice
+    changes = [health.record(passed) for passed in
+               (False, False, True, False, False, False)]
+
+    # Then: State goes down only after three consecutive failures
+    eq_(changes, [False, False, False, False, False, True])
+    eq_(health.up, False)
+
+
+def test_latency_estimate_is_smoothed():
+    # Given: Latency estimate
+    estimate = LatencyEstimate(smoothing=0.5)
+
+    # When: I record latencies
+    estimate.update(0.010)
+    value = estimate.update(0.030)
+
+    # Then: Smoothed latency is returned
+    eq_(round(value, 6), 0.02)
+
+
+def test_latency_estimate_publishes_past_threshold():
+    # Given: Published latency estimate
+    estimate = LatencyEstimate(smoothing=1)
+    estimate.update(0.100)
+    eq_(estimate.publish(threshold=0.25), 100.0)
+
+    # When: Latency moves within the threshold
+    estimate.update(0.120)
+
+    # Then: Published latency does not change
+    eq_(estimate.publish(threshold=0.25), 100.0)
+
+    # When: Latency moves past the threshold
+    estimate.update(0.130)
+
+    # Then: New latency is published
+    eq_(estimate.publish(threshold=0.25), 130.0)
+
+
+@patch('discover.health.health_test')
+def test_engine_deadline_starts_when_check_runs(m_health_test):
+    # Given: Health test that hangs for port 8080 and takes 0.6s otherwise
+    def slow_test(port, host, **kwargs):
+        time.sleep(3 if port == 8080 else 0.6)
+        return True
+    m_health_test.side_effect = slow_test
+
+    # When: I run the hung check alongside fast checks queued behind each
+    # other (beyond the concurrency cap)
+    with patch('discover.health.DEADLINE_GRACE_SECONDS', 0):
+        results = list(HealthCheckEngine(max_concurrent=2).run([
+            ('hung', 8080, 'mockhost', {'timeout': '800ms'}),
+            ('fast1', 8081, 'mockhost', {'timeout': '800ms'}),
+            ('fast2', 8082, 'mockhost', {'timeout': '800ms'}),
+            ('fast3', 8083, 'mockhost', {'timeout': '800ms'}),
+        ]))
+
+    # Then: Only the hung check fails (as soon as its own deadline is over)
+    eq_(results, [('fast1', True), ('hung', False), ('fast2', True),
+                  ('fast3', True)])
@@ -0,0 +1,92 @@
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from mock import patch
+from nose.tools import eq_, raises
+from discover.http_pool import HttpConnectionPool, DnsCache, PoolExhausted
+
+
+class MockHealthHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_GET(self):
+        MockHealthHandler.connections.add(self.client_address)
+        body = b'OK'
+        if self.path.startswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', self.path[len('/redirect'):])
+        else:
+            self.send_response(200 if self.path == '/health' else 500)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_mock_server():
+    server = HTTPServer(('127.0.0.1', 0), MockHealthHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def test_pool_reuses_connections():
+    # Given: Running http server
+    server = start_mock_server()
+    MockHealthHandler.connections.clear()
+    pool = HttpConnectionPool(max_connections=2)
+
+    # When: I perform multiple health requests
+    statuses = [pool.get_status('127.0.0.1', server.server_port, path, 2)
+                for path in ('/health', '/health', '/fail')]
+
+    # Then: Statuses are returned using a single keep-alive connection
+    eq_(statuses, [200, 200, 500])
+    eq_(len(MockHealthHandler.connections), 1)
+    pool.close()
+    server.shutdown()
+
+
+def test_pool_follows_one_redirect():
+    # Given: Running http server
+    server = start_mock_server()
+    pool = HttpConnectionPool(max_connections=2)
+
+    # When: I perform health requests that get redirected
+    statuses = [pool.get_status('127.0.0.1', server.server_port, path, 2)
+                for path in ('/redirect/health', '/redirect/fail',
+                             '/redirect/redirect/health')]
+
+    # Then: Status after a single redirect is returned
+    eq_(statuses, [200, 500, 302])
+    pool.close()
+    server.shutdown()
+
+
+@raises(PoolExhausted)
+def test_pool_caps_open_connections():
+    # Given: Pool with all connection slots in use
+    pool = HttpConnectionPool(max_connections=1)
+    pool._slots.acquire()
+
+    # When: I acquire a new connection
+    pool._acquire(('mockhost', 8080), '127.0.0.1', 0.1)
+
+    # Then: PoolExhausted is raised
+
+
+@patch('discover.http_pool.socket.getaddrinfo')
+def test_dns_cache_resolves_once_within_ttl(m_getaddrinfo):
+    # Given: Resolvable host
+    m_getaddrinfo.return_value = [(None, None, None, '', ('10.0.0.1', 80))]
+    dns_cache = DnsCache(ttl=60)
+
+    # When: I resolve the host twice
+    addresses = [dns_cache.resolve('mockhost', 80) for _ in range(2)]
+
+    # Then: Host is resolved only once
+    eq_(addresses, ['10.0.0.1', '10.0.0.1'])
+    eq_(m_getaddrinfo.call_count, 1)
@@ -0,0 +1,172 @@
+import json
+import logging
+import queue
+import sys
+from mock import MagicMock
+from nose.tools import eq_, ok_
+from discover.logs import FailureLog, JsonFormatter, DeferredQueueHandler, \
+    start_async_logging
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_failure_log(summary_interval=60):
+    clock = FakeClock()
+    return FailureLog(summary_interval, log=MagicMock(), clock=clock), clock
+
+
+def test_first_failure_is_logged_with_detail():
+    # Given: Failure log
+    failure_log, _ = create_failure_log()
+
+    # When: Target fails
+    failure_log.failed('host:8080', 'Port test failed for %s', 'host:8080',
+                       exc_info=True)
+
+    # Then: Failure is logged with traceback
+    failure_log.log.log.assert_called_once_with(
+        logging.WARN, 'Port test failed for %s', 'host:8080', exc_info=True,
+        extra={'check_target': 'host:8080'})
+
+
+def test_repeated_failures_are_summarized():
+    # Given: Failing target
+    failure_log, clock = create_failure_log()
+    failure_log.failed('host:8080', 'Port test failed for %s', 'host:8080')
+
+    # When: Target keeps failing within and after the summary interval
+    clock.now += 10
+    failure_log.failed('host:8080', 'Port test failed for %s', 'host:8080')
+    clock.now += 10
+    failure_log.failed('host:8080', 'Port test failed for %s', 'host:8080')
+    clock.now += 50
+    failure_log.failed('host:8080', 'Port test failed for %s', 'host:8080')
+
+    # Then: Repeats are logged once as summary with count
+    eq_(failure_log.log.log.call_count, 2)
+    eq_(failure_log.log.log.call_args[0][1:],
+        ('Port test failed for %s (repeated %d time(s) in the last %ds)',
+         'host:8080', 3, 70))
+    eq_(failure_log.log.log.call_args[1]['extra']['repeated'], 3)
+
+
+def test_changed_failure_is_logged_with_detail():
+    # Given: Failing target
+    failure_log, _ = create_failure_log()
+    failure_log.failed('host:8080', 'Port test failed for %s', 'host:8080')
+
+    # When: Target fails differently
+    failure_log.failed('host:8080', 'Status %d', 503)
+
+    # Then: New failure is logged
+    eq_(failure_log.log.log.call_count, 2)
+    eq_(failure_log.log.log.call_args[0][1:], ('Status %d', 503))
+
+
+def test_summaries_disabled():
+    # Given: Failure log without summaries
+    failure_log, _ = create_failure_log(summary_interval=0)
+
+    # When: Target fails repeatedly
+    for _ in range(3):
+        failure_log.failed('host:8080', 'Port test failed')
+
+    # Then: Every failure is logged
+    eq_(failure_log.log.log.call_count, 3)
+
+
+def test_recovery_is_logged():
+    # Given: Failing target
+    failure_log, clock = create_failure_log()
+    failure_log.failed('host:8080', 'Port test failed')
+    failure_log.failed('host:8080', 'Port test failed')
+    clock.now += 30
+
+    # When: Target passes (twice)
+    failure_log.passed('host:8080')
+    failure_log.passed('host:8080')
+
+    # Then: Recovery is logged once
+    failure_log.log.info.assert_called_once_with(
+        '%s recovered after %d failed check(s) in %ds', 'host:8080', 2, 30,
+        extra={'check_target': 'host:8080'})
+
+    # And: Next failure is logged with detail
+    failure_log.failed('host:8080', 'Port test failed')
+    eq_(failure_log.log.log.call_count, 2)
+
+
+def test_json_formatter():
+    # Given: Record with failure target
+    record = logging.LogRecord('yoda-discover', logging.WARN, __file__, 1,
+                               'Port test failed for %s', ('host:8080',),
+                               None)
+    record.check_target = 'host:8080'
+
+    # When: I format the record
+    formatted = json.loads(JsonFormatter().format(record))
+
+    # Then: Record is formatted as json
+    eq_(formatted['message'], 'Port test failed for host:8080')
+    eq_(formatted['level'], 'WARNING')
+    eq_(formatted['check_target'], 'host:8080')
+
+
+def test_deferred_queue_handler_keeps_exception_for_listener():
+    # Given: Queue handler
+    records = queue.Queue(1)
+    handler = DeferredQueueHandler(records)
+
+    # When: I log an exception
+    try:
+        raise ValueError('failed')
+    except ValueError:
+        record = logging.LogRecord('yoda-discover', logging.ERROR, __file__,
+                                   1, 'Failed %s', ('check',), True)
+        record.exc_info = sys.exc_info()
+        handler.emit(record)
+
+    # Then: Message is merged and traceback is left to the listener
+    queued = records.get_nowait()
+    eq_(queued.msg, 'Failed check')
+    eq_(queued.args, None)
+    eq_(queued.exc_info[0], ValueError)
+
+
+def test_deferred_queue_handler_drops_when_full():
+    # Given: Full queue
+    records = queue.Queue(1)
+    handler = DeferredQueueHandler(records)
+    records.put_nowait('queued')
+
+    # When: I log a record
+    handler.emit(logging.LogRecord('yoda-discover', logging.INFO, __file__, 1,
+                                   'Dropped', None, None))
+
+    # Then: Record is dropped without blocking
+    eq_(records.qsize(), 1)
+
+
+def test_async_logging_writes_from_listener():
+    # Given: Logger with a handler moved behind a queue
+    log = logging.getLogger('yoda-discover.test-async')
+    log.propagate = False
+    handler = MagicMock(level=logging.NOTSET)
+    log.addHandler(handler)
+    listener = start_async_logging(log)
+
+    # When: I log a record
+    log.warning('Written %s', 'async')
+    listener.stop()
+
+    # Then: Record is handled by the original handler
+    ok_(handler.handle.called)
+    eq_(handler.handle.call_args[0][0].getMessage(), 'Written async')
+    eq_(log.handlers[0].__class__, DeferredQueueHandler)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from nose.tools import eq_, raises
+from discover.metrics import MetricsRegistry, write_metrics
+
+
+def test_counter_render():
+    # Given: Counter incremented for two label sets
+    registry = MetricsRegistry()
+    counter = registry.counter('endpoints_total', 'Number of endpoints')
+    counter.inc(app='mock-app', outcome='registered')
+    counter.inc(2, app='mock-app', outcome='failed')
+
+    # When: I render the metrics
+    text = registry.render()
+
+    # Then: Counter is rendered in prometheus text format
+    eq_(text, '# HELP discover_endpoints_total Number of endpoints\n'
+              '# TYPE discover_endpoints_total counter\n'
+              'discover_endpoints_total{app="mock-app",outcome="failed"} '
+              '2.0\n'
+              'discover_endpoints_total{app="mock-app",outcome="registered"}'
+              ' 1.0\n')
+
+
+def test_histogram_buckets():
+    # Given: Histogram with 2 buckets
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency_seconds', buckets=(0.1, 1))
+
+    # When: I observe values in each bucket
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    # Then: Cumulative bucket counts, sum and count are recorded
+    lines = registry.render().splitlines()[2:]
+    eq_(lines, ['discover_latency_seconds_bucket{le="0.1"} 1.0',
+                'discover_latency_seconds_bucket{le="1.0"} 2.0',
+                'discover_latency_seconds_bucket{le="+Inf"} 3.0',
+                'discover_latency_seconds_sum 5.55',
+                'discover_latency_seconds_count 3.0'])
+
+
+def test_gauge_function_and_label_escaping():
+    # Given: Gauge evaluated on exposition
+    registry = MetricsRegistry()
+    registry.gauge('wait_seconds').set_function(lambda: 1.5,
+                                                node='mock"node')
+
+    # When: I render the metrics
+    lines = registry.render().splitlines()
+
+    # Then: Function value is exported with escaped labels
+    eq_(lines[-1], 'discover_wait_seconds{node="mock\\"node"} 1.5')
+
+
+@raises(ValueError)
+def test_timed_records_error_outcome():
+    # Given: Metrics registry
+    registry = MetricsRegistry()
+
+    # When: The timed block fails
+    try:
+        with registry.timed('do_register', app='mock-app'):
+            raise ValueError('mock')
+    finally:
+        # Then: Error outcome is recorded
+        eq_(registry.counter('operations_total').values,
+            {(('app', 'mock-app'), ('operation', 'do_register'),
+              ('outcome', 'error')): 1})
+
+
+def test_write_metrics():
+    # Given: Path for the metrics file
+    path = os.path.join(tempfile.mkdtemp(), 'metrics.prom')
+
+    # When: I write the metrics
+    write_metrics(path)
+
+    # Then: Metrics file is created
+    eq_(os.path.exists(path), True)
+    eq_(os.path.exists(path + '.tmp'), False)
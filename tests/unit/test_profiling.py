@@ -0,0 +1,40 @@
+import os
+import tempfile
+import time
+from nose.tools import eq_
+from discover.profiling import ProfileToggle, MODE_SAMPLING, MODE_CPROFILE
+
+
+def test_toggle_cprofile():
+    # Given: Profile toggle
+    toggle = ProfileToggle(profile_dir=tempfile.mkdtemp(),
+                           mode=MODE_CPROFILE)
+
+    # When: I toggle the profiler on
+    toggle()
+
+    # Then: Profiler is running
+    eq_(toggle.profiler is not None, True)
+
+    # When: I toggle the profiler off
+    path = toggle.stop()
+
+    # Then: Profile is dumped
+    eq_(path.endswith('.prof'), True)
+    eq_(os.path.exists(path), True)
+
+
+def test_toggle_sampling_profiler():
+    # Given: Running sampling profiler
+    toggle = ProfileToggle(profile_dir=tempfile.mkdtemp(),
+                           mode=MODE_SAMPLING)
+    toggle.start()
+    time.sleep(0.1)
+
+    # When: I stop the profiler
+    path = toggle.stop()
+
+    # Then: Collapsed stacks for the sampled threads are dumped
+    with open(path) as profile_file:
+        lines = profile_file.read().splitlines()
+    eq_(any(line.startswith('MainThread;') for line in lines), True)
@@ -0,0 +1,70 @@
+from mock import patch, MagicMock
+from nose.tools import eq_, raises
+from discover.ratelimit import RateLimiter
+
+
+@patch('discover.ratelimit.time')
+def test_acquire_within_burst(m_time):
+    # Given: Rate limiter with burst of 2
+    m_time.time.return_value = 100
+    limiter = RateLimiter(1, burst=2)
+
+    # When: I acquire 2 tokens
+    waits = [limiter.acquire(), limiter.acquire()]
+
+    # Then: Tokens are acquired without waiting
+    eq_(waits, [0, 0])
+    eq_(m_time.sleep.called, False)
+
+
+@patch('discover.ratelimit.time')
+def test_acquire_waits_for_token(m_time):
+    # Given: Rate limiter with no tokens left
+    m_time.time.return_value = 100
+    limiter = RateLimiter(2, burst=1)
+    limiter.acquire()
+
+    # And: Clock advancing while sleeping
+    m_time.sleep.side_effect = lambda delay: setattr(
+        m_time.time, 'return_value', m_time.time.return_value + delay)
+
+    # When: I acquire another token
+    waited = limiter.acquire()
+
+    # Then: Limiter waits as per the rate
+    eq_(waited, 0.5)
+    eq_(limiter.wait_seconds, 0.5)
+
+
+@patch('discover.ratelimit.time')
+def test_call_retries_throttled_calls(m_time):
+    # Given: Rate limiter with throttling detection
+    m_time.time.return_value = 100
+    limiter = RateLimiter(4, burst=10,
+                          is_throttled=lambda error: str(error) == 'slow')
+
+    # And: Function throttled once
+    func = MagicMock(side_effect=[Exception('slow'), 'success'])
+
+    # When: I call the function
+    result = limiter.call(func, 'mockarg')
+
+    # Then: Function is retried after backing off
+    eq_(result, 'success')
+    eq_(func.call_count, 2)
+    eq_(limiter.throttled_count, 1)
+    eq_(m_time.sleep.call_count, 1)
+
+    # And: Rate recovers partially after success
+    eq_(limiter.rate, 2.4)
+
+
+@raises(ValueError)
+def test_call_does_not_retry_other_errors():
+    # Given: Rate limiter
+    limiter = RateLimiter(10)
+
+    # When: I call function raising non throttling error
+    limiter.call(MagicMock(side_effect=ValueError('mock')))
+
+    # Then: Error is raised
@@ -0,0 +1,88 @@
+from mock import patch
+from nose.tools import eq_
+from discover.scheduler import AdaptiveSchedule, max_interval_for_ttl
+
+
+def test_max_interval_for_ttl():
+
+    # When: I get max interval for default register ttl
+    max_interval = max_interval_for_ttl(190)
+
+    # Then: Interval leaving two polls within ttl is returned
+    eq_(max_interval, 90)
+
+
+@patch('discover.scheduler.time')
+def test_schedule_is_anchored_to_previous_run(m_time):
+    # Given: Schedule without jitter
+    m_time.time.return_value = 100
+    schedule = AdaptiveSchedule(10, jitter=0)
+    schedule.first_run()
+
+    # When: I get next run after a slow run
+    m_time.time.return_value = 103
+    next_run = schedule.next_run(True)
+
+    # Then: Next run does not drift by the duration of the run
+    eq_(next_run, 110)
+
+
+@patch('discover.scheduler.time')
+def test_schedule_adapts_interval(m_time):
+    # Given: Schedule for new target
+    m_time.time.return_value = 0
+    schedule = AdaptiveSchedule(10, min_interval=5, max_interval=20,
+                                jitter=0, stable_runs=2)
+    schedule.first_run()
+
+    # When: Target stays healthy
+    intervals = []
+    for _ in range(6):
+        previous = schedule.scheduled_at
+        intervals.append(schedule.next_run(True) - previous)
+
+    # Then: Interval starts short and grows while stable
+    eq_(intervals, [5, 10, 10, 15, 15, 20])
+
+    # When: Target fails
+    previous = schedule.scheduled_at
+    interval = schedule.next_run(False) - previous
+
+    # Then: Interval is shortened right away
+    eq_(interval, 5)
+
+
+@patch('discover.scheduler.time')
+def test_schedule_interval_is_capped_by_ttl(m_time):
+    # Given: Schedule with poll interval longer than allowed by the ttl
+    m_time.time.return_value = 0
+    schedule = AdaptiveSchedule(45, min_interval=5,
+                                max_interval=max_interval_for_ttl(60),
+                                jitter=0, stable_runs=1)
+    schedule.first_run()
+
+    # When: Target stays healthy
+    intervals = []
+    for _ in range(3):
+        previous = schedule.scheduled_at
+        intervals.append(schedule.next_run(True) - previous)
+
+    # Then: Interval never exceeds the ttl cap
+    eq_(intervals, [25, 25, 25])
+
+
+@patch('discover.scheduler.random.uniform')
+@patch('discover.scheduler.time')
+def test_schedule_jitter_only_shortens_interval(m_time, m_uniform):
+    # Given: Schedule with jitter
+    m_time.time.return_value = 0
+    m_uniform.side_effect = lambda low, high: high
+    schedule = AdaptiveSchedule(10, jitter=0.2)
+
+    # When: I get the first and next runs
+    first_run = schedule.first_run()
+    next_run = schedule.next_run(True)
+
+    # Then: Runs are spread without exceeding the interval
+    eq_(first_run, 2)
+    eq_(next_run, 10)
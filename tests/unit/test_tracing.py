@@ -0,0 +1,61 @@
+import json
+from mock import patch
+from nose.tools import eq_
+from discover import tracing
+from discover.tracing import trace, span, traced, init_tracing
+
+
+def test_trace_when_disabled():
+    # Given: Tracing is disabled
+    init_tracing(False)
+
+    # When: I start a trace and a span
+    iteration = trace('mock_poll')
+    phase = span('health_check')
+
+    # Then: Shared no-op objects are returned
+    eq_(iteration is phase, True)
+    items = [1, 2]
+    eq_(traced(items, 'health_check') is items, True)
+
+
+@patch('discover.tracing.trace_logger')
+def test_trace_emits_spans(m_trace_logger):
+    # Given: Tracing is enabled
+    init_tracing(True)
+
+    try:
+        # When: I trace an iteration with spans
+        with trace('mock_poll', node='mock-node'):
+            with span('inspect'):
+                pass
+            eq_(list(traced([1, 2], 'health_check')), [1, 2])
+    finally:
+        init_tracing(False)
+
+    # Then: Single structured log line is emitted
+    eq_(m_trace_logger.info.call_count, 1)
+    logged = json.loads(m_trace_logger.info.call_args[0][0])
+    eq_(logged['trace'], 'mock_poll')
+    eq_(logged['node'], 'mock-node')
+    eq_(sorted(logged['phases_ms']), ['health_check', 'inspect'])
+    eq_(len(logged['spans']), 4)
+
+    # And: Current trace is cleared
+    eq_(tracing._local.trace, None)
+
+
+@patch('discover.tracing.trace_logger')
+def test_trace_below_threshold(m_trace_logger):
+    # Given: Tracing is enabled with threshold
+    init_tracing(True, threshold_ms=60000)
+
+    try:
+        # When: I trace a fast iteration
+        with trace('mock_poll'):
+            pass
+    finally:
+        init_tracing(False)
+
+    # Then: Trace is not emitted
+    eq_(m_trace_logger.info.called, False)
@@ -1,5 +1,5 @@
 import discover.util
-from mock import patch
+from mock import patch, MagicMock
 from nose.tools import eq_
 from discover.util import convert_to_milliseconds, DEFAULT_TIMEOUT_MS
 
@@ -49,19 +49,24 @@ def test_convert_to_milliseconds_for_invalid_timeout():
     eq_(timeout_ms, DEFAULT_TIMEOUT_MS)
 
 
-@patch('discover.util.urlopen')
-def test_health_when_uri_is_specified(murlopen):
+@patch('discover.util.get_http_pool')
+def test_health_when_uri_is_specified(mget_pool):
+    # Given: Healthy http endpoint
+    mget_pool().get_status.return_value = 200
 
     # When: I perform health test with given uri
     healthy = discover.util.health_test('8080', 'mockhost', uri='/test')
 
     # Then: http health test is performed
     eq_(healthy, True)
-    murlopen.assert_called_once_with('http://mockhost:8080/test', None, 2)
+    mget_pool().get_status.assert_called_once_with('mockhost', '8080',
+                                                   '/test', 2)
 
 
-@patch('discover.util.urlopen')
-def test_health_when_uri_and_timeout_is_specified(murlopen):
+@patch('discover.util.get_http_pool')
+def test_health_when_uri_and_timeout_is_specified(mget_pool):
+    # Given: Healthy http endpoint
+    mget_pool().get_status.return_value = 200
 
     # When: I perform health test with given uri
     healthy = discover.util.health_test(8080, 'mockhost', uri='/test',
@@ -69,7 +74,8 @@ def test_health_when_uri_and_timeout_is_specified(murlopen):
 
     # Then: http health test is performed
     eq_(healthy, True)
-    murlopen.assert_called_once_with('http://mockhost:8080/test', None, 60)
+    mget_pool().get_status.assert_called_once_with('mockhost', 8080,
+                                                   '/test', 60)
 
 
 @patch('discover.util.socket')
@@ -82,17 +88,42 @@ def test_health_when_uri_is_not_specified(msocket):
     eq_(healthy, True)
 
 
-@patch('discover.util.urlopen')
-def test_http_when_urlopen_fails(murlopen):
+@patch('discover.util.get_http_pool')
+def test_http_when_request_fails(mget_pool):
     # Given: An invalid uri
-    murlopen.side_effect = Exception('Invalid uri')
+    mget_pool().get_status.side_effect = Exception('Invalid uri')
 
     # When: I perform http_test with given uri
     healthy = discover.util.http_test(8080, 'mockhost')
 
     # Then: http test returns false
     eq_(healthy, False)
-    murlopen.assert_called_once_with('http://mockhost:8080/health', None, 2)
+    mget_pool().get_status.assert_called_once_with('mockhost', 8080,
+                                                   '/health', 2)
+
+
+@patch('discover.util.get_http_pool')
+def test_http_when_status_is_error(mget_pool):
+    # Given: Endpoint returning server error
+    mget_pool().get_status.return_value = 503
+
+    # When: I perform http_test
+    healthy = discover.util.http_test(8080, 'mockhost')
+
+    # Then: http test returns false
+    eq_(healthy, False)
+
+
+@patch('discover.util.get_http_pool')
+def test_http_when_status_is_redirect(mget_pool):
+    # Given: Endpoint redirecting beyond the followed redirects
+    mget_pool().get_status.return_value = 302
+
+    # When: I perform http_test
+    healthy = discover.util.http_test(8080, 'mockhost')
+
+    # Then: http test returns false
+    eq_(healthy, False)
 
 
 @patch('discover.util.socket')
@@ -120,6 +151,38 @@ def test_map_proxy_host_using_ec2_metadata(mock_get):
     mock_get().__getitem__.assert_called_once_with('mock')
 
 
+@patch('discover.util.get_instance_metadata')
+def test_remap_proxy_host(mock_get):
+    # Given: Ec2 metadata with a changed host
+    mock_get().__getitem__.return_value = 'newhost'
+    on_change = MagicMock()
+
+    # When: I remap the proxy host
+    host = discover.util.remap_proxy_host('ec2:meta-data:mock', 'oldhost',
+                                          on_change)
+
+    # Then: Change is notified
+    eq_(host, 'newhost')
+    on_change.assert_called_once_with('newhost')
+
+    # When: I remap the proxy host again
+    on_change.reset_mock()
+    discover.util.remap_proxy_host('ec2:meta-data:mock', 'newhost',
+                                   on_change)
+
+    # Then: No change is notified
+    eq_(on_change.called, False)
+
+
+def test_start_proxy_host_refresh_for_actualhost():
+    # When: I start refresh for an actual host
+    thread = discover.util.start_proxy_host_refresh(
+        'testhost', 'testhost', MagicMock(), 60)
+
+    # Then: Nothing is started
+    eq_(thread, None)
+
+
 @patch('discover.util.get_instance_metadata')
 def test_map_proxy_host_using_actualhost(mock_get):
 
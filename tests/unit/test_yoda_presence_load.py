@@ -0,0 +1,80 @@
+import os
+import tempfile
+from mock import patch
+from nose.tools import eq_
+from discover.yoda_presence.load import count_connections, parse_stats, \
+    sample_load
+
+TCP_TABLE = '''\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt
+   0: 00000000:0050 00000000:0000 0A 00000000:00000000 00:00000000 00000000
+   1: 0100007F:0050 0100007F:A1B2 01 00000000:00000000 00:00000000 00000000
+   2: 0100007F:0050 0100007F:A1B3 01 00000000:00000000 00:00000000 00000000
+   3: 0100007F:0050 0100007F:A1B4 06 00000000:00000000 00:00000000 00000000
+   4: 0100007F:01BB 0100007F:A1B5 01 00000000:00000000 00:00000000 00000000
+   5: 0100007F:A1B6 0100007F:0050 01 00000000:00000000 00:00000000 00000000
+'''
+
+
+def _write_tcp_table():
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as tcp_table:
+        tcp_table.write(TCP_TABLE)
+    return path
+
+
+def test_count_connections():
+    # Given: TCP table with established connections to ports 80 and 443
+    path = _write_tcp_table()
+
+    try:
+        # When: I count connections for port 80
+        connections = count_connections(['80'], proc_files=(path,))
+
+        # Then: Only established connections to local port 80 are counted
+        eq_(connections, 2)
+
+        # And: Connections for multiple ports can be counted
+        eq_(count_connections(['80', '443'], proc_files=(path,)), 3)
+    finally:
+        os.remove(path)
+
+
+def test_count_connections_ignores_missing_files():
+    # When: I count connections with a missing tcp table
+    connections = count_connections(['80'],
+                                    proc_files=('/non/existent/tcp',))
+
+    # Then: No connections are counted
+    eq_(connections, 0)
+
+
+def test_parse_stats():
+    # When: I parse stats responses
+    # Then: Active connections are returned
+    eq_(parse_stats('Active connections: 291 \nserver accepts handled\n'),
+        291.0)
+    eq_(parse_stats('{"connections": 12}'), 12.0)
+    eq_(parse_stats('7'), 7.0)
+    eq_(parse_stats('<html></html>'), None)
+
+
+@patch('discover.yoda_presence.load.fetch_stats_connections')
+def test_sample_load_uses_stats_url(m_fetch):
+    # Given: Stats url returning active connections
+    m_fetch.return_value = 10.0
+
+    # When: I sample load with stats url
+    load = sample_load(['80'], stats_url='http://localhost/nginx_status')
+
+    # Then: Load from the stats url is returned
+    eq_(load, 10.0)
+    m_fetch.assert_called_once_with('http://localhost/nginx_status')
+
+
+def test_sample_load_without_check_ports():
+    # When: I sample load without check ports and stats url
+    load = sample_load([])
+
+    # Then: No load is returned
+    eq_(load, None)
@@ -0,0 +1,426 @@
+import argparse
+import time
+from mock import MagicMock, patch
+from nose.tools import eq_
+from discover.yoda_register.__main__ import sync_registrations, \
+    ContainerRegistration, drain_registrations, update_proxy_host, \
+    refresh_node, docker_container_poll, register_all
+from discover.health import HealthCheckEngine
+from discover.yoda_register.containers import ContainerView
+from tests.unit.test_yoda_register_containers import create_container_info
+
+
+def create_mock_args(**kwargs):
+    args = argparse.Namespace(
+        docker_url='http://mockdocker:4243', etcd_host='mockhost',
+        etcd_port=4001, etcd_base='/yoda', proxy_host='mockproxy',
+        node_num=None, service_name=None, discover_name='mock-discover',
+        node_name='mock-node', all_containers=False, max_concurrent_checks=2,
+        drain_mode='remove', drain_seconds=0, etcd_api='v2', etcd3_port=2379,
+        lease_ttl=30, etcd_refresh='auto', publish_latency=False,
+        latency_smoothing=0.3, latency_threshold=0.25)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def test_sync_registrations():
+    # Given: Cache with discoverable, plain and stopped containers
+    cache = MagicMock()
+    cache.all.return_value = [
+        ContainerView(create_container_info(
+            container_id='app', name='/mock-app',
+            env=['DISCOVER_APP_NAME=mock-app', 'DISCOVER_NODE_NUM=2'])),
+        ContainerView(create_container_info(container_id='plain')),
+        ContainerView(create_container_info(
+            container_id='stopped', env=['DISCOVER_APP_NAME=mock-app'],
+            running=False)),
+    ]
+
+    # And: Existing registration for a container that no longer runs
+    stopped_registration = MagicMock()
+    registrations = {'stopped': stopped_registration}
+
+    # When: I sync registrations
+    sync_registrations(create_mock_args(), cache, registrations,
+                       HealthCheckEngine())
+
+    # Then: Only the running discoverable container is registered
+    eq_(list(registrations.keys()), ['app'])
+    registration = registrations['app']
+    eq_(registration.node_name, 'mock-app')
+    eq_(registration.parsed_args.discover_name, 'mock-app')
+    eq_(registration.parsed_args.node_num, '2')
+
+    # And: Registration for the stopped container is deregistered right away
+    stopped_registration.deregister.assert_called_once_with('remove', 0)
+
+
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_skips_ports_without_public_port(m_renew_upstream):
+    # Given: Registration for a container without public port
+    view = ContainerView(create_container_info(network_ports={}))
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+
+    # When: I register the container
+    registration.register(view)
+
+    # Then: Upstream is not renewed and next poll is scheduled
+    eq_(m_renew_upstream.called, False)
+    eq_(registration.next_poll > 0, True)
+
+
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_healthy_port(m_renew_upstream, m_health_test,
+                               m_do_register):
+    # Given: Registration for a container with public port
+    view = ContainerView(create_container_info())
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+
+    # And: Healthy container
+    m_health_test.return_value = True
+
+    # When: I register the container
+    registration.register(view)
+
+    # Then: Node gets registered using cached port mapping
+    m_health_test.assert_called_once_with(49153, 'mockproxy',
+                                          protocol='tcp')
+    eq_(m_do_register.call_args[0][4], '49153')
+
+
+@patch('discover.yoda_register.__main__.refresh_node')
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_refreshes_unchanged_endpoint(m_renew_upstream,
+                                               m_health_test, m_do_register,
+                                               m_refresh_node):
+    # Given: Registration for a healthy container
+    view = ContainerView(create_container_info())
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+    m_health_test.return_value = True
+    m_refresh_node.return_value = True
+
+    # When: I register the container twice
+    registration.register(view)
+    registration.register(view)
+
+    # Then: Endpoint and upstream are written only once
+    eq_(m_do_register.call_count, 1)
+    eq_(m_renew_upstream.call_count, 1)
+
+    # And: TTL of the endpoint is refreshed on second pass
+    eq_(m_refresh_node.call_count, 1)
+
+
+@patch('discover.yoda_register.__main__.refresh_node')
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.timed_health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_publishes_latency_past_threshold(
+        m_renew_upstream, m_timed_health_test, m_do_register,
+        m_refresh_node):
+    # Given: Registration publishing latency
+    view = ContainerView(create_container_info())
+    registration = ContainerRegistration(
+        create_mock_args(publish_latency=True), view, HealthCheckEngine())
+    m_refresh_node.return_value = True
+
+    # And: Health checks with a small and then a large latency change
+    m_timed_health_test.side_effect = [(True, 0.010), (True, 0.011),
+                                       (True, 0.050)]
+
+    # When: I register the container thrice
+    for _ in range(3):
+        registration.register(view)
+
+    # Then: Endpoint is re-written only once the latency moved past threshold
+    eq_(m_do_register.call_count, 2)
+    eq_(m_refresh_node.call_count, 1)
+    eq_(m_do_register.call_args_list[0][1]['latency_ms'], 10.0)
+    eq_(m_do_register.call_args_list[1][1]['latency_ms'], 22.2)
+
+
+@patch('discover.yoda_register.__main__.refresh_node')
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_republishes_expired_endpoint(
+        m_renew_upstream, m_health_test, m_do_register, m_refresh_node):
+    # Given: Registration for a healthy container
+    view = ContainerView(create_container_info())
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+    m_health_test.return_value = True
+
+    # And: Endpoint that expired in etcd
+    m_refresh_node.return_value = False
+
+    # When: I register the container twice
+    registration.register(view)
+    registration.register(view)
+
+    # Then: Endpoint is written again
+    eq_(m_do_register.call_count, 2)
+
+
+@patch('discover.yoda_register.__main__.etcd_client')
+def test_refresh_node_refreshes_endpoint_and_meta(m_etcd_client):
+    # Given: Etcd supporting TTL refresh
+    m_etcd_client.return_value.version = '2.3.7'
+
+    # When: I refresh the node published with meta
+    refreshed = refresh_node(create_mock_args(), 'mock-app-8080', 60,
+                             meta=True)
+
+    # Then: TTL of the endpoint and its meta is refreshed
+    eq_(refreshed, True)
+    m_refresh = m_etcd_client.return_value.refresh
+    eq_([call[0] for call in m_refresh.call_args_list],
+        [('/yoda/upstreams/mock-app-8080/endpoints/mock-discover', 60),
+         ('/yoda/upstreams/mock-app-8080/meta/mock-discover', 60)])
+
+
+@patch('discover.yoda_register.__main__.etcd_client')
+def test_refresh_node_falls_back_to_write_for_old_etcd(m_etcd_client):
+    # Given: Etcd not supporting TTL refresh
+    m_etcd_client.return_value.version = '2.2.5'
+
+    # When: I refresh the node
+    refreshed = refresh_node(create_mock_args(), 'mock-app-8080', 60)
+
+    # Then: Node is not refreshed (so that it gets re-written)
+    eq_(refreshed, False)
+    eq_(m_etcd_client.return_value.refresh.called, False)
+
+    # And: Refresh can be forced
+    eq_(refresh_node(create_mock_args(etcd_refresh='on'), 'mock-app-8080',
+                     60), True)
+
+
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_waits_for_rise_checks(m_renew_upstream, m_health_test,
+                                        m_do_register):
+    # Given: Registration for a container requiring 2 passed checks
+    view = ContainerView(create_container_info(
+        env=['DISCOVER_HEALTH={"8080": {"rise": 2}}']))
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+    m_health_test.return_value = True
+
+    # When: I register the container once
+    registration.register(view)
+
+    # Then: Node is not published yet
+    eq_(m_do_register.called, False)
+
+    # And: Thresholds are not passed to the health test
+    m_health_test.assert_called_once_with(49153, 'mockproxy',
+                                          protocol='tcp')
+
+    # When: I register the container again
+    registration.register(view)
+
+    # Then: Node gets published
+    eq_(m_do_register.call_count, 1)
+
+
+@patch('discover.yoda_register.__main__.etcd_client')
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_removes_node_after_fall_checks(
+        m_renew_upstream, m_health_test, m_do_register, m_etcd_client):
+    # Given: Published container with fall of 2
+    view = ContainerView(create_container_info(
+        env=['DISCOVER_HEALTH={"8080": {"fall": 2}}']))
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+    m_health_test.return_value = True
+    registration.register(view)
+
+    # When: Health check fails once
+    m_health_test.return_value = False
+    registration.register(view)
+
+    # Then: Node is kept
+    eq_(m_etcd_client.return_value.delete.called, False)
+
+    # When: Health check fails again
+    registration.register(view)
+
+    # Then: Node is removed right away
+    eq_(m_etcd_client.return_value.delete.call_count, 1)
+    node_key = m_etcd_client.return_value.delete.call_args[0][0]
+    eq_(node_key.endswith('/endpoints/mock-discover'), True)
+    eq_(registration.published, {})
+
+
+@patch('discover.yoda_register.__main__.etcd_client')
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_deregister_removes_published_endpoints(
+        m_renew_upstream, m_health_test, m_do_register, m_etcd_client):
+    # Given: Published container
+    view = ContainerView(create_container_info())
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+    m_health_test.return_value = True
+    registration.register(view)
+
+    # When: I deregister the container
+    deregistered = registration.deregister('remove')
+
+    # Then: Endpoint is removed right away
+    eq_(deregistered, 1)
+    eq_(m_etcd_client.return_value.delete.call_count, 1)
+    eq_(registration.published, {})
+
+
+@patch('discover.yoda_register.__main__.etcd_client')
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_deregister_marks_endpoints_as_draining(
+        m_renew_upstream, m_health_test, m_do_register, m_etcd_client):
+    # Given: Published container
+    view = ContainerView(create_container_info())
+    registration = ContainerRegistration(create_mock_args(), view,
+                                         HealthCheckEngine())
+    m_health_test.return_value = True
+    registration.register(view)
+
+    # When: I deregister the container using meta drain mode
+    registration.deregister('meta', drain_seconds=10)
+
+    # Then: Endpoint is re-published as draining with drain window as TTL
+    eq_(m_do_register.call_count, 2)
+    eq_(m_do_register.call_args[0][4], '49153')
+    eq_(m_do_register.call_args[1]['ttl'], 10)
+    eq_(m_do_register.call_args[1]['draining'], True)
+
+    # And: Endpoint is not deleted
+    eq_(m_etcd_client.return_value.delete.called, False)
+    eq_(registration.published, {})
+
+
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_register_all_runs_checks_of_all_containers_at_once(
+        m_renew_upstream, m_health_test, m_do_register):
+    # Given: Two containers with slow health checks
+    def slow_test(port, host, **kwargs):
+        time.sleep(0.5)
+        return True
+    m_health_test.side_effect = slow_test
+    engine = HealthCheckEngine(max_concurrent=4)
+    due = []
+    for index, host_port in enumerate(('49153', '49154')):
+        view = ContainerView(create_container_info(
+            container_id='mock-id%d' % index, name='/mock-app%d' % index,
+            network_ports={'8080/tcp': [{'HostIp': '0.0.0.0',
+                                         'HostPort': host_port}]}))
+        args = create_mock_args(node_name=view.name,
+                                discover_name=view.name)
+        due.append((ContainerRegistration(args, view, engine), view))
+
+    # When: I register both containers
+    started = time.time()
+    register_all(engine, due)
+
+    # Then: Checks of both containers run concurrently
+    eq_(time.time() - started < 0.9, True)
+
+    # And: Both containers are published
+    eq_(m_do_register.call_count, 2)
+    eq_([registration.public_ports for registration, _view in due],
+        [{'8080': '49153'}, {'8080': '49154'}])
+
+
+@patch('discover.yoda_register.__main__.start_event_watcher')
+@patch('discover.yoda_register.__main__.docker_client')
+@patch('discover.yoda_register.__main__.remove_node')
+@patch('discover.yoda_register.__main__.do_register')
+@patch('discover.health.health_test')
+@patch('discover.yoda_register.__main__.renew_upstream')
+def test_container_poll_deregisters_removed_container(
+        m_renew_upstream, m_health_test, m_do_register, m_remove_node,
+        m_docker_client, m_start_event_watcher):
+    # Given: Healthy container
+    m_docker_client.return_value.inspect_container.return_value = \
+        create_container_info()
+    m_health_test.return_value = True
+
+    # And: Container removed (docker rm -f) right after it got published
+    caches = []
+    m_start_event_watcher.side_effect = \
+        lambda factory, cache: caches.append(cache)
+
+    def remove_container(*args, **kwargs):
+        caches[0].handle_event({'status': 'die', 'id': 'mock-id'})
+        caches[0].handle_event({'status': 'destroy', 'id': 'mock-id'})
+    m_do_register.side_effect = remove_container
+
+    # When: I poll the container
+    docker_container_poll(create_mock_args(),
+                          poll=MagicMock(side_effect=[True] * 5 + [False]))
+
+    # Then: Endpoint is published and removed once the container is gone
+    eq_(m_do_register.call_count, 1)
+    eq_(m_remove_node.call_count, 1)
+
+
+@patch('discover.yoda_register.__main__.time.sleep')
+def test_drain_registrations(m_sleep):
+    # Given: Registrations with published endpoints
+    registrations = {'app1': MagicMock(), 'app2': MagicMock()}
+    registrations['app1'].deregister.return_value = 1
+    registrations['app2'].deregister.side_effect = Exception('mock')
+
+    # When: I drain registrations
+    drain_registrations(create_mock_args(drain_seconds=5), registrations)
+
+    # Then: All the registrations are deregistered
+    registrations['app1'].deregister.assert_called_once_with('remove', 5)
+    registrations['app2'].deregister.assert_called_once_with('remove', 5)
+
+    # And: Drain window is awaited
+    m_sleep.assert_called_once_with(5)
+
+
+@patch('discover.yoda_register.__main__.time.sleep')
+def test_drain_registrations_without_published_endpoints(m_sleep):
+    # Given: Registration without published endpoints
+    registrations = {'app1': MagicMock()}
+    registrations['app1'].deregister.return_value = 0
+
+    # When: I drain registrations
+    drain_registrations(create_mock_args(drain_seconds=5), registrations)
+
+    # Then: Drain window is skipped
+    eq_(m_sleep.called, False)
+
+
+def test_update_proxy_host():
+    # Given: Registrations with their own (copied) arguments
+    parsed_args = create_mock_args()
+    registration = MagicMock(next_poll=time.time() + 60,
+                             parsed_args=create_mock_args())
+
+    # When: I update the proxy host
+    update_proxy_host(parsed_args, {'app': registration}, 'newproxy')
+
+    # Then: Proxy host is updated and registration is due for re-publishing
+    eq_(parsed_args.proxy_host, 'newproxy')
+    eq_(registration.parsed_args.proxy_host, 'newproxy')
+    eq_(registration.next_poll <= time.time(), True)
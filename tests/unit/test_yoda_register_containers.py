@@ -0,0 +1,196 @@
+from mock import MagicMock
+from nose.tools import eq_
+from discover.yoda_register.containers import parse_discover_config, \
+    is_discoverable, parse_port_mappings, ContainerView, ContainerCache
+
+
+def create_container_info(container_id='mock-id', name='/mock-app', env=None,
+                          running=True, exposed_ports=None,
+                          network_ports=None):
+    return {
+        'Id': container_id,
+        'Name': name,
+        'Config': {
+            'Env': env or [],
+            'ExposedPorts': exposed_ports or {'8080/tcp': {}}
+        },
+        'NetworkSettings': {
+            'Ports': {
+                '8080/tcp': [{'HostIp': '0.0.0.0', 'HostPort': '49153'}]
+            } if network_ports is None else network_ports
+        },
+        'State': {
+            'Running': running
+        }
+    }
+
+
+def test_parse_discover_config_with_defaults():
+    # Given: Container without discover configuration
+    container_info = create_container_info()
+
+    # When: I parse the discover config
+    config = parse_discover_config(container_info)
+
+    # Then: Default configuration is returned
+    eq_(config['app_name'], 'not-set')
+    eq_(config['deployment_mode'], 'blue-green')
+    eq_(config['health_checks'], {})
+    eq_(config['discover_ports'], [])
+    eq_(config['poll_interval'], 45)
+    eq_(config['discover_ttl'], 190)
+    eq_(config['upstream_ttl'], 86400)
+
+
+def test_parse_discover_config():
+    # Given: Container with discover configuration
+    container_info = create_container_info(env=[
+        'DISCOVER_APP_NAME=mock-app',
+        'DISCOVER_APP_VERSION=v1',
+        'DISCOVER_PORTS=8080, 8081,',
+        'DISCOVER_HEALTH={"8080": {"uri": "/health"}}',
+        'DISCOVER_POLL_INTERVAL=10',
+    ])
+
+    # When: I parse the discover config
+    config = parse_discover_config(container_info)
+
+    # Then: Expected configuration is returned
+    eq_(config['app_name'], 'mock-app')
+    eq_(config['app_version'], 'v1')
+    eq_(config['discover_ports'], ['8080', '8081'])
+    eq_(config['health_checks'], {'8080': {'uri': '/health'}})
+    eq_(config['discover_ttl'], 50)
+
+
+def test_is_discoverable():
+    # Then: Only containers with DISCOVER_* env are discoverable
+    eq_(is_discoverable(create_container_info(
+        env=['DISCOVER_APP_NAME=mock-app'])), True)
+    eq_(is_discoverable(create_container_info(env=['PATH=/bin'])), False)
+
+
+def test_parse_port_mappings():
+    # Given: Container with published and unpublished ports
+    container_info = create_container_info(network_ports={
+        '8080/tcp': [{'HostIp': '0.0.0.0', 'HostPort': '49153'}],
+        '8081/tcp': None
+    })
+
+    # When: I parse the port mappings
+    ports = parse_port_mappings(container_info)
+
+    # Then: Only published ports are returned
+    eq_(ports, {'8080/tcp': '49153'})
+
+
+def test_cache_refreshes_container_on_start_event():
+    # Given: Container cache
+    docker_cl = MagicMock()
+    docker_cl.inspect_container.return_value = create_container_info()
+    cache = ContainerCache(docker_cl)
+
+    # When: I handle start event for the container
+    cache.handle_event({'status': 'start', 'id': 'mock-id'})
+
+    # Then: Container gets inspected and cached
+    docker_cl.inspect_container.assert_called_once_with('mock-id')
+    eq_(cache.get('mock-id').running, True)
+    eq_(cache.get('mock-app').id, 'mock-id')
+    eq_(cache.version, 1)
+
+
+def test_cache_marks_container_stopped_on_die_event():
+    # Given: Container cache with running container
+    docker_cl = MagicMock()
+    cache = ContainerCache(docker_cl)
+    cache.views['mock-id'] = ContainerView(create_container_info())
+
+    # When: I handle die event for the container
+    cache.handle_event({'status': 'die', 'id': 'mock-id'})
+
+    # Then: Container is marked as stopped without re-inspecting
+    eq_(cache.get('mock-id').running, False)
+    eq_(docker_cl.inspect_container.called, False)
+
+
+def test_cache_ignores_filtered_containers():
+    # Given: Container cache tracking a single container
+    docker_cl = MagicMock()
+    cache = ContainerCache(docker_cl, container_filter=lambda cid:
+                           cid == 'mock-id')
+
+    # When: I handle event for other container
+    cache.handle_event({'status': 'start', 'id': 'other-id'})
+
+    # Then: Event is ignored
+    eq_(docker_cl.inspect_container.called, False)
+    eq_(cache.version, 0)
+
+
+def test_cache_wait_returns_on_change():
+    # Given: Container cache
+    cache = ContainerCache(MagicMock())
+
+    # When: I wait on an outdated version
+    version = cache.wait(-1, 10)
+
+    # Then: Current version is returned without waiting
+    eq_(version, 0)
+
+
+def test_cache_refreshes_container_on_kill_event():
+    # Given: Container cache with running container
+    docker_cl = MagicMock()
+    docker_cl.inspect_container.return_value = create_container_info()
+    cache = ContainerCache(docker_cl)
+    cache.views['mock-id'] = ContainerView(create_container_info())
+
+    # When: I handle kill event for a signal that does not stop the
+    # container (e.g. docker kill -s HUP)
+    cache.handle_event({'status': 'kill', 'id': 'mock-id'})
+
+    # Then: Container is re-inspected and still running
+    docker_cl.inspect_container.assert_called_once_with('mock-id')
+    eq_(cache.get('mock-id').running, True)
+
+
+def test_cache_refreshes_container_on_pause_event():
+    # Given: Container cache with running container
+    docker_cl = MagicMock()
+    docker_cl.inspect_container.return_value = create_container_info()
+    cache = ContainerCache(docker_cl)
+    cache.views['mock-id'] = ContainerView(create_container_info())
+
+    # When: I handle pause event for the container
+    cache.handle_event({'status': 'pause', 'id': 'mock-id'})
+
+    # Then: Container is re-inspected and not marked as stopped
+    docker_cl.inspect_container.assert_called_once_with('mock-id')
+    eq_(cache.get('mock-id').running, True)
+
+
+def test_cache_resync_skips_container_with_invalid_config():
+    # Given: Docker with a container having invalid health check json and
+    # a valid container
+    containers = {
+        'bad-id': create_container_info(
+            container_id='bad-id', name='/bad-app',
+            env=['DISCOVER_HEALTH={invalid', 'DISCOVER_TTL=abc']),
+        'mock-id': create_container_info(),
+    }
+    docker_cl = MagicMock()
+    docker_cl.containers.return_value = [{'Id': 'bad-id'}, {'Id': 'mock-id'}]
+    docker_cl.inspect_container.side_effect = containers.get
+    cache = ContainerCache(docker_cl)
+
+    # When: I resync the cache
+    cache.resync()
+
+    # Then: Invalid container is skipped and the valid one is cached
+    eq_(cache.get('bad-id'), None)
+    eq_(cache.get('mock-id').running, True)
+
+    # And: Events for the invalid container do not fail
+    eq_(cache.handle_event({'status': 'start', 'id': 'bad-id'}), None)
+    eq_(cache.get('bad-id'), None)
@@ -1,9 +1,16 @@
 from collections import namedtuple
-from mock import patch, MagicMock
+import etcd
+from mock import patch, MagicMock, ANY, DEFAULT
 from nose.tools import eq_
-from discover.yoda_route53.__main__ import route53_sync
+from discover.yoda_route53.__main__ import route53_sync, reconcile, \
+    leader_sync, job_lock, job_unlock, get_sync_index, remove_sync_index, \
+    save_sync_index
+from discover.yoda_route53.targets import Route53Targets
+from discover.yoda_route53.records import RecordSetCache
+from benchmarks.fakes import FakeEtcdServer, FakeRoute53Connection
 
 Args = namedtuple('Args', 'etcd_host etcd_port etcd_base')
+Event = namedtuple('Event', 'key action value modifiedIndex etcd_index')
 
 
 def create_mock_args(etcd_host='mockhost', etcd_port=4001, etcd_base='/'):
@@ -27,3 +34,211 @@ def test_route53_sync_with_no_polling(m_etcd_cl, m_yoda_cl, m_route53):
     # Then: No sync is performed
     eq_(m_route53.called, False)
     eq_(m_yoda_cl.called, False)
+
+
+@patch('discover.yoda_route53.records.commit_changes')
+@patch('discover.yoda_route53.records.list_weighted_records')
+def test_reconcile(m_list_records, m_commit_changes):
+    # Given: Proxy nodes in etcd
+    etcd_cl = MagicMock()
+    etcd_cl.read.return_value.leaves = [
+        MagicMock(key='/yoda/proxy-nodes/node1', value='host1', dir=False,
+                  action='get'),
+        MagicMock(key='/yoda/proxy-nodes/node2', value='host2', dir=False,
+                  action='get')
+    ]
+    etcd_cl.read.return_value.etcd_index = 100
+
+    # And: Existing records in route53
+    m_list_records.return_value = {
+        'node1': MagicMock(resource_records=['host1'], ttl='60',
+                           weight='1'),
+        'node3': MagicMock(resource_records=['host3'], ttl='60',
+                           weight='1'),
+    }
+
+    # And: Mock parsed arguments
+    parsed_args = MagicMock(etcd_base='/yoda', zone_id='mockzone',
+                            dns_record='mycluster.abc.com',
+                            record_type='CNAME', record_weight=1, dns_ttl=60)
+
+    # And: Cached route53 records
+    conn = MagicMock()
+    records = RecordSetCache(conn, 'mockzone', 'mycluster.abc.com', 'CNAME')
+
+    # When: I reconcile route53
+    etcd_index = reconcile(etcd_cl, records, parsed_args,
+                           '/yoda/proxy-nodes')
+
+    # Then: Only the differences are applied
+    eq_(etcd_index, 100)
+    m_commit_changes.assert_called_once_with(
+        conn, 'mockzone', 'mycluster.abc.com', 'CNAME',
+        [('UPSERT', 'node2', 'host2', 60, 1),
+         ('DELETE', 'node3', 'host3', '60', '1')])
+
+    # And: Cached records reflect the applied changes
+    eq_(sorted(records.records.keys()), ['node1', 'node2'])
+
+    # And: Sync index is reset to the snapshot index
+    etcd_cl.write.assert_any_call('/yoda/route53/sync-index/', 100)
+
+
+@patch('discover.yoda_route53.__main__.apply_events')
+@patch('discover.yoda_route53.__main__.drain_events')
+def test_leader_sync_continues_from_sync_index(m_drain_events,
+                                               m_apply_events):
+    # Given: Sync index handed over by previous leader
+    etcd_cl = MagicMock()
+    etcd_cl.read.return_value.value = '10'
+
+    # And: Pending event after sync index
+    event = MagicMock(modifiedIndex=11, etcd_index=11)
+    m_drain_events.return_value = [event]
+
+    # And: Leader election
+    election = MagicMock(ttl=30)
+    election.is_leader.return_value = True
+
+    # And: Poll function returning true only once
+    poll = MagicMock(side_effect=[True, False])
+
+    # When: I perform leader sync
+    parsed_args = MagicMock(etcd_base='/yoda', reconcile_interval=900)
+    leader_sync(etcd_cl, election, MagicMock(), parsed_args,
+                '/yoda/proxy-nodes', poll)
+
+    # Then: Events are watched from handed over sync index
+    etcd_cl.read.assert_called_with('/yoda/proxy-nodes', recursive=True,
+                                    wait=True, timeout=10, waitIndex=11)
+
+    # And: Events are applied and sync index is persisted
+    eq_(m_apply_events.call_count, 1)
+    etcd_cl.write.assert_called_once_with('/yoda/route53/sync-index/', 11)
+
+
+def test_route53_sync_replicas_taking_turns():
+    # Given: Route53 shared by two replicas (each with own cached records)
+    route53 = FakeRoute53Connection(rate=100, burst=100)
+    replicas = [RecordSetCache(route53, 'mockzone', 'mycluster.abc.com',
+                               'CNAME') for _ in range(2)]
+
+    # And: Sync index shared through etcd
+    store = {}
+
+    def set_sync_index(etcd_cl, etcd_base, sync_index):
+        store['sync_index'] = sync_index
+
+    parsed_args = MagicMock(etcd_base='/yoda', reconcile_interval=900,
+                            dns_record='mycluster.abc.com', record_weight=1,
+                            dns_ttl=60, load_aware_weights=False)
+
+    def sync(records, event):
+        with patch.multiple(
+                'discover.yoda_route53.__main__', etcd_client=MagicMock(),
+                route53_records=MagicMock(return_value=records),
+                reconcile=MagicMock(return_value=None),
+                job_lock=MagicMock(return_value=1), job_unlock=MagicMock(),
+                get_sync_index=lambda *args: store.get('sync_index'),
+                set_sync_index=set_sync_index,
+                watch_proxy_nodes=MagicMock(return_value=event),
+                drain_events=MagicMock(return_value=[event])):
+            route53_sync(parsed_args, poll=MagicMock(
+                side_effect=[True, False]))
+
+    # When: Replicas take turns in applying the events
+    sync(replicas[0], Event('/yoda/proxy-nodes/node1', 'set', 'host1', 1, 1))
+    sync(replicas[1], Event('/yoda/proxy-nodes/node1', 'expire', None, 2, 2))
+    sync(replicas[0], Event('/yoda/proxy-nodes/node1', 'set', 'host1', 3, 3))
+
+    # Then: Route53 reflects the last event
+    eq_(route53.values('mycluster.abc.com', 'CNAME'), {'node1': 'host1'})
+    eq_(store['sync_index'], 3)
+
+
+def test_route53_sync_weights_after_another_replica_synced():
+    # Given: Cached records last synced by this replica at index 5
+    records = MagicMock(synced_index=5)
+    parsed_args = MagicMock(etcd_base='/yoda', reconcile_interval=900,
+                            weight_interval=0, load_aware_weights=True)
+
+    # And: Sync index moved by another replica (e.g. after reconciling a
+    # stale index)
+    with patch.multiple(
+            'discover.yoda_route53.__main__', etcd_client=MagicMock(),
+            route53_records=MagicMock(return_value=records),
+            load_weights=MagicMock(), reconcile=MagicMock(return_value=None),
+            job_lock=MagicMock(return_value=1), job_unlock=MagicMock(),
+            get_sync_index=MagicMock(return_value=9),
+            apply_load_weights=DEFAULT,
+            watch_proxy_nodes=MagicMock(
+                side_effect=etcd.EtcdWatchTimedOut('timeout'))) as mocks:
+
+        # When: Weights are applied
+        route53_sync(parsed_args, poll=MagicMock(
+            side_effect=[True, True, False]))
+
+    # Then: Cached records are refreshed before applying the weights
+    eq_(mocks['apply_load_weights'].call_count, 1)
+    eq_(records.invalidate.call_count, 1)
+
+
+@patch('discover.yoda_route53.__main__.watch_proxy_nodes')
+def test_route53_sync_on_fresh_cluster(m_watch_proxy_nodes):
+    # Given: Fresh etcd cluster (no lock, sync index or proxy nodes)
+    server = FakeEtcdServer().start()
+    etcd_cl = etcd.Client(host='127.0.0.1', port=server.port)
+    try:
+        # Then: Missing sync index is not an error
+        eq_(get_sync_index(etcd_cl, '/yoda'), None)
+        remove_sync_index(etcd_cl, '/yoda')
+
+        # And: Lock held by another node is not acquired
+        lock = job_lock(etcd_cl, '/yoda')
+        eq_(job_lock(etcd_cl, '/yoda'), None)
+
+        # And: Unlocking a lock taken over by another node fails gracefully
+        eq_(job_unlock(etcd_cl, '/yoda', lock + 1), False)
+        eq_(job_unlock(etcd_cl, '/yoda', lock), None)
+
+        # When: I perform leader sync
+        m_watch_proxy_nodes.side_effect = etcd.EtcdWatchTimedOut('timeout')
+        election = MagicMock(ttl=30)
+        election.is_leader.return_value = True
+        parsed_args = MagicMock(etcd_base='/yoda', reconcile_interval=900,
+                                dns_record='mycluster.abc.com',
+                                record_weight=1, dns_ttl=60)
+        records = RecordSetCache(FakeRoute53Connection(rate=100, burst=100),
+                                 'mockzone', 'mycluster.abc.com', 'CNAME')
+        leader_sync(etcd_cl, election, records, parsed_args,
+                    '/yoda/proxy-nodes', MagicMock(side_effect=[True, False]))
+
+        # Then: Sync starts from the (empty) snapshot without failing
+        eq_(m_watch_proxy_nodes.call_count, 1)
+        eq_(get_sync_index(etcd_cl, '/yoda'), None)
+    finally:
+        server.stop()
+
+
+@patch('discover.yoda_route53.__main__.set_sync_index')
+def test_save_sync_index_applied_by_all_targets(m_set_sync_index):
+    # Given: Targets where one target lags behind
+    targets = Route53Targets([MagicMock(applied_index=20),
+                              MagicMock(applied_index=12)])
+
+    # When: I save the sync index for a batch up to index 20
+    saved = save_sync_index(MagicMock(), targets, create_mock_args(), 20)
+
+    # Then: Lowest index applied by all the targets is saved
+    eq_(saved, 12)
+    m_set_sync_index.assert_called_once_with(ANY, '/', 12)
+    eq_(targets.synced_index, 12)
+
+    # When: A target did not apply any batch yet
+    m_set_sync_index.reset_mock()
+    targets.workers[1].applied_index = None
+    saved = save_sync_index(MagicMock(), targets, create_mock_args(), 20)
+
+    # Then: Sync index is not saved
+    eq_(saved, None)
+    eq_(m_set_sync_index.call_count, 0)
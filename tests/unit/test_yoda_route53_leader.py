@@ -0,0 +1,64 @@
+import etcd
+from mock import MagicMock
+from nose.tools import eq_
+from discover.yoda_route53.leader import LeaderElection
+
+
+def test_acquire_lease():
+    # Given: No existing leader
+    etcd_cl = MagicMock()
+    election = LeaderElection(etcd_cl, '/yoda/route53/_leader', 'node1',
+                              ttl=30)
+
+    # When: I acquire the lease
+    acquired = election.acquire()
+
+    # Then: Node becomes the leader
+    eq_(acquired, True)
+    eq_(election.is_leader(), True)
+    etcd_cl.write.assert_called_once_with('/yoda/route53/_leader', 'node1',
+                                          ttl=30, prevExist=False)
+
+
+def test_acquire_lease_held_by_other_node():
+    # Given: Existing leader
+    etcd_cl = MagicMock()
+    etcd_cl.write.side_effect = etcd.EtcdAlreadyExist('mock')
+    election = LeaderElection(etcd_cl, '/yoda/route53/_leader', 'node1')
+
+    # When: I acquire the lease
+    acquired = election.acquire()
+
+    # Then: Node stands by
+    eq_(acquired, False)
+    eq_(election.is_leader(), False)
+
+
+def test_renew_lease_failure_drops_leadership():
+    # Given: Leader whose lease was taken over
+    etcd_cl = MagicMock()
+    election = LeaderElection(etcd_cl, '/yoda/route53/_leader', 'node1')
+    election.acquire()
+    etcd_cl.refresh.side_effect = etcd.EtcdCompareFailed('mock')
+
+    # When: I renew the lease
+    renewed = election.renew()
+
+    # Then: Leadership is lost
+    eq_(renewed, False)
+    eq_(election.is_leader(), False)
+
+
+def test_release_lease():
+    # Given: Leader
+    etcd_cl = MagicMock()
+    election = LeaderElection(etcd_cl, '/yoda/route53/_leader', 'node1')
+    election.acquire()
+
+    # When: I release the lease
+    election.release()
+
+    # Then: Lease key is removed for the standby nodes
+    eq_(election.is_leader(), False)
+    etcd_cl.delete.assert_called_once_with('/yoda/route53/_leader',
+                                           prevValue='node1')
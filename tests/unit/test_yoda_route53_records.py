@@ -0,0 +1,226 @@
+from collections import namedtuple
+from boto.route53.exception import DNSServerError
+from mock import MagicMock, patch
+from nose.tools import eq_
+from discover.yoda_route53.records import list_weighted_records, \
+    collapse_events, plan_changes, chunk_changes, commit_changes, \
+    RecordSetCache, RateLimitedConnection, is_throttled
+from benchmarks.fakes import FakeRoute53Connection
+
+Event = namedtuple('Event', 'key action value modifiedIndex')
+
+
+def create_mock_record(identifier, value, name='mycluster.abc.com.',
+                       record_type='CNAME', ttl='60', weight='1'):
+    record = MagicMock(type=record_type, ttl=ttl, weight=weight,
+                       identifier=identifier, resource_records=[value])
+    # name can not be passed to MagicMock constructor
+    record.name = name
+    return record
+
+
+def test_list_weighted_records():
+    # Given: Hosted zone with weighted records for multiple names
+    conn = MagicMock()
+    conn.get_all_rrsets.return_value = [
+        create_mock_record('node1', 'host1'),
+        create_mock_record('node2', 'host2'),
+        create_mock_record('node3', 'host3', name='other.abc.com.'),
+    ]
+
+    # When: I list weighted records
+    records = list_weighted_records(conn, 'mockzone', 'mycluster.abc.com',
+                                    'CNAME')
+
+    # Then: Only records for the dns record are returned
+    eq_(sorted(records.keys()), ['node1', 'node2'])
+    conn.get_all_rrsets.assert_called_once_with(
+        'mockzone', type='CNAME', name='mycluster.abc.com')
+
+
+def test_list_weighted_records_pages_through_rate_limiter():
+    # Given: Hosted zone with 5 weighted records (listed 2 per page) followed
+    # by records for other names
+    route53 = FakeRoute53Connection(rate=100, burst=100, page_size=2)
+    route53.seed('mycluster.abc.com', 'CNAME',
+                 {'node%d' % index: 'host%d' % index
+                  for index in range(5)}, 60, 1)
+    route53.seed('other.abc.com', 'CNAME', {'node0': 'host0'}, 60, 1)
+
+    # And: Rate limited connection
+    limiter = MagicMock()
+    limiter.call.side_effect = lambda fn, *args, **kwargs: fn(*args,
+                                                              **kwargs)
+    conn = RateLimitedConnection(route53, limiter)
+
+    # When: I list weighted records
+    records = list_weighted_records(conn, 'mockzone', 'mycluster.abc.com',
+                                    'CNAME')
+
+    # Then: All the records are returned
+    eq_(sorted(records.keys()), ['node%d' % index for index in range(5)])
+
+    # And: Every page went through the rate limiter
+    eq_(route53.operations['get_all_rrsets'], 3)
+    eq_(limiter.call.call_count, 3)
+
+
+def test_collapse_events():
+    # Given: Multiple events for the same nodes
+    events = [
+        Event('/yoda/proxy-nodes/node1', 'set', 'host1', 10),
+        Event('/yoda/proxy-nodes/node2', 'set', 'host2', 11),
+        Event('/yoda/proxy-nodes/node1', 'expire', None, 12),
+        Event('/yoda/proxy-nodes/node2', 'set', 'host2-new', 13),
+        Event('/yoda/proxy-nodes', 'set', None, 14),
+    ]
+
+    # When: I collapse the events
+    desired = collapse_events(events, '/yoda/proxy-nodes')
+
+    # Then: Final state per node is returned
+    eq_(desired, {'node1': None, 'node2': 'host2-new'})
+
+
+def test_plan_changes():
+    # Given: Current records
+    current = {
+        'node1': create_mock_record('node1', 'host1'),
+        'node2': create_mock_record('node2', 'host2'),
+        'node3': create_mock_record('node3', 'host3'),
+    }
+
+    # When: I plan changes for desired state
+    changes = plan_changes({
+        'node1': 'host1',
+        'node2': 'host2-new',
+        'node3': None,
+        'node4': 'host4',
+        'node5': None,
+    }, current, 1, 60)
+
+    # Then: Only the differences are planned
+    eq_(changes, [
+        ('UPSERT', 'node2', 'host2-new', 60, 1),
+        ('DELETE', 'node3', 'host3', '60', '1'),
+        ('UPSERT', 'node4', 'host4', 60, 1),
+    ])
+
+
+def test_chunk_changes():
+
+    # When: I chunk changes
+    chunks = chunk_changes(list(range(5)), size=2)
+
+    # Then: Changes are split as per the size
+    eq_(chunks, [[0, 1], [2, 3], [4]])
+
+
+@patch('discover.yoda_route53.records.ResourceRecordSets')
+def test_commit_changes(m_record_sets):
+    # Given: Multiple changes
+    changes = [('UPSERT', 'node%d' % index, 'host', 60, 1)
+               for index in range(3)]
+
+    # When: I commit changes
+    with patch('discover.yoda_route53.records.chunk_changes',
+               side_effect=lambda changes: [changes[:2], changes[2:]]):
+        requests = commit_changes(MagicMock(), 'mockzone',
+                                  'mycluster.abc.com', 'CNAME', changes)
+
+    # Then: Changes are submitted in batches
+    eq_(requests, 2)
+    eq_(m_record_sets().commit.call_count, 2)
+    eq_(m_record_sets().add_change.call_count, 3)
+
+
+@patch('discover.yoda_route53.records.commit_changes')
+@patch('discover.yoda_route53.records.list_weighted_records')
+def test_record_set_cache_uses_cached_records(
+        m_list_records, m_commit_changes):
+    # Given: Cached route53 records
+    m_list_records.return_value = {}
+    records = RecordSetCache(MagicMock(), 'mockzone', 'mycluster.abc.com',
+                             'CNAME')
+
+    # When: I apply the same desired state twice
+    first = records.apply({'node1': 'host1'}, 1, 60)
+    second = records.apply({'node1': 'host1'}, 1, 60)
+
+    # Then: Records are listed only once
+    eq_(m_list_records.call_count, 1)
+
+    # And: Second apply is a no-op (using the cached record)
+    eq_(first, [('UPSERT', 'node1', 'host1', 60, 1)])
+    eq_(second, [])
+    eq_(m_commit_changes.call_count, 1)
+
+
+@patch('discover.yoda_route53.records.commit_changes')
+@patch('discover.yoda_route53.records.list_weighted_records')
+def test_record_set_cache_refreshes_on_conflict(
+        m_list_records, m_commit_changes):
+    # Given: Cached route53 records which are out of date
+    m_list_records.side_effect = [
+        {'node1': create_mock_record('node1', 'host1')},
+        {}
+    ]
+    records = RecordSetCache(MagicMock(), 'mockzone', 'mycluster.abc.com',
+                             'CNAME')
+
+    # And: Route53 rejecting the stale change
+    m_commit_changes.side_effect = [DNSServerError(400, 'Bad Request'), 1]
+
+    # When: I delete the record
+    changes = records.apply({'node1': None}, 1, 60)
+
+    # Then: Records are refreshed and changes are re-planned
+    eq_(m_list_records.call_count, 2)
+    eq_(changes, [])
+
+
+@patch('discover.yoda_route53.records.commit_changes')
+@patch('discover.yoda_route53.records.list_weighted_records')
+def test_record_set_cache_refreshes_on_delete_of_unknown_record(
+        m_list_records, m_commit_changes):
+    # Given: Cached route53 records without the record (created by another
+    # replica after the records were listed)
+    m_list_records.side_effect = [
+        {},
+        {'node1': create_mock_record('node1', 'host1')}
+    ]
+    records = RecordSetCache(MagicMock(), 'mockzone', 'mycluster.abc.com',
+                             'CNAME')
+    records.get_records()
+
+    # When: I delete the record
+    changes = records.apply({'node1': None}, 1, 60)
+
+    # Then: Records are refreshed and the record gets deleted
+    eq_(m_list_records.call_count, 2)
+    eq_(changes, [('DELETE', 'node1', 'host1', '60', '1')])
+
+
+def test_rate_limited_connection():
+    # Given: Connection wrapped with a rate limiter
+    conn = MagicMock()
+    limiter = MagicMock()
+    rate_limited = RateLimitedConnection(conn, limiter)
+
+    # When: I call route53 APIs
+    rate_limited.get_all_rrsets('mockzone')
+    rate_limited.get_all_hosted_zones()
+
+    # Then: Only the rate limited calls go through the limiter
+    limiter.call.assert_called_once_with(conn.get_all_rrsets, 'mockzone')
+    conn.get_all_hosted_zones.assert_called_once_with()
+
+
+def test_is_throttled():
+    # Given: Route53 throttling error
+    error = DNSServerError(400, 'Bad Request')
+    error.error_code = 'Throttling'
+
+    # Then: Error is detected as throttled
+    eq_(is_throttled(error), True)
+    eq_(is_throttled(DNSServerError(400, 'Bad Request')), False)
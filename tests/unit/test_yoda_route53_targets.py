@@ -0,0 +1,187 @@
+import threading
+from argparse import Namespace
+from mock import MagicMock
+from nose.tools import eq_, raises, ok_
+from discover.yoda_route53.targets import parse_targets, target_args, \
+    TargetWorker, Route53Targets
+
+
+def create_mock_args(zone_id='Z1', dns_record='a.abc.com'):
+    return Namespace(zone_id=zone_id, dns_record=dns_record,
+                     record_type='A', record_weight=10, dns_ttl=60,
+                     route53_rate=5.0, route53_burst=5)
+
+
+def create_mock_records():
+    records = MagicMock()
+    records.get_records.return_value = {}
+    records.refresh.return_value = {}
+    records.apply.side_effect = lambda desired, weight, ttl: list(desired)
+    return records
+
+
+def test_parse_compact_targets():
+    # When: I parse comma separated targets
+    targets = parse_targets('Z1:a.abc.com, Z2:a.internal:CNAME:20')
+
+    # Then: Targets are parsed with optional type and weight
+    eq_(targets, [
+        {'zone_id': 'Z1', 'dns_record': 'a.abc.com'},
+        {'zone_id': 'Z2', 'dns_record': 'a.internal', 'record_type': 'CNAME',
+         'record_weight': 20}
+    ])
+
+
+def test_parse_json_targets():
+    # When: I parse json targets
+    targets = parse_targets(
+        '[{"zone_id": "Z1", "dns_record": "a.abc.com", "route53_rate": 2}]')
+
+    # Then: Targets are parsed with per target rate
+    eq_(targets, [{'zone_id': 'Z1', 'dns_record': 'a.abc.com',
+                   'route53_rate': 2.0}])
+
+
+@raises(ValueError)
+def test_parse_targets_without_record():
+    # When: I parse a target without dns record
+    parse_targets('Z1')
+
+    # Then: ValueError is raised
+
+
+@raises(ValueError)
+def test_parse_targets_with_unknown_key():
+    # When: I parse a target with an unknown key
+    parse_targets('[{"zone_id": "Z1", "dns_record": "a", "zone": "Z2"}]')
+
+    # Then: ValueError is raised
+
+
+def test_target_args():
+    # Given: Parsed arguments
+    parsed_args = create_mock_args()
+
+    # When: I create the arguments for a target
+    args = target_args(parsed_args, {'zone_id': 'Z2', 'record_weight': 20})
+
+    # Then: Target values override the parsed arguments
+    eq_((args.zone_id, args.dns_record, args.record_weight),
+        ('Z2', 'a.abc.com', 20))
+    eq_(parsed_args.zone_id, 'Z1')
+
+
+def test_worker_coalesces_pending_changes():
+    # Given: Worker (not started) with pending changes
+    records = create_mock_records()
+    worker = TargetWorker(create_mock_args(), records)
+    worker.submit(desired={'node1': '1.1.1.1', 'node2': '2.2.2.2'})
+    worker.submit(desired={'node1': None})
+
+    # When: I apply the pending changes
+    worker.apply(*worker._take())
+
+    # Then: Final desired state is applied once
+    records.apply.assert_called_once_with(
+        {'node1': None, 'node2': '2.2.2.2'}, 10, 60)
+
+
+def test_worker_snapshot_replaces_pending_changes():
+    # Given: Worker (not started) with pending changes and a snapshot
+    records = create_mock_records()
+    records.refresh.return_value = {'node3': MagicMock()}
+    worker = TargetWorker(create_mock_args(), records)
+    worker.submit(desired={'node1': None})
+    worker.submit(snapshot={'node2': '2.2.2.2'})
+
+    # When: I apply the pending changes
+    worker.apply(*worker._take())
+
+    # Then: Only the snapshot is reconciled
+    records.apply.assert_called_once_with(
+        {'node2': '2.2.2.2', 'node3': None}, 10, 60)
+
+
+def test_worker_requeues_failed_changes():
+    # Given: Worker (not started) with taken changes and newer changes
+    worker = TargetWorker(create_mock_args(), create_mock_records())
+    worker.submit(desired={'node1': '1.1.1.1', 'node2': '2.2.2.2'})
+    work = worker._take()
+    worker.submit(desired={'node1': None})
+
+    # When: Taken changes fail
+    worker._restore(*work)
+
+    # Then: Failed changes are re-queued without overriding newer ones
+    eq_(worker._desired, {'node1': None, 'node2': '2.2.2.2'})
+
+
+def test_targets_fan_out_changes():
+    # Given: Targets for 2 zones
+    records1, records2 = create_mock_records(), create_mock_records()
+    targets = Route53Targets([
+        TargetWorker(create_mock_args('Z1'), records1),
+        TargetWorker(create_mock_args('Z2'), records2)
+    ], timeout=5).start()
+
+    # When: I submit changes
+    applied = targets.submit(desired={'node1': '1.1.1.1'})
+
+    # Then: Changes are applied to both the targets
+    ok_(applied)
+    records1.apply.assert_called_once_with({'node1': '1.1.1.1'}, 10, 60)
+    records2.apply.assert_called_once_with({'node1': '1.1.1.1'}, 10, 60)
+
+
+def test_slow_target_does_not_block_others():
+    # Given: Targets with a slow (throttled) zone
+    release = threading.Event()
+    slow_records, records = create_mock_records(), create_mock_records()
+    slow_records.apply.side_effect = lambda *args: release.wait(5) and []
+    targets = Route53Targets([
+        TargetWorker(create_mock_args('Z1'), slow_records),
+        TargetWorker(create_mock_args('Z2'), records)
+    ], timeout=0.2).start()
+
+    try:
+        # When: I submit multiple batches
+        eq_(targets.submit(desired={'node1': '1.1.1.1'}), False)
+        eq_(targets.submit(desired={'node2': '2.2.2.2'}), False)
+
+        # Then: Other target applies every batch
+        eq_(records.apply.call_count, 2)
+        # And: Slow target coalesces the batches submitted meanwhile
+        release.set()
+        ok_(targets.workers[0].wait(5))
+        eq_(slow_records.apply.call_count, 2)
+        eq_(slow_records.apply.call_args[0][0], {'node2': '2.2.2.2'})
+    finally:
+        release.set()
+
+
+def test_targets_applied_index_waits_for_slow_target():
+    # Given: Targets with a slow (throttled) zone
+    release = threading.Event()
+    slow_records, records = create_mock_records(), create_mock_records()
+    slow_records.apply.side_effect = lambda *args: release.wait(5) and []
+    targets = Route53Targets([
+        TargetWorker(create_mock_args('Z1'), slow_records),
+        TargetWorker(create_mock_args('Z2'), records)
+    ], timeout=0.2).start()
+
+    try:
+        # When: I submit a batch not applied in time by the slow target
+        eq_(targets.submit(desired={'node1': '1.1.1.1'}, index=10), False)
+
+        # Then: Batch is not acknowledged by all the targets
+        eq_(targets.workers[1].applied_index, 10)
+        eq_(targets.applied_index, None)
+
+        # When: Slow target catches up
+        release.set()
+        ok_(targets.wait())
+
+        # Then: Batch is acknowledged
+        eq_(targets.applied_index, 10)
+    finally:
+        release.set()
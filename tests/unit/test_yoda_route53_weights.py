@@ -0,0 +1,90 @@
+from mock import MagicMock
+from nose.tools import eq_
+from discover.yoda_route53.weights import LoadWeights, parse_load
+
+
+def test_parse_load():
+    # When: I parse published loads
+    # Then: Connections are returned for valid values
+    eq_(parse_load('{"connections": 10}'), 10.0)
+    eq_(parse_load('5'), 5.0)
+    eq_(parse_load('invalid'), None)
+    eq_(parse_load('{}'), None)
+
+
+def test_target_weight_is_inversely_proportional_to_load():
+    # Given: Weights with loads for 2 proxies
+    weights = LoadWeights(max_weight=100, min_weight=10)
+    weights.loads = {'node1': 9, 'node2': 29}
+
+    # When: I get the target weights
+    # Then: Less loaded proxy gets a higher (clamped) weight
+    eq_(weights.target('node1'), 100)
+    eq_(weights.target('node2'), 67)
+
+
+def test_target_weight_is_clamped_to_min_weight():
+    # Given: Weights with an overloaded proxy
+    weights = LoadWeights(max_weight=100, min_weight=50)
+    weights.loads = {'node1': 0, 'node2': 0, 'node3': 1000}
+
+    # Then: Overloaded proxy gets the min weight
+    eq_(weights.target('node3'), 50)
+
+
+def test_target_weight_for_unknown_load():
+    # Given: Weights without load for the proxy
+    weights = LoadWeights(max_weight=100)
+    weights.loads = {'node1': 50}
+
+    # Then: Max weight is returned
+    eq_(weights.target('node2'), 100)
+
+
+def test_weight_for_new_record():
+    # Given: Weights with loads
+    weights = LoadWeights(max_weight=100, min_weight=10)
+    weights.loads = {'node1': 9, 'node2': 29}
+
+    # When: I get the weight without an existing record
+    weight = weights.weight('node2')
+
+    # Then: Target weight is returned
+    eq_(weight, 67)
+
+
+def test_weight_is_damped():
+    # Given: Weights with loads and damping
+    weights = LoadWeights(max_weight=100, min_weight=10, damping=0.5)
+    weights.loads = {'node1': 9, 'node2': 29}
+
+    # When: I get the weight for an existing record
+    weight = weights.weight('node2', MagicMock(weight='100'))
+
+    # Then: Weight moves halfway to the target
+    eq_(weight, 84)
+
+
+def test_weight_ignores_small_changes():
+    # Given: Weights with loads and min change
+    weights = LoadWeights(max_weight=100, min_weight=10, min_change=0.2)
+    weights.loads = {'node1': 9, 'node2': 29}
+
+    # When: I get the weight for a record close to the target
+    weight = weights.weight('node2', MagicMock(weight='75'))
+
+    # Then: Current weight is retained
+    eq_(weight, 75)
+
+
+def test_weights():
+    # Given: Weights with loads
+    weights = LoadWeights(max_weight=100, min_weight=10)
+    weights.loads = {'node1': 9, 'node2': 29}
+
+    # When: I get the weights for the records
+    result = weights.weights(['node1', 'node2'],
+                             {'node1': MagicMock(weight='100')})
+
+    # Then: Weights keyed by identifier are returned
+    eq_(result, {'node1': 100, 'node2': 67})